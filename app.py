@@ -1,15 +1,13 @@
 import os
 import sys
+import asyncio
 import logging
 import signal
-import pytz
 from datetime import date, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import psutil
 import time
 import threading
-import pendulum
-import traceback
 from datetime import datetime
 
 # Временный обход для импорта keyboards и db
@@ -21,25 +19,41 @@ from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.base import KeyBuilder, StorageKey
 from aiogram.types import Message, CallbackQuery
-from aiogram.exceptions import TelegramAPIError
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request, Header, Depends
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Request, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from sqlalchemy.sql import text
 from sqlalchemy.exc import IntegrityError
-from aiogram.fsm.storage.redis import RedisStorage
-from redis.asyncio.client import Redis
-import hmac
-import hashlib
-import json
-from urllib.parse import parse_qsl, unquote
+import html
+from urllib.parse import unquote
 
 import db
 import keyboards
+import timezones
+import callbacks
+from cache import TwoLevelCache
+from callback_router import CallbackRouter
+from cron_report import CronRunReport
+from cron_shards import CRON_SHARDS, ShardCoordinator
+from dry_run import DRY_RUN_KEY_BUILDER, DryRunBot
+from edit_coalescer import EditCoalescer
+from fsm_context import CachedFSMContextMiddleware
+from fsm_storage import CompactRedisStorage
+from last_seen import LastSeenMiddleware, last_seen_tracker
+from leader import run_as_leader, run_exclusive
+from metrics import registry as metrics_registry
+from redis_pool import create_redis
+from telegram_session import create_session as create_telegram_session
+from update_dedup import UpdateDeduplicator
+from update_queue import UpdateScheduler, WEBHOOK_RETRY_AFTER
+from webapp_auth import InitDataValidator
 
 ADMIN_ID = int(os.getenv("ADMIN_ID")) if os.getenv("ADMIN_ID") else None
 
@@ -63,63 +77,34 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "https://your-frontend-render-url")
 RENDER_URL = os.getenv("RENDER_URL", "").rstrip('/')
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
 WEBHOOK_URL = f"{RENDER_URL}{WEBHOOK_PATH}"
+# webhook - апдейты принимает FastAPI; polling - их забирает polling.py, а API-процесс не трогает вебхук
+BOT_MODE = os.getenv("BOT_MODE", "webhook")
 
 # Инициализация
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(token=BOT_TOKEN, session=create_telegram_session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 REDIS_URL = os.getenv("REDIS_URL")
 if not REDIS_URL:
     raise ValueError("REDIS_URL не установлен в .env или переменных окружения")
 
-redis_client = Redis.from_url(REDIS_URL)
-storage = RedisStorage(redis=redis_client)
-dp = Dispatcher(storage=storage)
-fastapi_app = FastAPI()
-
-logger.info("Initializing database...")
-db.init_db()
-logger.info("Database initialization complete.")
-
-fastapi_app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# --- НОВАЯ ФУНКЦИЯ ВАЛИДАЦИИ INITDATA ---
-def validate_init_data(init_data: str, bot_token: str) -> Optional[Dict]:
-    """
-    Валидирует initData, полученную от Telegram Web App.
-    """
-    try:
-        parsed_data = dict(parse_qsl(init_data))
-        received_hash = parsed_data.pop('hash', None)
-        if not received_hash:
-            return None
-
-        data_check_string = "\n".join(
-            f"{k}={v}" for k, v in sorted(parsed_data.items())
-        )
-
-        secret_key = hmac.new(
-            "WebAppData".encode(), bot_token.encode(), hashlib.sha256
-        ).digest()
-        
-        calculated_hash = hmac.new(
-            secret_key, data_check_string.encode(), hashlib.sha256
-        ).hexdigest()
-
-        if calculated_hash == received_hash:
-            user_data = json.loads(parsed_data.get('user', '{}'))
-            if 'id' not in user_data:
-                return None
-            return user_data
-        
-        return None
-    except Exception as e:
-        logger.error(f"Could not validate initData: {e}")
-        return None
+# Один пул соединений на процесс для FSM, дедупликации, CRON и блокировок
+redis_client = create_redis(REDIS_URL)
+# msgpack-кодирование данных FSM и TTL по группам состояний
+storage = CompactRedisStorage(redis=redis_client)
+# Встроенный FSM-middleware заменён кэширующим: одно чтение и одна запись Redis на апдейт
+dp = Dispatcher(storage=storage, disable_fsm=True)
+dp.fsm = CachedFSMContextMiddleware(storage=storage, events_isolation=dp.fsm.events_isolation, strategy=dp.fsm.strategy)
+dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(LastSeenMiddleware())
+# Все callback-запросы проходят через одну таблицу маршрутов вместо цепочки lambda-фильтров
+callback_router = CallbackRouter()
+dp.callback_query.register(callback_router.handle)
+# Частые перерисовки одного сообщения (утренний опрос) сливаются в одну правку
+edit_coalescer = EditCoalescer()
+# Маршруты собираются в роутер и подключаются в create_app()
+api_router = APIRouter()
+
+# Проверка initData Web App: секрет из BOT_TOKEN вычисляется один раз здесь
+init_data_validator = InitDataValidator(BOT_TOKEN)
 
 # Модели Pydantic для API
 class HistoryDayStats(BaseModel):
@@ -248,7 +233,7 @@ signal.signal(signal.SIGINT, handle_shutdown)
 async def cmd_start(message: Message):
     logger.info(f"Received /start from user_id: {message.from_user.id}")
     try:
-        db.add_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
+        await asyncio.to_thread(db.add_user, message.from_user.id, message.from_user.username, message.from_user.first_name)
         await message.answer(
             "⚔️ Добро пожаловать, командир!\n\n"
             "Используй /menu, чтобы отдать приказ.",
@@ -317,7 +302,32 @@ async def cmd_tips(message: Message, state: FSMContext):
         logger.error(f"Error in /tips for user_id {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "menu_achievements")
+@dp.message(Command("fsm_memory"))
+async def cmd_fsm_memory(message: Message):
+    """Отчёт для администратора: ключи FSM в Redis и занимаемая ими память по группам состояний."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    logger.info("Received /fsm_memory from admin")
+    try:
+        report = await storage.memory_report()
+        if not report:
+            await message.answer("Ключей FSM в Redis нет.")
+            return
+        lines = ["<b>FSM в Redis</b> (группа: состояния / данные, память, без TTL)"]
+        for group, entry in sorted(report.items(), key=lambda item: -item[1]['bytes']):
+            lines.append(
+                f"• {html.escape(group)}: {entry['state_keys']} / {entry['data_keys']}, "
+                f"{entry['bytes'] / 1024:.1f} КБ, без TTL: {entry['no_ttl']}"
+            )
+        total_keys = sum(e['state_keys'] + e['data_keys'] for e in report.values())
+        total_bytes = sum(e['bytes'] for e in report.values())
+        lines.append(f"\nВсего: {total_keys} ключей, {total_bytes / 1024:.1f} КБ")
+        await message.answer("\n".join(lines))
+    except Exception as e:
+        logger.error(f"Error in /fsm_memory: {e}", exc_info=True)
+        await message.answer(f"⚠️ Не удалось собрать отчёт: {html.escape(str(e))}")
+
+@callback_router.exact("menu_achievements")
 async def cq_achievements_menu(callback: CallbackQuery):
     logger.info(f"Received callback menu_achievements from user_id: {callback.from_user.id}")
     try:
@@ -327,7 +337,7 @@ async def cq_achievements_menu(callback: CallbackQuery):
         logger.error(f"Error in menu_achievements for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data == "achievements_view")
+@callback_router.exact("achievements_view")
 async def cq_view_achievements(callback: CallbackQuery):
     logger.info(f"Received callback achievements_view from user_id: {callback.from_user.id}")
     try:
@@ -357,7 +367,7 @@ async def cq_view_achievements(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "achievements_add", StateFilter("*"))
+@callback_router.exact("achievements_add")
 async def cq_add_achievement(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text("Введите дату достижения в формате ДД.ММ.ГГГГ (например, 15.10.2024):", reply_markup=keyboards.get_cancel_keyboard())
@@ -391,14 +401,14 @@ async def achievement_description_chosen(message: Message, state: FSMContext):
             
         date_earned = date.fromisoformat(date_earned_str)
 
-        db.add_sport_achievement(message.from_user.id, achievement_name, date_earned)
+        await asyncio.to_thread(db.add_sport_achievement, message.from_user.id, achievement_name, date_earned)
         await state.clear()
         await message.answer(f"🏆 Достижение '{achievement_name}' ({date_earned.strftime('%d.%m.%Y')}) добавлено!", reply_markup=keyboards.get_achievements_menu_keyboard())
     except Exception as e:
         logger.error(f"Error in achievement_description_chosen for user {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка.")
 
-@dp.callback_query(lambda c: c.data == "menu_goals")
+@callback_router.exact("menu_goals")
 async def cq_goals_menu(callback: CallbackQuery):
     logger.info(f"Received callback menu_goals from user_id: {callback.from_user.id}")
     try:
@@ -408,7 +418,7 @@ async def cq_goals_menu(callback: CallbackQuery):
         logger.error(f"Error in menu_goals for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data == "goals_view")
+@callback_router.exact("goals_view")
 async def cq_view_goals(callback: CallbackQuery):
     logger.info(f"Received callback goals_view from user_id: {callback.from_user.id}")
     try:
@@ -443,7 +453,7 @@ async def cq_view_goals(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "goals_add", StateFilter("*"))
+@callback_router.exact("goals_add")
 async def cq_add_goal(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback goals_add from user_id: {callback.from_user.id}")
     try:
@@ -458,7 +468,7 @@ async def cq_add_goal(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in goals_add for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data.startswith("goal_type_"), StateFilter(SetGoal.choosing_goal_type))
+@callback_router.prefix("goal_type_", state=SetGoal.choosing_goal_type)
 async def goal_type_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Goal type chosen by user_id: {callback.from_user.id}: {callback.data}")
     try:
@@ -505,7 +515,7 @@ async def goal_target_chosen(message: Message, state: FSMContext):
         logger.error(f"Error in goal_target_chosen for user_id {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "goal_confirm", StateFilter(SetGoal.choosing_duration))
+@callback_router.exact("goal_confirm", state=SetGoal.choosing_duration)
 async def goal_duration_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Goal confirmed by user_id: {callback.from_user.id}")
     try:
@@ -519,7 +529,8 @@ async def goal_duration_chosen(callback: CallbackQuery, state: FSMContext):
             return
         start_date = date.today()
         end_date = start_date + timedelta(days=365)  # Цели активны год
-        db.add_goal(
+        await asyncio.to_thread(
+            db.add_goal,
             user_id=callback.from_user.id,
             goal_name=goal_name,
             goal_type=goal_type,
@@ -539,7 +550,7 @@ async def goal_duration_chosen(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in goal_duration_chosen for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data == "menu_habits")
+@callback_router.exact("menu_habits")
 async def cq_habits_menu(callback: CallbackQuery):
     logger.info(f"Received callback menu_habits from user_id: {callback.from_user.id}")
     try:
@@ -549,7 +560,7 @@ async def cq_habits_menu(callback: CallbackQuery):
         logger.error(f"Error in menu_habits for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data == "habits_add", StateFilter("*"))
+@callback_router.exact("habits_add")
 async def cq_add_habit(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback habits_add from user_id: {callback.from_user.id}")
     try:
@@ -569,7 +580,7 @@ async def habit_name_chosen(message: Message, state: FSMContext):
     logger.info(f"Habit name chosen by user_id: {message.from_user.id}: {message.text}")
     try:
         habit_name = message.text.strip()
-        db.add_habit(message.from_user.id, habit_name)
+        await asyncio.to_thread(db.add_habit, message.from_user.id, habit_name)
         await message.answer(
             f"✅ Привычка '{habit_name}' добавлена!",
             reply_markup=types.ReplyKeyboardRemove()
@@ -580,12 +591,12 @@ async def habit_name_chosen(message: Message, state: FSMContext):
         logger.error(f"Error in habit_name_chosen for user_id {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "habits_view")
+@callback_router.exact("habits_view")
 async def cq_view_habits(callback: CallbackQuery):
     logger.info(f"Received callback habits_view from user_id: {callback.from_user.id}")
     try:
         with db.get_db() as db_session:
-            habits = db.get_habits_with_progress(callback.from_user.id)
+            habits = await asyncio.to_thread(db.get_habits_with_progress, callback.from_user.id)
             if not habits:
                 await callback.message.edit_text(
                     "📋 У вас пока нет привычек. Добавьте первую!",
@@ -610,11 +621,11 @@ async def cq_view_habits(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "achievements_delete")
+@callback_router.exact("achievements_delete")
 async def cq_delete_achievements_menu(callback: CallbackQuery):
     logger.info(f"Received callback achievements_delete from user_id: {callback.from_user.id}")
     try:
-        _, total_items = db.get_paginated_achievements(callback.from_user.id, page=1)
+        _, total_items = await asyncio.to_thread(db.get_paginated_achievements, callback.from_user.id, page=1)
         if total_items == 0:
             await callback.message.edit_text(
                 "🏆 У вас пока нет достижений для удаления.",
@@ -637,11 +648,11 @@ async def cq_delete_achievements_menu(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("delete_achievement_"))
+@callback_router.prefix(callbacks.DeleteAchievementCallback)
 async def cq_delete_achievement(callback: CallbackQuery):
     try:
-        achievement_id = int(callback.data.split("_")[-1])
-        db.delete_sport_achievement(callback.from_user.id, achievement_id)
+        achievement_id = callbacks.DeleteAchievementCallback.unpack(callback.data)["achievement_id"]
+        await asyncio.to_thread(db.delete_sport_achievement, callback.from_user.id, achievement_id)
         await callback.answer("🏆 Достижение удалено!", show_alert=True)
         # Обновляем список, вызывая родительский обработчик
         await cq_delete_achievements_menu(callback)
@@ -649,10 +660,10 @@ async def cq_delete_achievement(callback: CallbackQuery):
         logger.error(f"Error deleting achievement: {e}")
         await callback.answer("⚠️ Ошибка при удалении.", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("delete_achievement_page:"))
+@callback_router.prefix(callbacks.DeleteAchievementPageCallback)
 async def cq_delete_achievement_page(callback: CallbackQuery):
     try:
-        page = int(callback.data.split(":")[1])
+        page = callbacks.DeleteAchievementPageCallback.unpack(callback.data)["page"]
         keyboard = keyboards.get_delete_achievements_keyboard(callback.from_user.id, page)
         await callback.message.edit_text(f"Выберите достижение для удаления (Стр. {page}):", reply_markup=keyboard)
         await callback.answer()
@@ -660,13 +671,13 @@ async def cq_delete_achievement_page(callback: CallbackQuery):
         if "message is not modified" not in str(e): logger.error(e)
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "habits_delete")
+@callback_router.exact("habits_delete")
 async def cq_delete_habits_menu(callback: CallbackQuery):
     """
     Показывает пагинированный список привычек для удаления.
     """
     try:
-        _, total_items = db.get_paginated_habits(callback.from_user.id, page=1)
+        _, total_items = await asyncio.to_thread(db.get_paginated_habits, callback.from_user.id, page=1)
         if total_items == 0:
             await callback.message.edit_text(
                 "📋 У вас пока нет привычек для удаления.",
@@ -688,11 +699,11 @@ async def cq_delete_habits_menu(callback: CallbackQuery):
             reply_markup=keyboards.get_habits_menu_keyboard()
         )
 
-@dp.callback_query(lambda c: c.data.startswith("delete_habit_"))
+@callback_router.prefix(callbacks.DeleteHabitCallback)
 async def cq_delete_habit(callback: CallbackQuery):
     try:
-        habit_id = int(callback.data.split("_")[-1])
-        db.delete_habit(callback.from_user.id, habit_id)
+        habit_id = callbacks.DeleteHabitCallback.unpack(callback.data)["habit_id"]
+        await asyncio.to_thread(db.delete_habit, callback.from_user.id, habit_id)
         await callback.answer("✅ Привычка удалена!", show_alert=True)
         # Обновляем список, вызывая родительский обработчик
         await cq_delete_habits_menu(callback)
@@ -700,10 +711,10 @@ async def cq_delete_habit(callback: CallbackQuery):
         logger.error(f"Error deleting habit: {e}")
         await callback.answer("⚠️ Ошибка при удалении.", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("delete_habit_page:"))
+@callback_router.prefix(callbacks.DeleteHabitPageCallback)
 async def cq_delete_habit_page(callback: CallbackQuery):
     try:
-        page = int(callback.data.split(":")[1])
+        page = callbacks.DeleteHabitPageCallback.unpack(callback.data)["page"]
         keyboard = keyboards.get_delete_habits_keyboard(callback.from_user.id, page)
         await callback.message.edit_text(f"Выберите привычку для удаления (Стр. {page}):", reply_markup=keyboard)
         await callback.answer()
@@ -711,13 +722,13 @@ async def cq_delete_habit_page(callback: CallbackQuery):
         if "message is not modified" not in str(e): logger.error(e)
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "goals_delete")
+@callback_router.exact("goals_delete")
 async def cq_delete_goals_menu(callback: CallbackQuery):
     """
     Показывает пагинированный список целей для удаления.
     """
     try:
-        _, total_items = db.get_paginated_goals(callback.from_user.id, page=1)
+        _, total_items = await asyncio.to_thread(db.get_paginated_goals, callback.from_user.id, page=1)
         if total_items == 0:
             await callback.message.edit_text(
                 "🎯 У вас пока нет целей для удаления.",
@@ -739,11 +750,11 @@ async def cq_delete_goals_menu(callback: CallbackQuery):
             reply_markup=keyboards.get_goals_menu_keyboard()
         )
 
-@dp.callback_query(lambda c: c.data.startswith("delete_goal_"))
+@callback_router.prefix(callbacks.DeleteGoalCallback)
 async def cq_delete_goal(callback: CallbackQuery):
     try:
-        goal_id = int(callback.data.split("_")[-1])
-        db.delete_goal(callback.from_user.id, goal_id)
+        goal_id = callbacks.DeleteGoalCallback.unpack(callback.data)["goal_id"]
+        await asyncio.to_thread(db.delete_goal, callback.from_user.id, goal_id)
         await callback.answer("🎯 Цель удалена!", show_alert=True)
         # Обновляем список, вызывая родительский обработчик
         await cq_delete_goals_menu(callback)
@@ -751,10 +762,10 @@ async def cq_delete_goal(callback: CallbackQuery):
         logger.error(f"Error deleting goal: {e}")
         await callback.answer("⚠️ Ошибка при удалении.", show_alert=True)
     
-@dp.callback_query(lambda c: c.data.startswith("delete_goal_page:"))
+@callback_router.prefix(callbacks.DeleteGoalPageCallback)
 async def cq_delete_goal_page(callback: CallbackQuery):
     try:
-        page = int(callback.data.split(":")[1])
+        page = callbacks.DeleteGoalPageCallback.unpack(callback.data)["page"]
         keyboard = keyboards.get_delete_goals_keyboard(callback.from_user.id, page)
         await callback.message.edit_text(f"Выберите цель для удаления (Стр. {page}):", reply_markup=keyboard)
         await callback.answer()
@@ -762,7 +773,7 @@ async def cq_delete_goal_page(callback: CallbackQuery):
         if "message is not modified" not in str(e): logger.error(e)
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "menu_tips", StateFilter("*"))
+@callback_router.exact("menu_tips")
 async def cq_tips_menu(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback menu_tips from user_id: {callback.from_user.id}")
     try:
@@ -774,13 +785,13 @@ async def cq_tips_menu(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in menu_tips for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data.startswith("tip_category_"), StateFilter(TipsSelection.choosing_category))
+@callback_router.prefix(callbacks.TipCategoryCallback, state=TipsSelection.choosing_category)
 async def cq_tip_category_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Tip category chosen by user_id: {callback.from_user.id}: {callback.data}")
     try:
-        category = callback.data.split('_')[2]
+        category = callbacks.TipCategoryCallback.unpack(callback.data)["category"]
         await state.update_data(category=category)
-        tips = db.get_tips_by_category(category)
+        tips = await asyncio.to_thread(db.get_tips_by_category, category)
         if not tips:
             await callback.message.edit_text(
                 f"Советов в категории '{category}' пока нет.",
@@ -798,7 +809,8 @@ async def cq_tip_category_chosen(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in tip_category_chosen for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.", reply_markup=keyboards.get_main_menu_keyboard(include_settings=True))
 
-@dp.callback_query(lambda c: c.data.startswith("tip_") or c.data == "category" or c.data.startswith("tip_category_"), StateFilter(TipsSelection.choosing_tip))
+@callback_router.exact("category", state=TipsSelection.choosing_tip)
+@callback_router.prefix(callbacks.TipCallback, state=TipsSelection.choosing_tip)
 async def cq_tip_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Tip chosen by user_id: {callback.from_user.id}: {callback.data}")
     try:
@@ -813,12 +825,12 @@ async def cq_tip_chosen(callback: CallbackQuery, state: FSMContext):
             await callback.answer()
             return
 
-        if callback.data.startswith('tip_category_'):
+        if callback.data.startswith(callbacks.TipCategoryCallback.prefix):
             # Возвращаем пользователя к списку советов в категории
-            category = callback.data.replace("tip_category_", "")
+            category = callbacks.TipCategoryCallback.unpack(callback.data)["category"]
             logger.debug(f"User {callback.from_user.id} requested tips for category: {category}")
             await state.update_data(category=category)
-            tips = db.get_tips_by_category(category)
+            tips = await asyncio.to_thread(db.get_tips_by_category, category)
             if not tips:
                 logger.warning(f"No tips found for category {category} for user_id {callback.from_user.id}")
                 await callback.message.edit_text(
@@ -837,7 +849,7 @@ async def cq_tip_chosen(callback: CallbackQuery, state: FSMContext):
             return
 
         # Обрабатываем выбор конкретного совета
-        tip_id = int(callback.data.split('_')[1])  # Извлекаем ID из callback_data (tip_<id>)
+        tip_id = callbacks.TipCallback.unpack(callback.data)["tip_id"]
         user_data = await state.get_data()
         category = user_data.get('category')
         if not category:
@@ -849,22 +861,20 @@ async def cq_tip_chosen(callback: CallbackQuery, state: FSMContext):
             await state.set_state(TipsSelection.choosing_category)
             await callback.answer()
             return
-        with db.get_db() as db_session:
-            stmt = text("SELECT tip FROM tips WHERE id = :tip_id")
-            tip = db_session.execute(stmt, {'tip_id': tip_id}).first()
-            if not tip:
-                logger.warning(f"Tip with id {tip_id} not found for user_id {callback.from_user.id}")
-                await callback.message.edit_text(
-                    "Совет не найден.",
-                    reply_markup=keyboards.get_tips_categories_keyboard()
-                )
-                await state.set_state(TipsSelection.choosing_category)
-                await callback.answer()
-                return
+        tip = await asyncio.to_thread(db.get_tip, tip_id)
+        if not tip:
+            logger.warning(f"Tip with id {tip_id} not found for user_id {callback.from_user.id}")
             await callback.message.edit_text(
-                f"💡 {category}: {tip.tip}",
-                reply_markup=keyboards.get_tip_content_keyboard(category)
+                "Совет не найден.",
+                reply_markup=keyboards.get_tips_categories_keyboard()
             )
+            await state.set_state(TipsSelection.choosing_category)
+            await callback.answer()
+            return
+        await callback.message.edit_text(
+            f"💡 {category}: {tip['tip']}",
+            reply_markup=keyboards.get_tip_content_keyboard(category)
+        )
         await state.set_state(TipsSelection.choosing_tip)
         await callback.answer()
     except ValueError as e:
@@ -884,7 +894,7 @@ async def cq_tip_chosen(callback: CallbackQuery, state: FSMContext):
         await state.set_state(TipsSelection.choosing_category)
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "menu_mark_done")
+@callback_router.exact("menu_mark_done")
 async def cq_mark_done_menu(callback: CallbackQuery):
     logger.info(f"Received callback menu_mark_done from user_id: {callback.from_user.id}")
     try:
@@ -895,7 +905,7 @@ async def cq_mark_done_menu(callback: CallbackQuery):
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
 @dp.message(Command("stats"))
-@dp.callback_query(lambda c: c.data == "menu_stats")
+@callback_router.exact("menu_stats")
 async def show_stats(update: Message | CallbackQuery):
     user_id = update.from_user.id if isinstance(update, Message) else update.from_user.id
     logger.info(f"Received stats request from user_id: {user_id}")
@@ -912,7 +922,7 @@ async def show_stats(update: Message | CallbackQuery):
         logger.error(f"Error in stats for user_id {user_id}: {e}")
         await (update if isinstance(update, Message) else update.message).answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "menu_back")
+@callback_router.exact("menu_back")
 async def cq_back_to_menu(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback menu_back from user_id: {callback.from_user.id}")
     try:
@@ -923,20 +933,20 @@ async def cq_back_to_menu(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in menu_back for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data.startswith("done_"))
+@callback_router.prefix(callbacks.DoneActivityCallback)
 async def cq_mark_activity_done(callback: CallbackQuery):
-    activity_type = callback.data.split('_')[1]
+    activity_type = callbacks.DoneActivityCallback.unpack(callback.data)["activity_type"]
     logger.info(f"Marking activity {activity_type} for user_id: {callback.from_user.id}")
     try:
-        db.mark_activity_done(callback.from_user.id, activity_type)
-        db.update_goal_progress(callback.from_user.id, activity_type, 1)
+        await asyncio.to_thread(db.mark_activity_done, callback.from_user.id, activity_type)
+        await asyncio.to_thread(db.update_goal_progress, callback.from_user.id, activity_type, 1)
         await callback.answer(f"✅ {activity_type.capitalize()} засчитано!", show_alert=True)
     except Exception as e:
         logger.error(f"Error marking activity {activity_type} for user_id {callback.from_user.id}: {e}")
         await callback.answer("⚠️ Ошибка. Попробуйте позже.", show_alert=True)
 
 @dp.message(Command("clear_stats"))
-@dp.callback_query(lambda c: c.data == "menu_clear_stats")
+@callback_router.exact("menu_clear_stats")
 async def cmd_clear_stats(update: Message | CallbackQuery):
     user_id = update.from_user.id if isinstance(update, Message) else update.from_user.id
     logger.info(f"Received clear_stats request from user_id: {user_id}")
@@ -951,18 +961,18 @@ async def cmd_clear_stats(update: Message | CallbackQuery):
         logger.error(f"Error in clear_stats for user_id {user_id}: {e}")
         await (update if isinstance(update, Message) else update.message).answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "confirm_clear_yes")
+@callback_router.exact("confirm_clear_yes")
 async def cq_confirm_clear(callback: CallbackQuery):
     logger.info(f"Confirming clear data for user_id: {callback.from_user.id}")
     try:
-        db.clear_user_data(callback.from_user.id)
+        await asyncio.to_thread(db.clear_user_data, callback.from_user.id)
         await callback.message.edit_text("⚔️ Все ваши данные удалены. Начнем с чистого листа. Используй /start")
         await callback.answer()
     except Exception as e:
         logger.error(f"Error clearing data for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data == "confirm_clear_no")
+@callback_router.exact("confirm_clear_no")
 async def cq_cancel_clear(callback: CallbackQuery):
     logger.info(f"Canceling clear data for user_id: {callback.from_user.id}")
     try:
@@ -972,7 +982,7 @@ async def cq_cancel_clear(callback: CallbackQuery):
         logger.error(f"Error in cancel_clear for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data == "fsm_cancel", StateFilter("*"))
+@callback_router.exact("fsm_cancel")
 async def cq_cancel_fsm(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Canceling FSM for user_id: {callback.from_user.id}")
     try:
@@ -992,7 +1002,7 @@ async def cq_cancel_fsm(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
 @dp.message(Command("log"))
-@dp.callback_query(lambda c: c.data == "menu_free_activity")
+@callback_router.exact("menu_free_activity")
 async def cq_free_activity_menu(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     logger.info(f"User {user_id} opened free activity menu.")
@@ -1008,7 +1018,7 @@ async def cq_free_activity_menu(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("⚠️ Ошибка. Попробуйте позже.")
 
 @dp.message(Command("log")) # Оставим команду /log на всякий случай
-@dp.callback_query(lambda c: c.data == "log_activity_start")
+@callback_router.exact("log_activity_start")
 async def cq_start_log_activity(update: Message | CallbackQuery, state: FSMContext):
     user_id = update.from_user.id
     logger.info(f"Starting log activity for user_id: {user_id}")
@@ -1025,7 +1035,7 @@ async def cq_start_log_activity(update: Message | CallbackQuery, state: FSMConte
         logger.error(f"Error in cq_start_log_activity for user_id {user_id}: {e}")
         await message_to_use.answer("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data == "log_activity_delete_menu")
+@callback_router.exact("log_activity_delete_menu")
 async def cq_delete_activity_menu(callback: CallbackQuery, state: FSMContext):
     """Показывает меню выбора типа активности для удаления."""
     user_id = callback.from_user.id
@@ -1056,37 +1066,36 @@ async def show_activities_for_deletion(callback: CallbackQuery, activity_type: s
         )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("delete_activity_type_"))
+@callback_router.prefix(callbacks.DeleteActivityTypeCallback)
 async def cq_delete_activity_type_chosen(callback: CallbackQuery):
     """Показывает список активностей после выбора типа."""
-    activity_type = callback.data.split('_')[-1]
+    activity_type = callbacks.DeleteActivityTypeCallback.unpack(callback.data)["activity_type"]
     await show_activities_for_deletion(callback, activity_type)
 
-@dp.callback_query(lambda c: c.data.startswith("delete_activity_page_"))
+@callback_router.prefix(callbacks.DeleteActivityPageCallback)
 async def cq_delete_activity_page(callback: CallbackQuery):
     """Обрабатывает пагинацию в меню удаления."""
     try:
-        parts = callback.data.split(':')
-        activity_type = parts[0].replace("delete_activity_page_", "")
-        page = int(parts[1])
+        parsed = callbacks.DeleteActivityPageCallback.unpack(callback.data)
+        activity_type, page = parsed["activity_type"], parsed["page"]
         await show_activities_for_deletion(callback, activity_type, page)
     except Exception as e:
         logger.error(f"Error in pagination for activity deletion: {e}")
         await callback.answer("Ошибка пагинации", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("delete_activity_confirm_"))
+@callback_router.prefix(callbacks.DeleteActivityConfirmCallback)
 async def cq_delete_activity_confirm(callback: CallbackQuery):
     """Удаляет выбранную активность и обновляет сообщение."""
     user_id = callback.from_user.id
     try:
-        _, _, activity_type, activity_id_str = callback.data.split('_')
-        activity_id = int(activity_id_str)
+        parsed = callbacks.DeleteActivityConfirmCallback.unpack(callback.data)
+        activity_type, activity_id = parsed["activity_type"], parsed["activity_id"]
 
         if activity_type == "screen":
-            deleted_duration = db.delete_screen_activity(user_id, activity_id)
+            deleted_duration = await asyncio.to_thread(db.delete_screen_activity, user_id, activity_id)
             await callback.answer(f"✅ Не полезная активность удалена ({deleted_duration} мин).", show_alert=True)
         elif activity_type == "productive":
-            db.delete_productive_activity(user_id, activity_id)
+            await asyncio.to_thread(db.delete_productive_activity, user_id, activity_id)
             await callback.answer("✅ Полезная активность удалена.", show_alert=True)
         
         # Обновляем список, чтобы удаленный элемент исчез
@@ -1096,7 +1105,7 @@ async def cq_delete_activity_confirm(callback: CallbackQuery):
         logger.error(f"Error deleting activity: {e}")
         await callback.answer("⚠️ Ошибка при удалении.", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("log_type_"), StateFilter(LogActivity.choosing_type))
+@callback_router.prefix("log_type_", state=LogActivity.choosing_type)
 async def activity_type_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Activity type chosen by user_id: {callback.from_user.id}: {callback.data}")
     try:
@@ -1135,9 +1144,9 @@ async def duration_chosen(message: Message, state: FSMContext):
         activity_type = user_data.get('activity_type', 'screen')
         duration_minutes = int(message.text)
         if activity_type == 'screen':
-            db.log_custom_activity(message.from_user.id, activity_name, duration_minutes)
+            await asyncio.to_thread(db.log_custom_activity, message.from_user.id, activity_name, duration_minutes)
         else:
-            db.log_productive_activity(message.from_user.id, activity_name, duration_minutes)
+            await asyncio.to_thread(db.log_productive_activity, message.from_user.id, activity_name, duration_minutes)
         await message.answer(
             f"Записано: '{activity_name}' - {duration_minutes} мин. ({'Не полезная' if activity_type == 'screen' else 'Полезная'} активность)",
             reply_markup=types.ReplyKeyboardRemove()
@@ -1153,16 +1162,13 @@ async def cmd_morning(message: Message, state: FSMContext):
     logger.info(f"Received /morning from user_id: {message.from_user.id}")
     try:
         user_id = message.from_user.id
-        with db.get_db() as db_session:
-            stmt = text("SELECT morning_poll_completed, is_rest_day FROM daily_stats WHERE user_id = :uid AND stat_date = :today")
-            result = db_session.execute(stmt, {'uid': user_id, 'today': date.today()}).first()
-            db_session.commit()
-            if result and result._asdict()['morning_poll_completed']:
-                await message.answer("☀️ Утренний опрос уже завершен сегодня. Используй /menu для других действий.", reply_markup=types.ReplyKeyboardRemove())
-                return
-            if result and result._asdict()['is_rest_day']:
-                await message.answer("🏖️ Сегодня день отдыха. Хорошего отдыха, командир!", reply_markup=types.ReplyKeyboardRemove())
-                return
+        today_stats = await asyncio.to_thread(db.get_today_stats_for_user, user_id)
+        if today_stats and today_stats['morning_poll_completed']:
+            await message.answer("☀️ Утренний опрос уже завершен сегодня. Используй /menu для других действий.", reply_markup=types.ReplyKeyboardRemove())
+            return
+        if today_stats and today_stats['is_rest_day']:
+            await message.answer("🏖️ Сегодня день отдыха. Хорошего отдыха, командир!", reply_markup=types.ReplyKeyboardRemove())
+            return
         await state.clear()
         await message.answer("☀️ Какой у вас сегодня день?", reply_markup=keyboards.get_morning_day_type_keyboard())
         await state.set_state(MorningPoll.choosing_day_type)
@@ -1170,13 +1176,14 @@ async def cmd_morning(message: Message, state: FSMContext):
         logger.error(f"Error in /morning for user_id {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data.startswith("plan_day_"), StateFilter(MorningPoll.choosing_day_type))
+@callback_router.prefix("plan_day_", state=MorningPoll.choosing_day_type)
 async def day_type_chosen(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Day type chosen by user_id: {callback.from_user.id}: {callback.data}")
     try:
         day_type = callback.data.split('_')[2]
         if day_type == 'rest':
-            db.save_morning_plan(
+            await asyncio.to_thread(
+                db.save_morning_plan,
                 user_id=callback.from_user.id,
                 screen_time=0, workout=0, english=0, coding=0,
                 planning=0, stretching=0, reflection=0, walk=0,
@@ -1212,7 +1219,7 @@ async def day_type_chosen(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in day_type_chosen for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data.startswith("plan_"), StateFilter(MorningPoll.planning_day))
+@callback_router.prefix("plan_", state=MorningPoll.planning_day)
 async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     action = callback.data.split('_')
@@ -1225,6 +1232,7 @@ async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
             'planning': 0, 'stretching': 0, 'reflection': 0, 'walk': 0
         })
 
+        # Отвечаем на нажатие сразу, перерисовка сообщения уходит в EditCoalescer
         if action[1] == 'time':
             time_map = {'2': 120, '3': 180, '4': 240, '5': 300, '6': 360}
             selected_time = action[2]
@@ -1240,13 +1248,14 @@ async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
         await state.update_data(plan=plan)
 
         if action[1] == 'done':
-            final_plan = (await state.get_data()).get('plan')
-            if not final_plan or final_plan['time'] is None:
+            final_plan = plan
+            if final_plan['time'] is None:
                 await callback.answer("Пожалуйста, выберите лимит времени.", show_alert=True)
                 return
             
             try:
-                db.save_morning_plan(
+                await asyncio.to_thread(
+                    db.save_morning_plan,
                     user_id=user_id,
                     screen_time=final_plan['time'],
                     workout=final_plan['workout'],
@@ -1258,17 +1267,20 @@ async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
                     walk=final_plan['walk'],
                     is_rest_day=False
                 )
+                # Ожидающая перерисовка клавиатуры не должна затереть итоговое сообщение
+                await edit_coalescer.cancel(callback.message)
                 await callback.message.edit_text("⚔️ План на день сохранён. Продуктивного дня, командир!")
                 await state.clear()
                 await callback.answer()
                 return
             except Exception as e:
                 logger.error(f"Error saving morning plan for user_id {user_id}: {e}")
+                await edit_coalescer.cancel(callback.message)
                 await callback.message.edit_text("⚠️ Ошибка сохранения плана. Попробуйте позже.")
                 await callback.answer()
                 return
 
-        current_plan = (await state.get_data()).get('plan', {})
+        current_plan = plan
         time_text = f"{current_plan.get('time', 0) // 60}ч" if current_plan.get('time') else "не выбрано"
         activities = [
             f"🏋️ Тренировка: {'✅' if current_plan.get('workout') else '❌'}",
@@ -1280,8 +1292,9 @@ async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
             f"🚶 Прогулка: {'✅' if current_plan.get('walk') else '❌'}"
         ]
         message_text = f"☀️ Составьте план на сегодня:\n\n⏰ Лимит времени: {time_text}\n" + "\n".join(activities)
-        await callback.message.edit_text(message_text, reply_markup=keyboards.get_morning_poll_keyboard(current_plan))
-        await callback.answer()
+        edit_coalescer.schedule(callback.message, message_text, reply_markup=keyboards.get_morning_poll_keyboard(current_plan))
+        if action[1] not in ('time', 'toggle'):
+            await callback.answer()
         
     except TelegramAPIError as e:
         if "message is not modified" in str(e):
@@ -1293,22 +1306,23 @@ async def handle_morning_plan(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in handle_morning_plan for user_id {user_id}: {e}")
         await callback.message.answer("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data.startswith("habit_answer_"), StateFilter(EveningHabitPoll.answering_habit))
+@callback_router.prefix(callbacks.HabitAnswerCallback, state=EveningHabitPoll.answering_habit)
 async def handle_habit_answer(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Habit answer received from user_id: {callback.from_user.id}: {callback.data}")
     try:
         user_id = callback.from_user.id
-        habit_id, answer = callback.data.split('_')[2:4]
+        parsed = callbacks.HabitAnswerCallback.unpack(callback.data)
+        habit_id, answer = parsed["habit_id"], parsed["answer"]
         is_completed = answer == 'yes'
 
         current_data = await state.get_data()
         habit_answers = current_data.get('habit_answers', {})
-        habit_answers[int(habit_id)] = is_completed
+        habit_answers[habit_id] = is_completed
         await state.update_data(habit_answers=habit_answers)
 
         with db.get_db() as db_session:
             stmt = text("SELECT habit_name, id FROM habits WHERE user_id = :uid AND id > :current_id ORDER BY id LIMIT 1")
-            next_habit = db_session.execute(stmt, {'uid': user_id, 'current_id': int(habit_id)}).first()
+            next_habit = db_session.execute(stmt, {'uid': user_id, 'current_id': habit_id}).first()
             
             if next_habit:
                 await callback.message.edit_text(
@@ -1319,7 +1333,7 @@ async def handle_habit_answer(callback: CallbackQuery, state: FSMContext):
             else:
                 final_answers = (await state.get_data()).get('habit_answers', {})
                 for h_id, completed in final_answers.items():
-                    db.log_habit_completion(user_id, h_id, completed)
+                    await asyncio.to_thread(db.log_habit_completion, user_id, h_id, completed)
 
                 await callback.message.edit_text("🌙 Все привычки отмечены! Переходим к целям.")
                 
@@ -1343,22 +1357,23 @@ async def handle_habit_answer(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in handle_habit_answer for user_id {callback.from_user.id}: {e}")
         await callback.message.edit_text("⚠️ Ошибка. Попробуйте позже.")
 
-@dp.callback_query(lambda c: c.data.startswith("goal_answer_"), StateFilter(EveningGoalPoll.answering_goal))
+@callback_router.prefix(callbacks.GoalAnswerCallback, state=EveningGoalPoll.answering_goal)
 async def handle_goal_answer(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Goal answer received from user_id: {callback.from_user.id}: {callback.data}")
     try:
         user_id = callback.from_user.id
-        goal_id, answer = callback.data.split('_')[2:4]
+        parsed = callbacks.GoalAnswerCallback.unpack(callback.data)
+        goal_id, answer = parsed["goal_id"], parsed["answer"]
         is_completed = answer == 'yes'
 
         current_data = await state.get_data()
         goal_answers = current_data.get('goal_answers', {})
-        goal_answers[int(goal_id)] = is_completed
+        goal_answers[goal_id] = is_completed
         await state.update_data(goal_answers=goal_answers)
 
         with db.get_db() as db_session:
             stmt = text("SELECT goal_name, id FROM goals WHERE user_id = :uid AND is_completed = false AND id > :current_id ORDER BY id LIMIT 1")
-            next_goal = db_session.execute(stmt, {'uid': user_id, 'current_id': int(goal_id)}).first()
+            next_goal = db_session.execute(stmt, {'uid': user_id, 'current_id': goal_id}).first()
             
             if next_goal:
                 await callback.message.edit_text(
@@ -1369,9 +1384,9 @@ async def handle_goal_answer(callback: CallbackQuery, state: FSMContext):
             else:
                 final_answers = (await state.get_data()).get('goal_answers', {})
                 for g_id, completed in final_answers.items():
-                    db.log_goal_completion(user_id, g_id, completed)
+                    await asyncio.to_thread(db.log_goal_completion, user_id, g_id, completed)
                     if completed:
-                        db.update_goal_streak(user_id, g_id)
+                        await asyncio.to_thread(db.update_goal_streak, user_id, g_id)
                 
                 await callback.message.edit_text("🌙 Все цели отмечены! Переходим к вопросам продуктивности.")
                 questions = ["Что сегодня мешало быть продуктивным?", "Что дало тебе силу двигаться?", "Что ты сделаешь завтра лучше?"]
@@ -1406,7 +1421,7 @@ async def handle_productivity_answer(message: Message, state: FSMContext):
             # Сохраняем ответы из state в БД
             final_answers = (await state.get_data()).get('productivity_answers', {})
             for question, answer in final_answers.items():
-                db.save_productivity_answer(user_id, question, answer)
+                await asyncio.to_thread(db.save_productivity_answer, user_id, question, answer)
             
             await message.answer(
                 "🌙 Все вопросы продуктивности отмечены! Спасибо за продуктивный день, командир!",
@@ -1417,7 +1432,7 @@ async def handle_productivity_answer(message: Message, state: FSMContext):
         logger.error(f"Error in handle_productivity_answer for user_id {message.from_user.id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "menu_feedback", StateFilter("*"))
+@callback_router.exact("menu_feedback")
 async def start_feedback(callback: CallbackQuery, state: FSMContext):
     """
     Начинает процесс сбора обратной связи.
@@ -1500,7 +1515,7 @@ async def cmd_settings(message: Message):
     logger.info(f"Received /settings from user_id: {user_id}")
     try:
         # ИЗМЕНЕНО: Мы получаем реальный часовой пояс пользователя из БД.
-        current_tz = db.get_user_timezone(user_id)
+        current_tz = await asyncio.to_thread(db.get_user_timezone, user_id)
         
         await message.answer(
             "⚙️ <b>Меню настроек</b>\n\nЗдесь вы можете изменить свой часовой пояс. "
@@ -1512,7 +1527,7 @@ async def cmd_settings(message: Message):
         logger.error(f"Error in /settings for user_id {user_id}: {e}")
         await message.answer("⚠️ Ошибка. Попробуйте позже.", reply_markup=types.ReplyKeyboardRemove())
 
-@dp.callback_query(lambda c: c.data == "menu_help", StateFilter("*"))
+@callback_router.exact("menu_help")
 async def cq_help_menu(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback menu_help from user_id: {callback.from_user.id}")
     try:
@@ -1531,7 +1546,7 @@ async def cq_help_menu(callback: CallbackQuery, state: FSMContext):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_functionality", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_functionality", state=HelpSection.choosing_section)
 async def cq_help_functionality(callback: CallbackQuery):
     logger.info(f"Received callback help_functionality from user_id: {callback.from_user.id}")
     try:
@@ -1555,7 +1570,7 @@ async def cq_help_functionality(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_general", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_general", state=HelpSection.choosing_section)
 async def cq_help_general(callback: CallbackQuery):
     logger.info(f"Received callback help_general from user_id: {callback.from_user.id}")
     try:
@@ -1579,7 +1594,7 @@ async def cq_help_general(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_activities", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_activities", state=HelpSection.choosing_section)
 async def cq_help_activities(callback: CallbackQuery):
     logger.info(f"Received callback help_activities from user_id: {callback.from_user.id}")
     try:
@@ -1604,7 +1619,7 @@ async def cq_help_activities(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_goals", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_goals", state=HelpSection.choosing_section)
 async def cq_help_goals(callback: CallbackQuery):
     logger.info(f"Received callback help_goals from user_id: {callback.from_user.id}")
     try:
@@ -1627,7 +1642,7 @@ async def cq_help_goals(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_tips", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_tips", state=HelpSection.choosing_section)
 async def cq_help_tips(callback: CallbackQuery):
     logger.info(f"Received callback help_tips from user_id: {callback.from_user.id}")
     try:
@@ -1649,7 +1664,7 @@ async def cq_help_tips(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_achievements", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_achievements", state=HelpSection.choosing_section)
 async def cq_help_achievements(callback: CallbackQuery):
     logger.info(f"Received callback help_achievements from user_id: {callback.from_user.id}")
     try:
@@ -1670,7 +1685,7 @@ async def cq_help_achievements(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_habits", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_habits", state=HelpSection.choosing_section)
 async def cq_help_habits(callback: CallbackQuery):
     logger.info(f"Received callback help_habits from user_id: {callback.from_user.id}")
     try:
@@ -1692,7 +1707,7 @@ async def cq_help_habits(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "help_stats", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("help_stats", state=HelpSection.choosing_section)
 async def cq_help_stats(callback: CallbackQuery):
     logger.info(f"Received callback help_stats from user_id: {callback.from_user.id}")
     try:
@@ -1714,7 +1729,7 @@ async def cq_help_stats(callback: CallbackQuery):
         )
         await callback.answer()
 
-@dp.callback_query(lambda c: c.data == "menu_back", StateFilter(HelpSection.choosing_section))
+@callback_router.exact("menu_back", state=HelpSection.choosing_section)
 async def cq_back_from_help(callback: CallbackQuery, state: FSMContext):
     logger.info(f"Received callback menu_back from help for user_id: {callback.from_user.id}")
     try:
@@ -1733,7 +1748,7 @@ async def cq_back_from_help(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
 
 # --- СМЕНА ЧАСОВОГО ПОЯСА ---
-@dp.callback_query(lambda c: c.data.startswith("tz_set_"))
+@callback_router.prefix("tz_set_")
 async def cq_set_timezone(callback: CallbackQuery):
     try:
         # Извлекаем часовой пояс из callback_data (например, "tz_set_Europe/Moscow")
@@ -1741,7 +1756,7 @@ async def cq_set_timezone(callback: CallbackQuery):
         user_id = callback.from_user.id
         
         # Сохраняем в базу данных
-        db.set_user_timezone(user_id, new_timezone)
+        await asyncio.to_thread(db.set_user_timezone, user_id, new_timezone)
         
         # Обновляем клавиатуру настроек, чтобы показать новый выбранный пояс
         new_settings_keyboard = keyboards.get_settings_keyboard(new_timezone)
@@ -1757,13 +1772,13 @@ async def cq_set_timezone(callback: CallbackQuery):
         await callback.answer("⚠️ Ошибка при смене часового пояса.", show_alert=True)
 
 # --- МЕНЮ НАСТРОЕК ---
-@dp.callback_query(lambda c: c.data == "menu_settings")
+@callback_router.exact("menu_settings")
 async def cq_settings_menu(callback: CallbackQuery):
     user_id = callback.from_user.id
     logger.info(f"Received settings menu request from user_id: {user_id}")
     try:
         # Получаем текущий часовой пояс пользователя из БД, чтобы отобразить его
-        current_tz = db.get_user_timezone(user_id)
+        current_tz = await asyncio.to_thread(db.get_user_timezone, user_id)
         
         # Создаем клавиатуру с актуальным часовым поясом
         settings_keyboard = keyboards.get_settings_keyboard(current_tz)
@@ -1795,10 +1810,33 @@ async def verify_cron_secret(x_cron_secret: Optional[str] = Header(None, alias="
         raise HTTPException(status_code=403, detail="Invalid or missing CRON secret.")
 
 # API endpoints
-@fastapi_app.post("/api/stats", response_model=UserStatsResponse)
-async def read_user_stats(x_telegram_init_data: str = Header(..., alias="X-Telegram-Init-Data")):
+# Готовые тела ответа /api/stats по версии данных пользователя. Под одним ключом
+# содержимое не меняется (запись увеличивает версию), поэтому и в памяти процесса
+# оно может жить весь срок кэша
+STATS_RESPONSE_CACHE_TTL = int(os.getenv("STATS_RESPONSE_CACHE_TTL", 3600))
+stats_response_cache = TwoLevelCache(
+    'stats_response',
+    redis=db.cache_redis,
+    l1_ttl=STATS_RESPONSE_CACHE_TTL,
+    l1_size=int(os.getenv("STATS_RESPONSE_CACHE_SIZE", 1000)),
+    encode=lambda body: body,
+    decode=lambda raw: raw,
+)
+
+def stats_etag(user_id: int) -> Optional[str]:
+    """ETag ответа /api/stats: версия данных пользователя и дата (история сдвигается в полночь)."""
+    version = db.data_versions.current(user_id)
+    if version is None:
+        return None
+    return f'W/"{user_id}-{version}-{date.today().isoformat()}"'
+
+@api_router.post("/api/stats", response_model=UserStatsResponse)
+async def read_user_stats(
+    x_telegram_init_data: str = Header(..., alias="X-Telegram-Init-Data"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
     # 1. Валидируем initData
-    user_data_from_telegram = validate_init_data(x_telegram_init_data, BOT_TOKEN)
+    user_data_from_telegram = init_data_validator.validate(x_telegram_init_data)
     
     if user_data_from_telegram is None:
         logger.warning("Failed validation of initData.")
@@ -1807,10 +1845,22 @@ async def read_user_stats(x_telegram_init_data: str = Header(..., alias="X-Teleg
     # 2. Безопасно получаем user_id
     user_id = user_data_from_telegram['id']
     logger.info(f"Validated stats request for user_id: {user_id}")
+
+    # Версия читается до сборки ответа: запись во время сборки даст новый ETag в следующий раз
+    etag = await asyncio.to_thread(stats_etag, user_id)
+    if etag is not None:
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+            metrics_registry.counter('api_stats_not_modified').inc()
+            return Response(status_code=304, headers=headers)
+        # Тело ответа этой версии уже собрано - отдаём байты без запросов к БД и моделей
+        body = await asyncio.to_thread(stats_response_cache.get, etag)
+        if body is not None:
+            return Response(content=body, media_type="application/json", headers=headers)
     
     try:
         # 3. Получаем статистику, как и раньше
-        stats = db.get_full_user_stats(user_id)
+        stats = await asyncio.to_thread(db.get_full_user_stats, user_id)
         if not stats or not stats.get('today_main_stats'):
             raise HTTPException(status_code=404, detail="План на сегодня не найден. Заполните утренний опрос /morning.")
 
@@ -1852,25 +1902,35 @@ async def read_user_stats(x_telegram_init_data: str = Header(..., alias="X-Teleg
             ) for day in stats['history']
         ]
         
-        return UserStatsResponse(
+        stats_response = UserStatsResponse(
             user_id=user_id,
             today=today_data,
             history=history_data,
             goals=stats.get('goals', []),
             habits=stats.get('habits_data', [])
         )
+        if etag is None:
+            return stats_response
+        body = stats_response.model_dump_json().encode()
+        await asyncio.to_thread(stats_response_cache.set, etag, body, STATS_RESPONSE_CACHE_TTL)
+        return Response(content=body, media_type="application/json", headers=headers)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in /api/stats/{user_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера.")
 
-@fastapi_app.api_route("/ping", methods=["GET", "HEAD"])
+@api_router.get("/api/metrics", dependencies=[Depends(verify_cron_secret)])
+async def get_metrics():
+    """Внутрипроцессные метрики: очередь вебхука, задержки обработки и т.п."""
+    return metrics_registry.snapshot()
+
+@api_router.api_route("/ping", methods=["GET", "HEAD"])
 async def handle_ping(request: Request):
     logger.info(f"Received {request.method} /ping request from {request.client.host}")
     return {"status": "ok"}
 
-#@fastapi_app.get("/api/morning/cron", dependencies=[Depends(verify_cron_secret)])
+#@api_router.get("/api/morning/cron", dependencies=[Depends(verify_cron_secret)])
 #async def morning_poll_cron():
 #    logger.info("Running morning poll CRON via GET")
 #    try:
@@ -1905,15 +1965,194 @@ async def handle_ping(request: Request):
 #        logger.error(f"Error in morning poll CRON: {e}")
 #        return {"status": "error", "message": str(e)}
 
-@fastapi_app.get("/api/evening/cron/{timezone_url:path}", dependencies=[Depends(verify_cron_secret)])
-async def evening_summary_cron(timezone_url: str):
-    user_timezone = unquote(timezone_url).replace('-', '/')
-    logger.info(f"Running evening summary CRON for timezone: {user_timezone}")
-    if ADMIN_ID:
+# Размер пачки пользователей для пакетной записи FSM-состояний в Redis
+FSM_BULK_BATCH_SIZE = int(os.getenv("FSM_BULK_BATCH_SIZE", 200))
+
+EVENING_PRODUCTIVITY_QUESTIONS = ["Что сегодня мешало быть продуктивным?", "Что дало тебе силу двигаться?", "Что ты сделаешь завтра лучше?"]
+
+# TTL состояний FSM, созданных пробным прогоном CRON
+DRY_RUN_FSM_TTL = 60
+
+async def bulk_set_fsm_states(
+    entries: List[Tuple[int, State, Dict[str, Any]]],
+    batch_size: int = FSM_BULK_BATCH_SIZE,
+    bot_id: Optional[int] = None,
+    ttl: Optional[int] = None,
+    key_builder: Optional[KeyBuilder] = None,
+    report: Optional[CronRunReport] = None
+) -> List[int]:
+    """
+    Записывает состояние и данные FSM для пачки пользователей одним pipeline (MULTI/EXEC).
+    Данные сливаются с уже сохранёнными, как в update_data: текущие данные пачки читаются
+    одним MGET. Вместо обращений к Redis на каждого пользователя - два на пачку.
+    Ошибка отбрасывает только свою пачку; возвращает user_id, чьё состояние записано.
+    """
+    bot_id = bot.id if bot_id is None else bot_id
+    key_builder = key_builder or storage.key_builder
+    written = []
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+        keys = [StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id) for user_id, _, _ in batch]
+        try:
+            data_keys = [key_builder.build(key, "data") for key in keys]
+            current_data = await redis_client.mget(data_keys)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                for key, data_key, current, (user_id, fsm_state, fsm_data) in zip(keys, data_keys, current_data, batch):
+                    state_ttl = ttl or storage.ttl_for_state(fsm_state)
+                    pipe.set(key_builder.build(key, "state"), fsm_state.state, ex=state_ttl)
+                    merged = {**storage.decode_data(current), **fsm_data} if current else fsm_data
+                    if merged:
+                        pipe.set(data_key, storage.encode_data(merged), ex=state_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to bulk-initialize FSM state for {len(batch)} users: {e}")
+            if report is not None:
+                report.count('fsm_failed', len(batch))
+                report.record_error(None, e)
+            continue
+        written.extend(user_id for user_id, _, _ in batch)
+        logger.debug(f"Bulk-initialized FSM state for {len(batch)} users")
+    return written
+
+async def bulk_clear_fsm_states(
+    user_ids: List[int],
+    batch_size: int = FSM_BULK_BATCH_SIZE,
+    bot_id: Optional[int] = None,
+    key_builder: Optional[KeyBuilder] = None,
+    report: Optional[CronRunReport] = None
+):
+    """Сбрасывает состояние и данные FSM пачки пользователей (опрос, который до них не дошёл)."""
+    bot_id = bot.id if bot_id is None else bot_id
+    key_builder = key_builder or storage.key_builder
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        keys = []
+        for user_id in batch:
+            key = StorageKey(bot_id=bot_id, chat_id=user_id, user_id=user_id)
+            keys.extend((key_builder.build(key, "state"), key_builder.build(key, "data")))
+        try:
+            await redis_client.delete(*keys)
+        except Exception as e:
+            logger.error(f"Failed to clear FSM state for {len(batch)} users: {e}")
+            if report is not None:
+                report.record_error(None, e)
+
+def build_evening_summary(stats: Dict[str, Any], time_actual: int, report_time: str) -> str:
+    """Формирует текст вечернего отчёта по статистике за сегодня."""
+    time_goal = stats.get('screen_time_goal', 0)
+    time_status = "✅ В пределах лимита!" if time_actual <= time_goal else "❌ Превышен лимит!"
+
+    summary_lines = [
+        f"🌙 Вечерний отчёт на {report_time}, командир:\n",
+        f"📱 Экранное время: ~{round(time_actual / 60, 1)}ч из {time_goal // 60}ч ({time_status})\n"
+    ]
+
+    def get_status(planned_key, done_key):
+        planned = stats.get(planned_key, 0)
+        done = stats.get(done_key, 0)
+        return "не запланировано" if not planned else ("✅ Выполнено!" if done else "❌ Пропущено")
+
+    summary_lines.extend([
+        f"⚔️ Тренировка: {get_status('workout_planned', 'workout_done')}",
+        f"🎓 Язык: {get_status('english_planned', 'english_done')}",
+        f"💻 Программирование: {get_status('coding_planned', 'coding_done')}",
+        f"📝 Планирование: {get_status('planning_planned', 'planning_done')}",
+        f"🧘 Растяжка: {get_status('stretching_planned', 'stretching_done')}",
+        f"🤔 Размышление: {get_status('reflection_planned', 'reflection_done')}",
+        f"🚶 Прогулка: {get_status('walk_planned', 'walk_done')}"
+    ])
+    return "\n".join(summary_lines)
+
+def build_evening_poll(db_session, user_id: int) -> Tuple[State, Dict[str, Any], str, types.InlineKeyboardMarkup]:
+    """
+    Определяет, с какого шага начинается вечерний опрос пользователя:
+    привычки, цели или вопросы продуктивности.
+    Возвращает (состояние FSM, данные FSM, текст первого вопроса, клавиатура).
+    """
+    first_habit = db_session.execute(text("SELECT habit_name, id FROM habits WHERE user_id = :uid ORDER BY id LIMIT 1"), {'uid': user_id}).first()
+    if first_habit:
+        return (
+            EveningHabitPoll.answering_habit,
+            {'habit_answers': {}},
+            f"📋 Выполнили ли вы привычку '{first_habit.habit_name}' сегодня?",
+            keyboards.get_habit_answer_keyboard(first_habit.id)
+        )
+
+    first_goal = db_session.execute(text("SELECT id, goal_name FROM goals WHERE user_id = :uid AND is_completed = false ORDER BY id LIMIT 1"), {'uid': user_id}).first()
+    if first_goal:
+        return (
+            EveningGoalPoll.answering_goal,
+            {'goal_answers': {}},
+            f"🎯 Выполнили ли вы цель '{first_goal.goal_name}' сегодня?",
+            keyboards.get_goal_answer_keyboard(first_goal.id)
+        )
+
+    questions = list(EVENING_PRODUCTIVITY_QUESTIONS)
+    return (
+        ProductivityPoll.answering_question,
+        {'current_question_idx': 0, 'questions': questions, 'productivity_answers': {}},
+        questions[0],
+        keyboards.get_cancel_keyboard()
+    )
+
+def is_chat_unreachable(error: TelegramAPIError) -> bool:
+    """
+    Пользователь заблокировал бота, удалил аккаунт или чат не существует -
+    повторять отправку бессмысленно.
+    """
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+
+def deactivate_unreachable_users(user_ids: List[int], report: CronRunReport):
+    """Одним запросом исключает недоступных пользователей из следующих CRON-рассылок."""
+    if not user_ids:
+        return
+    try:
+        with report.phase('db'):
+            db.deactivate_users(user_ids)
+        report.count('deactivated', len(user_ids))
+    except Exception as e:
+        report.record_error(None, e)
+
+async def send_cron_report(report: CronRunReport):
+    """Отправляет администратору одно итоговое сообщение о запуске CRON-задачи."""
+    logger.info(f"CRON report: {report.to_dict()}")
+    if not ADMIN_ID:
+        return
+    try:
+        await bot.send_message(ADMIN_ID, report.format_summary())
+    except Exception as admin_send_error:
+        logger.error(f"COULD NOT SEND CRON REPORT TO ADMIN: {admin_send_error}")
+
+# Сколько раз повторять отправку после ответа 429 (flood control)
+CRON_SEND_MAX_RETRIES = int(os.getenv("CRON_SEND_MAX_RETRIES", 2))
+
+async def send_with_retry(target_bot, report: CronRunReport, chat_id: int, text: str, **kwargs):
+    """Отправляет сообщение, выжидая retry_after при ответе 429."""
+    for attempt in range(CRON_SEND_MAX_RETRIES + 1):
         try:
-            now_almaty = datetime.now(pytz.timezone('Asia/Almaty')).strftime('%H:%M:%S')
-            await bot.send_message(ADMIN_ID, f"🌙 Запущена вечерняя сводка ({now_almaty})...")
-        except Exception: pass # Игнорируем ошибку, если не удалось отправить
+            return await target_bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            report.count('rate_limited')
+            if attempt == CRON_SEND_MAX_RETRIES:
+                raise
+            logger.warning(f"Rate limited while sending to {chat_id}, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+
+async def run_evening_summary(
+    user_timezone: str,
+    target_bot,
+    report: CronRunReport,
+    dry_run: bool = False,
+    shard: int = 0,
+    shards: int = 1
+) -> Dict[str, Any]:
+    """
+    Вечерняя сводка для когорты часового пояса (или её шарда user_id % shards == shard).
+    target_bot - настоящий Bot или DryRunBot; в пробном прогоне не выдаются достижения,
+    не деактивируются пользователи, а состояния FSM пишутся с коротким TTL под отдельным префиксом.
+    """
     try:
         # Контекстный менеджер для сессии БД
         with db.get_db() as db_session:
@@ -1922,245 +2161,374 @@ async def evening_summary_cron(timezone_url: str):
                 SELECT u.user_id, u.timezone, ds.is_rest_day 
                 FROM users u 
                 JOIN daily_stats ds ON u.user_id = ds.user_id 
-                WHERE ds.stat_date = :today AND u.timezone = :tz
+                WHERE ds.stat_date = :today AND u.timezone = :tz AND u.is_active
+                  AND mod(u.user_id, :shards) = :shard
             """)
-            users = db_session.execute(stmt, {'today': date.today(), 'tz': user_timezone}).fetchall()
+            with report.phase('db'):
+                users = db_session.execute(
+                    stmt, {'today': date.today(), 'tz': user_timezone, 'shards': shards, 'shard': shard}
+                ).fetchall()
+            report.count('cohort', len(users))
             
             if not users:
                 logger.warning("No users with stats for today found for evening cron")
+                report.finish("skipped")
                 return {"status": "skipped", "message": "No users with stats for today"}
 
+            report_time = timezones.local_now(user_timezone).strftime('%H:%M')
+
+            # Шаг 1: готовим отчёты и первый вопрос опроса для всей когорты
+            prepared = []
             for user in users:
+                user_id = user.user_id
                 try:
-                    user_id = user.user_id
-                    if user.is_rest_day:
-                        continue
-                    
                     if user.is_rest_day:
-                        # await bot.send_message(user_id, "🌙 Хорошего вечера в день отдыха, командир!")
                         logger.info(f"Skipping evening poll for user {user_id} on rest day.")
-                        continue
-                        
-                    stats = db.get_today_stats_for_user(user_id)
-                    if not stats:
-                        logger.info(f"No stats found for user {user_id} in evening cron")
+                        report.count('skipped_rest_day')
                         continue
 
-                    now = pendulum.now(user_timezone)
-                    time_actual = db.get_today_screen_time(user_id)
-                    time_goal = stats.get('screen_time_goal', 0)
-                    time_status = "✅ В пределах лимита!" if time_actual <= time_goal else "❌ Превышен лимит!"
-                    
-                    report_time = now.strftime('%H:%M')
-                    summary_lines = [
-                        f"🌙 Вечерний отчёт на {report_time}, командир:\n",
-                        f"📱 Экранное время: ~{round(time_actual / 60, 1)}ч из {time_goal // 60}ч ({time_status})\n"
-                    ]
-                    
-                    def get_status(planned_key, done_key):
-                        planned = stats.get(planned_key, 0)
-                        done = stats.get(done_key, 0)
-                        return "не запланировано" if not planned else ("✅ Выполнено!" if done else "❌ Пропущено")
-
-                    summary_lines.extend([
-                        f"⚔️ Тренировка: {get_status('workout_planned', 'workout_done')}",
-                        f"🎓 Язык: {get_status('english_planned', 'english_done')}",
-                        f"💻 Программирование: {get_status('coding_planned', 'coding_done')}",
-                        f"📝 Планирование: {get_status('planning_planned', 'planning_done')}",
-                        f"🧘 Растяжка: {get_status('stretching_planned', 'stretching_done')}",
-                        f"🤔 Размышление: {get_status('reflection_planned', 'reflection_done')}",
-                        f"🚶 Прогулка: {get_status('walk_planned', 'walk_done')}"
-                    ])
-
-                    await bot.send_message(user_id, "\n".join(summary_lines))
-                    db.check_and_award_achievements(user_id)
-                    
-                    state = FSMContext(storage=dp.storage, key=StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id))
-                    
-                    first_habit = db_session.execute(text("SELECT habit_name, id FROM habits WHERE user_id = :uid ORDER BY id LIMIT 1"), {'uid': user_id}).first()
-                    if first_habit:
-                        await state.set_state(EveningHabitPoll.answering_habit)
-                        await state.update_data(habit_answers={})
-                        await bot.send_message(
-                            user_id,
-                            f"📋 Выполнили ли вы привычку '{first_habit.habit_name}' сегодня?",
-                            reply_markup=keyboards.get_habit_answer_keyboard(first_habit.id)
-                        )
-                    else:
-                        first_goal = db_session.execute(text("SELECT id, goal_name FROM goals WHERE user_id = :uid AND is_completed = false ORDER BY id LIMIT 1"), {'uid': user_id}).first()
-                        if first_goal:
-                            await state.set_state(EveningGoalPoll.answering_goal)
-                            await state.update_data(goal_answers={})
-                            await bot.send_message(
-                                user_id,
-                                f"🎯 Выполнили ли вы цель '{first_goal.goal_name}' сегодня?",
-                                reply_markup=keyboards.get_goal_answer_keyboard(first_goal.id)
-                            )
-                        else:
-                            questions = ["Что сегодня мешало быть продуктивным?", "Что дало тебе силу двигаться?", "Что ты сделаешь завтра лучше?"]
-                            await state.set_state(ProductivityPoll.answering_question)
-                            await state.update_data(current_question_idx=0, questions=questions, productivity_answers={})
-                            await bot.send_message(user_id, questions[0], reply_markup=keyboards.get_cancel_keyboard())
-                    
+                    with report.phase('db'):
+                        stats = await asyncio.to_thread(db.get_today_stats_for_user, user_id)
+                        if not stats:
+                            logger.info(f"No stats found for user {user_id} in evening cron")
+                            report.count('skipped_no_stats')
+                            continue
+                        time_actual = await asyncio.to_thread(db.get_today_screen_time, user_id)
+                        poll_state, poll_data, poll_text, poll_markup = build_evening_poll(db_session, user_id)
+                    summary_text = build_evening_summary(stats, time_actual, report_time)
+                    prepared.append((user_id, summary_text, poll_state, poll_data, poll_text, poll_markup))
+                except Exception as e:
+                    logger.error(f"CRON JOB FAILED for user {user_id}: {e}", exc_info=True)
+                    report.record_error(user_id, e)
+
+            # Шаг 2: одним pipeline на пачку выставляем состояния опроса в Redis.
+            # Состояние пишется до отправки, чтобы ответ на опрос не обогнал его
+            fsm_key_builder = DRY_RUN_KEY_BUILDER if dry_run else None
+            with report.phase('redis'):
+                written = set(await bulk_set_fsm_states(
+                    [(user_id, poll_state, poll_data) for user_id, _, poll_state, poll_data, _, _ in prepared],
+                    bot_id=target_bot.id,
+                    ttl=DRY_RUN_FSM_TTL if dry_run else None,
+                    key_builder=fsm_key_builder,
+                    report=report
+                ))
+
+            # Шаг 3: рассылка; кому опрос не дошёл, тому состояние опроса сбрасывается
+            unreachable = []
+            not_delivered = []
+            for user_id, summary_text, poll_state, poll_data, poll_text, poll_markup in prepared:
+                if user_id not in written:
+                    continue
+                try:
+                    with report.timed_send():
+                        await send_with_retry(target_bot, report, user_id, summary_text)
+                    if not dry_run:
+                        with report.phase('db'):
+                            await asyncio.to_thread(db.check_and_award_achievements, user_id)
+                    with report.timed_send():
+                        await send_with_retry(target_bot, report, user_id, poll_text, reply_markup=poll_markup)
+                    report.count('sent')
                     logger.info(f"Sent evening summary and started poll for user_id: {user_id}")
-                
                 except TelegramAPIError as e:
+                    not_delivered.append(user_id)
+                    if is_chat_unreachable(e):
+                        logger.info(f"User {user_id} is unreachable, deactivating: {e}")
+                        unreachable.append(user_id)
+                        continue
                     logger.error(f"Failed to send evening summary to user_id {user_id}: {e}")
+                    report.count('send_failed')
+                    report.record_error(user_id, e)
                 except Exception as e:
-                     logger.error(f"CRON JOB FAILED for user {user_id}: {e}", exc_info=True)
-                     if ADMIN_ID:
-                        # Формируем детальное сообщение об ошибке
-                        error_message = (
-                            f"‼️ <b>Сбой в вечерней CRON-задаче!</b>\n\n"
-                            f"<b>Пользователь:</b> <code>{user_id}</code>\n"
-                            f"<b>Ошибка:</b> <code>{e}</code>\n\n"
-                            f"<b>Traceback:</b>\n<pre>{traceback.format_exc()}</pre>"
-                        )
-                        # Пытаемся отправить сообщение администратору
-                        try:
-                            await bot.send_message(ADMIN_ID, error_message)
-                        except Exception as admin_send_error:
-                            logger.error(f"COULD NOT SEND CRON ERROR TO ADMIN: {admin_send_error}")
+                    not_delivered.append(user_id)
+                    logger.error(f"CRON JOB FAILED for user {user_id}: {e}", exc_info=True)
+                    report.record_error(user_id, e)
+            with report.phase('redis'):
+                await bulk_clear_fsm_states(
+                    not_delivered, bot_id=target_bot.id, key_builder=fsm_key_builder, report=report
+                )
+            if not dry_run:
+                deactivate_unreachable_users(unreachable, report)
 
         # `commit` не нужен, так как мы только читаем данные, но если бы писали - он был бы здесь
-        return {"status": "finished"}
+        report.finish()
+        return {"status": "finished", "report": report.to_dict()}
 
     except Exception as e:
         logger.error(f"Error in evening summary CRON task: {e}")
         # `rollback` здесь не нужен, так как он обрабатывается в `get_db`
+        report.record_error(None, e)
+        report.finish("error")
         return {"status": "error", "message": str(e)}
 
-@fastapi_app.get("/api/streaks/reset/cron", dependencies=[Depends(verify_cron_secret)])
+@api_router.get("/api/evening/cron/{timezone_url:path}", dependencies=[Depends(verify_cron_secret)])
+async def evening_summary_cron(
+    timezone_url: str,
+    dry_run: bool = False,
+    dry_run_latency_ms: int = 0,
+    dry_run_rate_limit_every: int = 0,
+    dry_run_retry_after: int = 1
+):
+    user_timezone = unquote(timezone_url).replace('-', '/')
+    if dry_run:
+        # Пробный прогон: весь конвейер, но сообщения уходят в заглушку вместо Telegram
+        logger.info(f"Running evening summary CRON (dry run) for timezone: {user_timezone}")
+        fake_bot = DryRunBot(
+            latency_ms=dry_run_latency_ms,
+            rate_limit_every=dry_run_rate_limit_every,
+            retry_after=dry_run_retry_after
+        )
+        report = CronRunReport(f"вечерняя сводка {user_timezone} (dry run)")
+        result = await run_evening_summary(user_timezone, fake_bot, report, dry_run=True)
+        sent = report.counts.get('sent', 0)
+        result.update({
+            "dry_run": fake_bot.summary(),
+            "report": report.to_dict(),
+            "throughput_users_per_s": round(sent / report.duration, 2) if report.duration else 0.0,
+        })
+        return result
+
+    if CRON_SHARDS > 1:
+        return await dispatch_sharded_cron('evening', user_timezone, f"вечерняя сводка {user_timezone}")
+
+    logger.info(f"Running evening summary CRON for timezone: {user_timezone}")
+    report = CronRunReport(f"вечерняя сводка {user_timezone}")
+    try:
+        return await run_evening_summary(user_timezone, bot, report)
+    finally:
+        await send_cron_report(report)
+
+@api_router.get("/api/streaks/reset/cron", dependencies=[Depends(verify_cron_secret)])
 async def daily_streaks_reset_cron():
     logger.info("Running daily streaks reset CRON")
-    if ADMIN_ID:
-        try:
-            now_almaty = datetime.now(pytz.timezone('Asia/Almaty')).strftime('%H:%M:%S')
-            await bot.send_message(ADMIN_ID, f"🔥 Запущен сброс стриков ({now_almaty})...")
-        except Exception: pass
+    report = CronRunReport("сброс стриков")
     try:
-        db.reset_missed_streaks()
+        with report.phase('db'):
+            await asyncio.to_thread(db.reset_missed_streaks, tier='active')
+        report.finish()
         return {"status": "ok", "message": "Streaks reset successfully."}
     except Exception as e:
         logger.error(f"Error in daily streaks reset CRON: {e}", exc_info=True)
-        if ADMIN_ID:
-            error_message = (f"‼️ <b>Сбой в СБРОСЕ СТРИКОВ!</b>...\n<pre>{traceback.format_exc()}</pre>")
-            await bot.send_message(ADMIN_ID, error_message)
+        report.record_error(None, e)
+        report.finish("error")
         return {"status": "error", "message": str(e)}
+    finally:
+        await send_cron_report(report)
     
-@fastapi_app.get("/api/afternoon/cron/{timezone_url:path}", dependencies=[Depends(verify_cron_secret)])
-async def afternoon_reminder_cron(timezone_url: str):
-    user_timezone = unquote(timezone_url).replace('-', '/')
-    logger.info(f"Running afternoon reminder CRON for timezone: {user_timezone}")
-    if ADMIN_ID:
-        try:
-            now_almaty = datetime.now(pytz.timezone('Asia/Almaty')).strftime('%H:%M:%S')
-            await bot.send_message(ADMIN_ID, f"☀️ Запущено дневное напоминание ({now_almaty})...")
-        except Exception:
-            pass
-
+async def run_afternoon_reminder(user_timezone: str, report: CronRunReport, shard: int = 0, shards: int = 1) -> Dict[str, Any]:
+    """Дневное напоминание для когорты часового пояса (или её шарда user_id % shards == shard)."""
     try:
         with db.get_db() as db_session:
             stmt = text("""
                 SELECT u.user_id, u.timezone, ds.is_rest_day, ds.morning_poll_completed 
                 FROM users u 
                 JOIN daily_stats ds ON u.user_id = ds.user_id 
-                WHERE ds.stat_date = :today AND u.timezone = :tz
+                WHERE ds.stat_date = :today AND u.timezone = :tz AND u.is_active
+                  AND mod(u.user_id, :shards) = :shard
             """)
-            users = db_session.execute(stmt, {'today': date.today(), 'tz': user_timezone}).fetchall()
+            with report.phase('db'):
+                users = db_session.execute(
+                    stmt, {'today': date.today(), 'tz': user_timezone, 'shards': shards, 'shard': shard}
+                ).fetchall()
+            report.count('cohort', len(users))
             if not users:
                 logger.info(f"No users to remind in timezone {user_timezone}")
+                report.finish("skipped")
                 return {"status": "skipped", "message": "No users with stats for today"}
 
+            unreachable = []
             for user in users:
                 user_id = user.user_id
-                if user.is_rest_day or not user.morning_poll_completed:
-                    continue
-
                 if user.is_rest_day:
                     logger.info(f"Skipping afternoon reminder for user_id: {user_id}, rest day")
+                    report.count('skipped_rest_day')
                     continue
                 if not user.morning_poll_completed:
                     logger.info(f"Skipping afternoon reminder for user_id: {user_id}, morning poll not completed")
+                    report.count('skipped_no_morning_poll')
                     continue
 
-                # Check for planned activities, habits, and goals
-                activities_planned = False
-                habits_exist = False
-                goals_exist = False
-
-                # Check planned activities
-                stats = db.get_today_stats_for_user(user_id)
-                if stats and any([
-                    stats['workout_planned'], stats['english_planned'], stats['coding_planned'],
-                    stats['planning_planned'], stats['stretching_planned'], stats['reflection_planned'],
-                    stats['walk_planned']
-                ]):
-                    activities_planned = True
-
-                # Check habits
-                habit_stmt = text("SELECT id FROM habits WHERE user_id = :uid LIMIT 1")
-                if db_session.execute(habit_stmt, {'uid': user_id}).first():
-                    habits_exist = True
-
-                # Check active goals
-                goal_stmt = text("SELECT id FROM goals WHERE user_id = :uid AND is_completed = false LIMIT 1")
-                if db_session.execute(goal_stmt, {'uid': user_id}).first():
-                    goals_exist = True
-
-                if not (activities_planned or habits_exist or goals_exist):
-                    logger.info(f"Skipping afternoon reminder for user_id: {user_id}, no activities, habits, or goals")
-                    continue
+                try:
+                    # Check for planned activities, habits, and goals
+                    activities_planned = False
+                    habits_exist = False
+                    goals_exist = False
+
+                    with report.phase('db'):
+                        # Check planned activities
+                        stats = await asyncio.to_thread(db.get_today_stats_for_user, user_id)
+                        if stats and any([
+                            stats['workout_planned'], stats['english_planned'], stats['coding_planned'],
+                            stats['planning_planned'], stats['stretching_planned'], stats['reflection_planned'],
+                            stats['walk_planned']
+                        ]):
+                            activities_planned = True
+
+                        # Check habits
+                        habit_stmt = text("SELECT id FROM habits WHERE user_id = :uid LIMIT 1")
+                        if db_session.execute(habit_stmt, {'uid': user_id}).first():
+                            habits_exist = True
+
+                        # Check active goals
+                        goal_stmt = text("SELECT id FROM goals WHERE user_id = :uid AND is_completed = false LIMIT 1")
+                        if db_session.execute(goal_stmt, {'uid': user_id}).first():
+                            goals_exist = True
+
+                    if not (activities_planned or habits_exist or goals_exist):
+                        logger.info(f"Skipping afternoon reminder for user_id: {user_id}, no activities, habits, or goals")
+                        report.count('skipped_nothing_planned')
+                        continue
 
-                # Form reminder text
-                reminder_lines = [
-                    "🔔 Напоминание, командир!",
-                    "Не забудьте отметить выполнение ваших задач за сегодня:"
-                ]
-                if activities_planned:
-                    reminder_lines.append("• Активности (тренировка, язык, программирование и др.)")
-                if habits_exist:
-                    reminder_lines.append("• Привычки")
-                if goals_exist:
-                    reminder_lines.append("• Цели")
-                reminder_lines.append("\nИспользуйте /menu чтобы отметить выполнение!")
-
-                await bot.send_message(
-                    user_id,
-                    "\n".join(reminder_lines),
-                    reply_markup=keyboards.get_main_menu_keyboard(include_settings=True)
-                )
-                logger.info(f"Sent afternoon reminder to user_id: {user_id}")
+                    # Form reminder text
+                    reminder_lines = [
+                        "🔔 Напоминание, командир!",
+                        "Не забудьте отметить выполнение ваших задач за сегодня:"
+                    ]
+                    if activities_planned:
+                        reminder_lines.append("• Активности (тренировка, язык, программирование и др.)")
+                    if habits_exist:
+                        reminder_lines.append("• Привычки")
+                    if goals_exist:
+                        reminder_lines.append("• Цели")
+                    reminder_lines.append("\nИспользуйте /menu чтобы отметить выполнение!")
+
+                    with report.timed_send():
+                        await bot.send_message(
+                            user_id,
+                            "\n".join(reminder_lines),
+                            reply_markup=keyboards.get_main_menu_keyboard(include_settings=True)
+                        )
+                    report.count('sent')
+                    logger.info(f"Sent afternoon reminder to user_id: {user_id}")
+                except TelegramAPIError as e:
+                    if is_chat_unreachable(e):
+                        logger.info(f"User {user_id} is unreachable, deactivating: {e}")
+                        unreachable.append(user_id)
+                        continue
+                    logger.error(f"Failed to send afternoon reminder to user_id {user_id}: {e}")
+                    report.count('send_failed')
+                    report.record_error(user_id, e)
+            deactivate_unreachable_users(unreachable, report)
 
-        return {"status": "sent"}
+        report.finish()
+        return {"status": "sent", "report": report.to_dict()}
     except Exception as e:
         logger.error(f"Error in afternoon reminder CRON: {e}", exc_info=True)
-        if ADMIN_ID:
-            error_message = (f"‼️ <b>Сбой в ДНЕВНОМ НАПОМИНАНИИ!</b>...\n<pre>{traceback.format_exc()}</pre>")
-            await bot.send_message(ADMIN_ID, error_message)
+        report.record_error(None, e)
+        report.finish("error")
         return {"status": "error", "message": str(e)}
+
+@api_router.get("/api/afternoon/cron/{timezone_url:path}", dependencies=[Depends(verify_cron_secret)])
+async def afternoon_reminder_cron(timezone_url: str):
+    user_timezone = unquote(timezone_url).replace('-', '/')
+    if CRON_SHARDS > 1:
+        return await dispatch_sharded_cron('afternoon', user_timezone, f"дневное напоминание {user_timezone}")
+
+    logger.info(f"Running afternoon reminder CRON for timezone: {user_timezone}")
+    report = CronRunReport(f"дневное напоминание {user_timezone}")
+    try:
+        return await run_afternoon_reminder(user_timezone, report)
+    finally:
+        await send_cron_report(report)
     
-@fastapi_app.get("/api/daily_reset/cron", dependencies=[Depends(verify_cron_secret)])
+@api_router.get("/api/daily_reset/cron", dependencies=[Depends(verify_cron_secret)])
 async def daily_reset_cron():
     logger.info("Running daily goals reset CRON via GET")
-    if ADMIN_ID:
-        try:
-            now_almaty = datetime.now(pytz.timezone('Asia/Almaty')).strftime('%H:%M:%S')
-            await bot.send_message(ADMIN_ID, f"🔄 Запущен ежедневный сброс целей ({now_almaty})...")
-        except Exception: pass
+    report = CronRunReport("ежедневный сброс целей")
     try:
-        db.reset_goals()
+        with report.phase('db'):
+            await asyncio.to_thread(db.reset_goals, tier='active')
+        report.finish()
         return {"status": "ok", "message": "Goals progress reset successfully."}
     except Exception as e:
         logger.error(f"Error in daily goals reset CRON: {e}", exc_info=True)
-        if ADMIN_ID:
-            error_message = (f"‼️ <b>Сбой в ЕЖЕДНЕВНОМ СБРОСЕ!</b>...\n<pre>{traceback.format_exc()}</pre>")
-            await bot.send_message(ADMIN_ID, error_message)
+        report.record_error(None, e)
+        report.finish("error")
         return {"status": "error", "message": str(e)}
+    finally:
+        await send_cron_report(report)
+
+@api_router.get("/api/dormant/weekly/cron", dependencies=[Depends(verify_cron_secret)])
+async def dormant_weekly_cron():
+    """
+    Низкоприоритетный еженедельный проход по спящим пользователям:
+    ежедневные задачи сброса обрабатывают только активных.
+    """
+    logger.info("Running weekly dormant users CRON")
+    report = CronRunReport("еженедельный проход по спящим")
+    try:
+        with report.phase('db'):
+            await asyncio.to_thread(db.reset_missed_streaks, tier='dormant')
+            await asyncio.to_thread(db.reset_goals, tier='dormant')
+        report.finish()
+        return {"status": "ok", "message": "Dormant users processed successfully."}
+    except Exception as e:
+        logger.error(f"Error in weekly dormant CRON: {e}", exc_info=True)
+        report.record_error(None, e)
+        report.finish("error")
+        return {"status": "error", "message": str(e)}
+    finally:
+        await send_cron_report(report)
+
+async def evening_summary_shard(user_timezone: str, shard: int, shards: int) -> CronRunReport:
+    report = CronRunReport(f"вечерняя сводка {user_timezone} [{shard + 1}/{shards}]")
+    await run_evening_summary(user_timezone, bot, report, shard=shard, shards=shards)
+    return report
+
+async def afternoon_reminder_shard(user_timezone: str, shard: int, shards: int) -> CronRunReport:
+    report = CronRunReport(f"дневное напоминание {user_timezone} [{shard + 1}/{shards}]")
+    await run_afternoon_reminder(user_timezone, report, shard=shard, shards=shards)
+    return report
+
+cron_coordinator = ShardCoordinator(
+    redis_client,
+    handlers={
+        'evening': evening_summary_shard,
+        'afternoon': afternoon_reminder_shard,
+    },
+    on_run_complete=send_cron_report
+)
+
+async def dispatch_sharded_cron(job: str, user_timezone: str, title: str) -> Dict[str, Any]:
+    """
+    Публикует запуск, разбитый на CRON_SHARDS шардов, и сразу берётся за те, что успеет захватить.
+    Остальные шарды подхватывают фоновые циклы других экземпляров; общий отчёт
+    администратору отправляет экземпляр, завершивший последний шард.
+    """
+    logger.info(f"Dispatching sharded CRON {job} for timezone: {user_timezone}")
+    run_id = await cron_coordinator.publish_run(job, user_timezone, title)
+    processed = await cron_coordinator.process_run(run_id)
+    return {"status": "dispatched", "run_id": run_id, "shards": CRON_SHARDS, "processed_here": processed}
 
 # Webhook setup
-async def on_startup():
+async def on_startup(register_webhook: bool = True):
+    """
+    Запуск процесса. Миграции выполняет один процесс-лидер раз на версию схемы БД;
+    проверку вебхука - при каждом запуске тот процесс, что взял блокировку;
+    мониторинг ресурсов, каталог советов и фоновые задачи (шарды CRON) - каждый процесс.
+    """
     logger.info("Starting up bot...")
+
+    async def migrate():
+        logger.info("Initializing database...")
+        await asyncio.to_thread(db.init_db)
+        logger.info("Database initialization complete.")
+
+    await run_as_leader(redis_client, "startup", migrate, version=f"schema-{db.SCHEMA_VERSION}")
+    if not register_webhook or BOT_MODE == "polling":
+        logger.info("Polling mode, skipping webhook setup")
+    else:
+        # Проверка идемпотентна: вебхук ставится заново, только если он отличается или снят
+        await run_exclusive(redis_client, "webhook", setup_webhook)
+    start_resource_monitor()
+    # Каталог советов загружается в каждом процессе, после миграций лидера
+    try:
+        await asyncio.to_thread(db.tips_catalog.refresh)
+    except Exception as e:
+        logger.error(f"Failed to load tips catalog: {e}")
+    if CRON_SHARDS > 1:
+        cron_coordinator.start()
+
+async def setup_webhook():
     try:
         webhook_info = await bot.get_webhook_info()
         if webhook_info.url != WEBHOOK_URL:
@@ -2173,19 +2541,50 @@ async def on_startup():
 
 async def on_shutdown():
     logger.info("Shutting down bot...")
+    await update_queue.stop()
+    await cron_coordinator.stop()
+    await last_seen_tracker.flush()
+    await redis_client.aclose(close_connection_pool=True)
     # Пропускаем удаление вебхука для работы 24/7
     await bot.session.close()
 
+async def process_update(update: types.Update):
+    await dp.feed_update(bot=bot, update=update)
+
+# Апдейты обрабатываются в фоне, вебхук отвечает сразу после постановки в очередь.
+# Апдейты одного пользователя идут строго по порядку, разных - параллельно
+update_queue = UpdateScheduler(process_update)
+# Повторные доставки одного и того же апдейта отбрасываются до постановки в очередь
+update_deduplicator = UpdateDeduplicator(redis_client, bot.id)
+
+webhook_parse_latency = metrics_registry.histogram('webhook_update_parse', buckets_ms=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25))
+
 # FastAPI webhook endpoint
-@fastapi_app.post(WEBHOOK_PATH)
+@api_router.post(WEBHOOK_PATH)
 async def handle_webhook_update(request: Request):
     try:
-        update = types.Update(**await request.json())
-        await dp.feed_update(bot=bot, update=update)
-        return {"status": "ok"}
+        body = await request.body()
+        started = time.perf_counter()
+        # Валидация прямо из байтов, без промежуточного dict. Контекст bot привязывает апдейт
+        # к боту сразу, иначе feed_update повторно сериализует и валидирует его целиком
+        update = types.Update.model_validate_json(body, context={"bot": bot})
+        webhook_parse_latency.observe(time.perf_counter() - started)
     except Exception as e:
-        logger.error(f"Error processing webhook update: {e}")
+        # Отвечаем 200: повторная доставка некорректного апдейта ничего не изменит
+        logger.error(f"Invalid webhook update: {e}")
         return {"status": "error", "message": str(e)}
+    if await update_deduplicator.is_duplicate(update.update_id):
+        logger.info(f"Dropping duplicate webhook update {update.update_id}")
+        return {"status": "duplicate"}
+    if not update_queue.put_nowait(update):
+        logger.warning(f"Webhook queue is full, rejecting update {update.update_id}")
+        await update_deduplicator.forget(update.update_id)
+        return JSONResponse(
+            status_code=503,
+            content={"status": "busy"},
+            headers={"Retry-After": str(WEBHOOK_RETRY_AFTER)}
+        )
+    return {"status": "ok"}
 
 # Monitor system resources
 def monitor_resources():
@@ -2198,13 +2597,45 @@ def monitor_resources():
             logger.warning(f"High resource usage detected: CPU {cpu_percent}%, Memory {memory_percent}%")
         time.sleep(60)
 
-# Start resource monitoring in a separate thread
-resource_monitor_thread = threading.Thread(target=monitor_resources, daemon=True)
-resource_monitor_thread.start()
+def start_resource_monitor():
+    # Start resource monitoring in a separate thread
+    resource_monitor_thread = threading.Thread(target=monitor_resources, daemon=True)
+    resource_monitor_thread.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await on_startup()
+    try:
+        yield
+    finally:
+        await on_shutdown()
+
+def create_app() -> FastAPI:
+    """Фабрика приложения: uvicorn вызывает её в каждом воркере при импорте модуля."""
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Mini App читает ETag ответа /api/stats и присылает его в If-None-Match
+        expose_headers=["ETag"],
+    )
+    app.include_router(api_router)
+    return app
+
+fastapi_app = create_app()
 
 # Main entry point
 if __name__ == "__main__":
     import uvicorn
-    fastapi_app.add_event_handler("startup", on_startup)
-    fastapi_app.add_event_handler("shutdown", on_shutdown)
-    uvicorn.run(fastapi_app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
\ No newline at end of file
+    # Число процессов-воркеров; каждый обслуживает запросы на своём ядре
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    uvicorn.run(
+        # Несколько воркеров uvicorn запускает только по строке импорта
+        "app:fastapi_app" if workers > 1 else fastapi_app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        workers=workers
+    )
\ No newline at end of file
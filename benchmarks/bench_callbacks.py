@@ -0,0 +1,153 @@
+"""
+Микробенчмарк выбора обработчика callback-запроса.
+
+Сравнивает прежнюю схему (aiogram по очереди проверяет lambda-фильтр и StateFilter
+каждого обработчика) с таблицей CallbackRouter. Маршруты берутся из декораторов
+@callback_router.exact/prefix в app.py, поэтому app.py не импортируется и БД не нужна.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_callbacks.py [--iterations 20000]
+"""
+import argparse
+import ast
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiogram.dispatcher.event.handler import FilterObject, HandlerObject  # noqa: E402
+from aiogram.filters import StateFilter  # noqa: E402
+
+import callbacks  # noqa: E402
+from callback_router import CallbackFactory, CallbackRouter  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+
+# (callback_data, состояние FSM) - популярные кнопки и кнопки из разных частей таблицы
+SAMPLES = [
+    ("menu_back", None),
+    ("menu_achievements", None),
+    ("done_workout", None),
+    ("habit_answer_17_yes", "EveningHabitPoll:answering_habit"),
+    ("goal_answer_4_no", "EveningGoalPoll:answering_goal"),
+    ("delete_activity_confirm_screen_42", None),
+    ("plan_toggle_coding", "MorningPoll:planning_day"),
+    ("tz_set_Europe/Moscow", None),
+    ("menu_settings", None),
+    ("unknown_button", None),
+]
+
+
+class FakeCallback:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def _literal(node):
+    """Строка или callbacks.X из аргумента декоратора."""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "callbacks":
+        return getattr(callbacks, node.attr)
+    raise ValueError(f"Unsupported decorator argument: {ast.dump(node)}")
+
+
+def _state(node):
+    if node is None:
+        return None
+    # SetGoal.choosing_duration -> "SetGoal:choosing_duration", как у aiogram State
+    return f"{node.value.id}:{node.attr}"
+
+
+def load_routes():
+    """[(kind, value, state)] в порядке регистрации в app.py."""
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    routes = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        # Декораторы применяются снизу вверх
+        for decorator in reversed(node.decorator_list):
+            if not (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute)
+                    and isinstance(decorator.func.value, ast.Name) and decorator.func.value.id == "callback_router"):
+                continue
+            state = _state(next((kw.value for kw in decorator.keywords if kw.arg == "state"), None))
+            for arg in decorator.args:
+                value = _literal(arg)
+                if isinstance(value, CallbackFactory):
+                    value = value.prefix
+                routes.append((decorator.func.attr, value, state, node.lineno))
+    routes.sort(key=lambda route: route[3])
+    return [route[:3] for route in routes]
+
+
+def build_linear(routes):
+    """Прежняя схема: HandlerObject с lambda-фильтром и StateFilter на каждый маршрут."""
+    handlers = []
+    for kind, value, state in routes:
+        if kind == "exact":
+            predicate = (lambda v: lambda c: c.data == v)(value)
+        else:
+            predicate = (lambda v: lambda c: c.data.startswith(v))(value)
+        filters = [FilterObject(predicate)]
+        if state is not None:
+            filters.append(FilterObject(StateFilter(state)))
+        handlers.append(HandlerObject(_noop, filters=filters))
+    return handlers
+
+
+def build_router(routes):
+    router = CallbackRouter()
+    for kind, value, state in routes:
+        getattr(router, kind)(value, state=state)(_noop)
+    return router
+
+
+async def linear_dispatch(handlers, callback, raw_state):
+    for handler in handlers:
+        matched, _ = await handler.check(callback, raw_state=raw_state)
+        if matched:
+            return handler
+    return None
+
+
+async def bench(iterations):
+    routes = load_routes()
+    linear = build_linear(routes)
+    router = build_router(routes)
+    print(f"Маршрутов: {len(routes)}, итераций на кнопку: {iterations}\n")
+    print(f"{'callback_data':<36}{'lambda-фильтры, мкс':>22}{'CallbackRouter, мкс':>22}{'ускорение':>12}")
+    total_linear = total_router = 0.0
+    for data, raw_state in SAMPLES:
+        callback = FakeCallback(data)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await linear_dispatch(linear, callback, raw_state)
+        linear_us = (time.perf_counter() - started) / iterations * 1e6
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            router.resolve(data, raw_state)
+        router_us = (time.perf_counter() - started) / iterations * 1e6
+
+        total_linear += linear_us
+        total_router += router_us
+        print(f"{data:<36}{linear_us:>22.2f}{router_us:>22.2f}{linear_us / router_us:>11.1f}x")
+    print(f"\n{'среднее':<36}{total_linear / len(SAMPLES):>22.2f}{total_router / len(SAMPLES):>22.2f}"
+          f"{total_linear / total_router:>11.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    asyncio.run(bench(parser.parse_args().iterations))
@@ -0,0 +1,110 @@
+"""
+Микробенчмарк проверки initData Web App.
+
+Сравнивает прежнюю проверку (секрет HMAC вычислялся на каждый запрос) с
+InitDataValidator без кэша и с кэшем проверенных строк. Нагрузка похожа на
+мини-приложение: --users сессий, каждая шлёт свою initData --requests раз подряд
+вперемешку с другими сессиями. Заодно проверяет, что поддельная и просроченная
+initData отклоняются.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_init_data.py [--users 2000] [--requests 10] [--threads 8]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from webapp_auth import InitDataValidator, derive_secret_key  # noqa: E402
+
+BOT_TOKEN = "123456:bench-token"
+
+
+def sign(fields, bot_token=BOT_TOKEN):
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    fields = dict(fields, hash=hmac.new(derive_secret_key(bot_token), data_check_string.encode(), hashlib.sha256).hexdigest())
+    return urlencode(fields)
+
+
+def make_init_data(user_id, auth_date):
+    user = {"id": user_id, "first_name": f"User {user_id}", "language_code": "ru"}
+    return sign({
+        "query_id": f"AAH{user_id:010d}",
+        "user": json.dumps(user, separators=(",", ":"), ensure_ascii=False),
+        "auth_date": str(auth_date),
+    })
+
+
+def legacy_validate(init_data, bot_token=BOT_TOKEN):
+    """Проверка в том виде, в каком она была в app.py до InitDataValidator."""
+    parsed_data = dict(parse_qsl(init_data))
+    received_hash = parsed_data.pop('hash', None)
+    if not received_hash:
+        return None
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(parsed_data.items()))
+    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+    calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if calculated_hash == received_hash:
+        user_data = json.loads(parsed_data.get('user', '{}'))
+        return user_data if 'id' in user_data else None
+    return None
+
+
+def run(validate, workload, threads):
+    started = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(validate, workload, chunksize=256))
+    else:
+        results = [validate(init_data) for init_data in workload]
+    elapsed = time.perf_counter() - started
+    assert all(result is not None for result in results)
+    return elapsed / len(workload) * 1e6, len(workload) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    now = int(time.time())
+    sessions = [make_init_data(user_id, now - random.randint(0, 3600)) for user_id in range(1, args.users + 1)]
+    workload = sessions * args.requests
+    random.shuffle(workload)
+
+    validator = InitDataValidator(BOT_TOKEN)
+    sample = sessions[0]
+    assert validator.validate(sample) == legacy_validate(sample)
+    assert validator.validate(sample.replace("User", "Admin")) is None
+    assert validator.validate(make_init_data(1, now - validator.max_age - 1)) is None
+    assert InitDataValidator("654321:other-token").validate(sample) is None
+
+    uncached = InitDataValidator(BOT_TOKEN, cache_ttl=0)
+    cached = InitDataValidator(BOT_TOKEN, cache_size=args.users)
+    cases = [
+        ("прежняя", legacy_validate),
+        ("без кэша", uncached.validate),
+        ("с кэшем", cached.validate),
+    ]
+    print(f"{len(workload)} запросов, {args.users} сессий, потоков: {args.threads}\n")
+    print(f"{'проверка':<12}{'мкс/запрос':>12}{'запросов/с':>14}{'ускорение':>12}")
+    baseline_us = None
+    for name, validate in cases:
+        per_request_us, rate = run(validate, workload, args.threads)
+        baseline_us = baseline_us or per_request_us
+        print(f"{name:<12}{per_request_us:>12.2f}{rate:>14.0f}{baseline_us / per_request_us:>11.1f}x")
+    print(f"\nпопаданий в кэш: {cached.cache_hits.value} из {len(workload)}")
+
+
+if __name__ == "__main__":
+    main()
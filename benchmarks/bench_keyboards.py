@@ -0,0 +1,65 @@
+"""
+Микробенчмарк получения клавиатур.
+
+Сравнивает сборку InlineKeyboardMarkup при каждом вызове (так было до кэширования)
+с общими экземплярами из keyboards.py: собранными при импорте и кэшированными по аргументам.
+Заодно проверяет, что общая клавиатура сериализуется так же, как собранная заново.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_keyboards.py [--iterations 20000]
+"""
+import argparse
+import inspect
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# keyboards импортирует db; движок SQLAlchemy не подключается к БД, пока его не используют
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+
+import keyboards  # noqa: E402
+
+MORNING_PLAN = {'time': 300, 'workout': 1, 'english': 0, 'coding': 1, 'planning': 0, 'stretching': 0, 'reflection': 1, 'walk': 0}
+
+# (название, вызов через keyboards, вызов сборки без кэша)
+CASES = [
+    ("главное меню", lambda: keyboards.get_main_menu_keyboard(include_settings=True),
+     lambda: inspect.unwrap(keyboards.get_main_menu_keyboard)(include_settings=True)),
+    ("меню помощи", keyboards.get_help_menu_keyboard, inspect.unwrap(keyboards.get_help_menu_keyboard)),
+    ("категории советов", keyboards.get_tips_categories_keyboard, inspect.unwrap(keyboards.get_tips_categories_keyboard)),
+    ("отмена", keyboards.get_cancel_keyboard, inspect.unwrap(keyboards.get_cancel_keyboard)),
+    ("настройки", lambda: keyboards.get_settings_keyboard("Asia/Almaty"),
+     lambda: inspect.unwrap(keyboards.get_settings_keyboard)("Asia/Almaty")),
+    ("утренний опрос", lambda: keyboards.get_morning_poll_keyboard(MORNING_PLAN),
+     lambda: inspect.unwrap(keyboards._morning_poll_keyboard)(*(MORNING_PLAN[key] for key in keyboards.MORNING_PLAN_KEYS))),
+]
+
+
+def measure(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'клавиатура':<22}{'сборка, мкс':>14}{'общая, мкс':>14}{'ускорение':>12}")
+    total_build = total_shared = 0.0
+    for name, shared, build in CASES:
+        assert shared().model_dump_json(exclude_none=True) == build().model_dump_json(exclude_none=True)
+        build_us = measure(build, args.iterations)
+        shared_us = measure(shared, args.iterations)
+        total_build += build_us
+        total_shared += shared_us
+        print(f"{name:<22}{build_us:>14.2f}{shared_us:>14.3f}{build_us / shared_us:>11.0f}x")
+    print(f"\n{'среднее':<22}{total_build / len(CASES):>14.2f}{total_shared / len(CASES):>14.3f}"
+          f"{total_build / total_shared:>11.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Бенчмарк разбора тела вебхука.
+
+Сравнивает прежний путь (json.loads -> Update(**dict), затем повторная валидация
+в feed_update для привязки к боту) с Update.model_validate_json(body, context={"bot": bot})
+на корпусе записанных апдейтов benchmarks/corpus/updates.jsonl.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_webhook_parse.py [--iterations 2000] [--corpus PATH]
+"""
+import argparse
+import json
+import os
+import time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "updates.jsonl")
+
+
+def load_corpus(path):
+    with open(path, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def parse_dict_kwargs(body, bot):
+    update = Update(**json.loads(body))
+    # Так делает Dispatcher.feed_update для апдейта, не привязанного к боту
+    return Update.model_validate(update.model_dump(), context={"bot": bot})
+
+
+def parse_validate_json(body, bot):
+    return Update.model_validate_json(body, context={"bot": bot})
+
+
+def measure(parse, corpus, bot, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for body in corpus:
+            parse(body, bot)
+    return (time.perf_counter() - started) / (iterations * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    bot = Bot("123456:BENCHMARK")
+    # Оба способа должны давать одинаковый результат
+    for body in corpus:
+        assert parse_dict_kwargs(body, bot) == parse_validate_json(body, bot)
+
+    print(f"Апдейтов в корпусе: {len(corpus)}, средний размер: {sum(map(len, corpus)) // len(corpus)} байт\n")
+    old_us = measure(parse_dict_kwargs, corpus, bot, args.iterations)
+    new_us = measure(parse_validate_json, corpus, bot, args.iterations)
+    print(f"json.loads + Update(**dict) + перепривязка: {old_us:8.1f} мкс/апдейт")
+    print(f"Update.model_validate_json(bytes):          {new_us:8.1f} мкс/апдейт")
+    print(f"Ускорение: {old_us / new_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
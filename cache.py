@@ -0,0 +1,130 @@
+"""
+Двухуровневый кэш для синхронного кода (db.py): LRU процесса с TTL перед Redis.
+L1 отвечает без сетевого обращения, L2 общий для всех процессов и переживает
+перезапуск. Записи L1 живут недолго (CACHE_L1_TTL), потому что другой процесс
+может обновить значение в Redis: столько же может длиться расхождение между
+процессами. Ошибки Redis не ломают чтение - кэш просто промахивается.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд значение живёт в памяти процесса
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", 5))
+# Размер LRU процесса для одного кэша
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", 10000))
+
+
+class TwoLevelCache:
+    """Кэш name:key -> значение; None не кэшируется."""
+
+    def __init__(
+        self,
+        name: str,
+        redis=None,
+        l1_ttl: float = CACHE_L1_TTL,
+        l1_size: int = CACHE_L1_SIZE,
+        encode: Callable[[Any], str] = json.dumps,
+        decode: Callable[[bytes], Any] = json.loads,
+    ):
+        self.name = name
+        self.redis = redis
+        self.l1_ttl = l1_ttl
+        self.l1_size = l1_size
+        self.encode = encode
+        self.decode = decode
+        self.l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.l1_hits = registry.counter(f'cache_hits:{name}:l1')
+        self.l2_hits = registry.counter(f'cache_hits:{name}:l2')
+        self.misses = registry.counter(f'cache_misses:{name}')
+        self.errors = registry.counter(f'cache_errors:{name}')
+        registry.gauge(f'cache_hit_rate:{name}', self.hit_rate)
+
+    def hit_rate(self) -> float:
+        hits = self.l1_hits.value + self.l2_hits.value
+        total = hits + self.misses.value
+        return round(hits / total, 3) if total else 0.0
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _l1_get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.l1.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.l1[key]
+                return None
+            self.l1.move_to_end(key)
+            return value
+
+    def _l1_set(self, key: str, value: Any, ttl: float):
+        with self.lock:
+            self.l1[key] = (time.monotonic() + min(ttl, self.l1_ttl), value)
+            self.l1.move_to_end(key)
+            if len(self.l1) > self.l1_size:
+                self.l1.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._l1_get(key)
+        if value is not None:
+            self.l1_hits.inc()
+            return value
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self._redis_key(key))
+            except Exception as e:
+                self.errors.inc()
+                logger.warning(f"Cache {self.name}: Redis get failed for {key}: {e}")
+                raw = None
+            if raw is not None:
+                value = self.decode(raw)
+                self._l1_set(key, value, self.l1_ttl)
+                self.l2_hits.inc()
+                return value
+        self.misses.inc()
+        return None
+
+    def set(self, key: str, value: Any, ttl: int):
+        """Записывает значение в оба уровня на ttl секунд (L1 - не дольше CACHE_L1_TTL)."""
+        if ttl <= 0:
+            self.delete(key)
+            return
+        self._l1_set(key, value, ttl)
+        if self.redis is not None:
+            try:
+                self.redis.set(self._redis_key(key), self.encode(value), ex=int(ttl))
+            except Exception as e:
+                self.errors.inc()
+                logger.warning(f"Cache {self.name}: Redis set failed for {key}: {e}")
+                # Старое значение в Redis не должно пережить запись
+                self.delete(key)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.l1.pop(key, None)
+        if self.redis is not None:
+            try:
+                self.redis.delete(self._redis_key(key))
+            except Exception as e:
+                self.errors.inc()
+                logger.warning(f"Cache {self.name}: Redis delete failed for {key}: {e}")
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Any]], ttl: int) -> Optional[Any]:
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
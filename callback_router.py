@@ -0,0 +1,146 @@
+"""
+Маршрутизация callback-запросов по таблице вместо цепочки фильтров.
+aiogram проверяет lambda-фильтры обработчиков по очереди, и кнопки, зарегистрированные
+внизу app.py, платят за все предикаты выше. Здесь обработчик находится словарём
+(точное совпадение callback_data) или префиксным деревом (самый длинный подходящий
+префикс), после чего проверяется только состояние FSM.
+"""
+import inspect
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+StateSpec = Union[None, str, State, Iterable[Union[str, State]]]
+
+
+class CallbackFactory:
+    """
+    Формат callback_data: префикс и поля через разделитель.
+    Повторяет уже используемые строки (например, habit_answer_5_yes), поэтому кнопки
+    в отправленных ранее сообщениях продолжают работать.
+    """
+
+    def __init__(self, prefix: str, *fields: str, sep: str = "_", types: Optional[Dict[str, Callable[[str], Any]]] = None):
+        self.prefix = prefix
+        self.fields = fields
+        self.sep = sep
+        self.types = types or {}
+
+    def pack(self, *values: Any) -> str:
+        return self.prefix + self.sep.join(str(value) for value in values)
+
+    def unpack(self, data: str) -> Dict[str, Any]:
+        """Разбирает callback_data; в первом поле допускается разделитель (разбор справа)."""
+        if not data.startswith(self.prefix):
+            raise ValueError(f"callback_data {data!r} does not start with {self.prefix!r}")
+        parts = data[len(self.prefix):].rsplit(self.sep, len(self.fields) - 1)
+        if len(parts) != len(self.fields):
+            raise ValueError(f"callback_data {data!r} does not match {self.prefix!r} fields {self.fields}")
+        return {name: self.types.get(name, str)(value) for name, value in zip(self.fields, parts)}
+
+
+def _normalize_states(state: StateSpec) -> Optional[FrozenSet[Optional[str]]]:
+    """None - любое состояние, иначе множество допустимых строк состояния."""
+    if state is None:
+        return None
+    states = [state] if isinstance(state, (str, State)) else list(state)
+    normalized = set()
+    for item in states:
+        value = item.state if isinstance(item, State) else item
+        if value == "*":
+            return None
+        normalized.add(value)
+    return frozenset(normalized)
+
+
+@dataclass
+class _Route:
+    handler: Callable[..., Any]
+    states: Optional[FrozenSet[Optional[str]]]
+    # Имена аргументов обработчика после callback; None - принимает **kwargs
+    params: Optional[Tuple[str, ...]]
+
+    def accepts_state(self, raw_state: Optional[str]) -> bool:
+        return self.states is None or raw_state in self.states
+
+    async def call(self, callback: CallbackQuery, data: Dict[str, Any]) -> Any:
+        if self.params is None:
+            return await self.handler(callback, **data)
+        return await self.handler(callback, **{name: data[name] for name in self.params if name in data})
+
+
+@dataclass
+class _TrieNode:
+    children: Dict[str, "_TrieNode"] = field(default_factory=dict)
+    routes: List[_Route] = field(default_factory=list)
+
+
+def _handler_params(handler: Callable[..., Any]) -> Optional[Tuple[str, ...]]:
+    params = list(inspect.signature(handler).parameters.values())[1:]
+    if any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params):
+        return None
+    return tuple(p.name for p in params)
+
+
+class CallbackRouter:
+    """Таблица обработчиков callback-запросов с единой точкой входа в dispatcher."""
+
+    def __init__(self):
+        self._exact: Dict[str, List[_Route]] = {}
+        self._prefixes = _TrieNode()
+
+    def _route(self, handler: Callable[..., Any], state: StateSpec) -> _Route:
+        return _Route(handler, _normalize_states(state), _handler_params(handler))
+
+    def exact(self, *values: str, state: StateSpec = None):
+        """Обработчик для callback_data, точно равных одному из values."""
+        def decorator(handler):
+            route = self._route(handler, state)
+            for value in values:
+                self._exact.setdefault(value, []).append(route)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: Union[str, CallbackFactory], state: StateSpec = None):
+        """Обработчик для callback_data, начинающихся с одного из prefixes."""
+        def decorator(handler):
+            route = self._route(handler, state)
+            for prefix in prefixes:
+                node = self._prefixes
+                for char in prefix.prefix if isinstance(prefix, CallbackFactory) else prefix:
+                    node = node.children.setdefault(char, _TrieNode())
+                node.routes.append(route)
+            return handler
+        return decorator
+
+    def resolve(self, data: str, raw_state: Optional[str] = None) -> Optional[_Route]:
+        """
+        Точное совпадение проверяется первым, затем префиксы от самого длинного к короткому.
+        Для одного ключа обработчики проверяются в порядке регистрации.
+        """
+        for route in self._exact.get(data, ()):
+            if route.accepts_state(raw_state):
+                return route
+        matched: List[List[_Route]] = []
+        node = self._prefixes
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.routes:
+                matched.append(node.routes)
+        for routes in reversed(matched):
+            for route in routes:
+                if route.accepts_state(raw_state):
+                    return route
+        return None
+
+    async def handle(self, callback: CallbackQuery, **data: Any) -> Any:
+        """Единственный обработчик callback_query в dispatcher."""
+        route = self.resolve(callback.data or "", data.get("raw_state"))
+        if route is None:
+            raise SkipHandler()
+        return await route.call(callback, data)
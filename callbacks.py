@@ -0,0 +1,24 @@
+"""
+Форматы callback_data кнопок с параметрами.
+Используются и при построении клавиатур (pack), и в обработчиках (unpack, маршрутизация).
+"""
+from callback_router import CallbackFactory
+
+DoneActivityCallback = CallbackFactory("done_", "activity_type")
+
+HabitAnswerCallback = CallbackFactory("habit_answer_", "habit_id", "answer", types={"habit_id": int})
+GoalAnswerCallback = CallbackFactory("goal_answer_", "goal_id", "answer", types={"goal_id": int})
+
+DeleteAchievementCallback = CallbackFactory("delete_achievement_", "achievement_id", types={"achievement_id": int})
+DeleteAchievementPageCallback = CallbackFactory("delete_achievement_page:", "page", types={"page": int})
+DeleteHabitCallback = CallbackFactory("delete_habit_", "habit_id", types={"habit_id": int})
+DeleteHabitPageCallback = CallbackFactory("delete_habit_page:", "page", types={"page": int})
+DeleteGoalCallback = CallbackFactory("delete_goal_", "goal_id", types={"goal_id": int})
+DeleteGoalPageCallback = CallbackFactory("delete_goal_page:", "page", types={"page": int})
+
+DeleteActivityTypeCallback = CallbackFactory("delete_activity_type_", "activity_type")
+DeleteActivityPageCallback = CallbackFactory("delete_activity_page_", "activity_type", "page", sep=":", types={"page": int})
+DeleteActivityConfirmCallback = CallbackFactory("delete_activity_confirm_", "activity_type", "activity_id", types={"activity_id": int})
+
+TipCategoryCallback = CallbackFactory("tip_category_", "category")
+TipCallback = CallbackFactory("tip_", "tip_id", types={"tip_id": int})
@@ -0,0 +1,168 @@
+"""
+Сводный отчёт о запуске CRON-задачи.
+Вместо отдельного сообщения администратору на старт и на каждую ошибку
+собирает счётчики, длительности, гистограмму задержек отправки и
+дедуплицированные сигнатуры ошибок, и отдаёт одно итоговое сообщение.
+"""
+import html
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from metrics import LatencyHistogram
+
+# Сколько различных сигнатур ошибок хранить (остальные попадают в общий счётчик)
+CRON_REPORT_MAX_SIGNATURES = int(os.getenv("CRON_REPORT_MAX_SIGNATURES", 10))
+# Для скольких сигнатур прикладывать traceback
+CRON_REPORT_MAX_TRACEBACKS = int(os.getenv("CRON_REPORT_MAX_TRACEBACKS", 2))
+# Максимальная длина одного traceback в отчёте
+CRON_REPORT_TRACEBACK_CHARS = 1200
+# Ограничение Telegram на длину сообщения
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def error_signature(exc: BaseException) -> str:
+    """
+    Сигнатура ошибки: тип, сообщение без чисел (id пользователей, таймауты)
+    и место возникновения. Одинаковые сбои у тысяч пользователей дают одну сигнатуру.
+    """
+    message = _NUMBER_RE.sub("N", str(exc))[:200]
+    location = ""
+    frames = traceback.extract_tb(exc.__traceback__)
+    if frames:
+        last = frames[-1]
+        location = f" @ {os.path.basename(last.filename)}:{last.lineno}"
+    return f"{type(exc).__name__}: {message}{location}"
+
+
+class CronRunReport:
+    """Накопитель статистики одного запуска CRON-задачи."""
+
+    def __init__(self, job_name: str):
+        self.job_name = job_name
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.status = "running"
+        self.counts: Counter = Counter()
+        self.phase_seconds: Dict[str, float] = {}
+        self.send_latency = LatencyHistogram()
+        # сигнатура -> {'count', 'example_user', 'traceback'}
+        self.errors: Dict[str, Dict[str, Any]] = {}
+        self.unsampled_errors = 0
+
+    def count(self, key: str, n: int = 1):
+        self.counts[key] += n
+
+    @contextmanager
+    def phase(self, name: str):
+        """Суммирует время, проведённое в фазе (БД, Redis, отправка и т.п.)."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + time.monotonic() - started
+
+    @contextmanager
+    def timed_send(self):
+        """Замеряет отправку сообщений одному пользователю."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.send_latency.observe(elapsed)
+            self.phase_seconds['send'] = self.phase_seconds.get('send', 0.0) + elapsed
+
+    def record_error(self, user_id: Optional[int], exc: BaseException):
+        self.counts['errors'] += 1
+        signature = error_signature(exc)
+        entry = self.errors.get(signature)
+        if entry is not None:
+            entry['count'] += 1
+            return
+        if len(self.errors) >= CRON_REPORT_MAX_SIGNATURES:
+            self.unsampled_errors += 1
+            return
+        sampled_tb = None
+        if sum(1 for e in self.errors.values() if e['traceback']) < CRON_REPORT_MAX_TRACEBACKS:
+            sampled_tb = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))[-CRON_REPORT_TRACEBACK_CHARS:]
+        self.errors[signature] = {'count': 1, 'example_user': user_id, 'traceback': sampled_tb}
+
+    def merge_dict(self, data: Dict[str, Any]):
+        """Добавляет результаты другого отчёта (например, шарда), сериализованного to_dict()."""
+        self.counts.update(data.get('counts', {}))
+        for name, seconds in data.get('phases_s', {}).items():
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+        self.send_latency.merge_snapshot(data.get('send_latency') or {})
+        for signature, count in data.get('error_signatures', {}).items():
+            entry = self.errors.get(signature)
+            if entry is not None:
+                entry['count'] += count
+            elif len(self.errors) < CRON_REPORT_MAX_SIGNATURES:
+                self.errors[signature] = {'count': count, 'example_user': None, 'traceback': None}
+            else:
+                self.unsampled_errors += count
+        self.unsampled_errors += data.get('unsampled_errors', 0)
+
+    def finish(self, status: str = "finished"):
+        self.status = status
+        self.finished_at = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job': self.job_name,
+            'status': self.status,
+            'duration_s': round(self.duration, 3),
+            'counts': dict(self.counts),
+            'phases_s': {k: round(v, 3) for k, v in self.phase_seconds.items()},
+            'send_latency': self.send_latency.snapshot(),
+            'error_signatures': {sig: e['count'] for sig, e in self.errors.items()},
+            'unsampled_errors': self.unsampled_errors,
+        }
+
+    def format_summary(self) -> str:
+        """HTML-сообщение для администратора, обрезанное до лимита Telegram."""
+        status_icon = "✅" if self.status == "finished" and not self.errors else ("‼️" if self.status == "error" else "⚠️")
+        lines = [
+            f"{status_icon} <b>CRON {html.escape(self.job_name)}</b>: {html.escape(self.status)} за {self.duration:.1f}с"
+        ]
+        if self.counts:
+            lines.append(", ".join(f"{html.escape(k)}: {v}" for k, v in sorted(self.counts.items())))
+        if self.phase_seconds:
+            lines.append("Фазы: " + ", ".join(f"{html.escape(k)} {v:.2f}с" for k, v in self.phase_seconds.items()))
+        if self.send_latency.count:
+            lines.append(f"Отправка: {self.send_latency.format_compact()}")
+        if self.errors:
+            lines.append("\n<b>Ошибки:</b>")
+            for sig, entry in sorted(self.errors.items(), key=lambda item: -item[1]['count']):
+                example = f" (напр. <code>{entry['example_user']}</code>)" if entry['example_user'] is not None else ""
+                lines.append(f"• ×{entry['count']} <code>{html.escape(sig)}</code>{example}")
+            if self.unsampled_errors:
+                lines.append(f"• ещё {self.unsampled_errors} ошибок с другими сигнатурами")
+            for sig, entry in self.errors.items():
+                if entry['traceback']:
+                    lines.append(f"\n<pre>{html.escape(entry['traceback'])}</pre>")
+
+        message = "\n".join(lines)
+        if len(message) > TELEGRAM_MESSAGE_LIMIT:
+            # Обрезаем по строкам, чтобы не разорвать HTML-теги
+            kept = []
+            size = 0
+            for line in lines:
+                if size + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT - 20:
+                    break
+                kept.append(line)
+                size += len(line) + 1
+            kept.append("…")
+            message = "\n".join(kept)
+        return message
@@ -0,0 +1,198 @@
+"""
+Распределение CRON-рассылок между несколькими экземплярами бота.
+Когорта делится на CRON_SHARDS шардов по user_id % N. Экземпляры захватывают
+шарды через аренды в Redis (SET NX EX), продлевают их во время работы и отмечают
+завершение. Аренда упавшего экземпляра истекает, и шард забирает другой.
+Экземпляр, завершивший последний шард, собирает общий отчёт.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cron_report import CronRunReport
+
+logger = logging.getLogger(__name__)
+
+# Число шардов, на которые делится когорта (1 - без распределения)
+CRON_SHARDS = max(int(os.getenv("CRON_SHARDS", 1)), 1)
+# Время жизни аренды шарда; продлевается каждую треть срока, пока шард обрабатывается
+CRON_SHARD_LEASE_TTL = int(os.getenv("CRON_SHARD_LEASE_TTL", 60))
+# Как часто фоновый цикл проверяет незавершённые запуски
+CRON_SHARD_POLL_INTERVAL = float(os.getenv("CRON_SHARD_POLL_INTERVAL", 5))
+# Сколько хранить служебные ключи запуска
+CRON_RUN_TTL = int(os.getenv("CRON_RUN_TTL", 6 * 3600))
+
+RUNS_KEY = "cron:runs"
+
+# Продлеваем аренду, только если она всё ещё принадлежит этому экземпляру
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# (параметр задачи, номер шарда, число шардов) -> отчёт по шарду
+ShardHandler = Callable[[str, int, int], Awaitable[CronRunReport]]
+
+
+def _decode(value: Any) -> Any:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ShardCoordinator:
+    """Публикует запуски CRON-задач и обрабатывает их шарды под арендой."""
+
+    def __init__(
+        self,
+        redis,
+        handlers: Dict[str, ShardHandler],
+        on_run_complete: Callable[[CronRunReport], Awaitable[None]],
+        instance_id: Optional[str] = None,
+    ):
+        self.redis = redis
+        self.handlers = handlers
+        self.on_run_complete = on_run_complete
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._renew_lease = redis.register_script(_RENEW_LEASE_SCRIPT)
+        self._worker_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(run_id: str, suffix: str) -> str:
+        return f"cron:run:{run_id}:{suffix}"
+
+    async def publish_run(self, job: str, param: str, title: str, shards: int = CRON_SHARDS) -> str:
+        """Регистрирует запуск; его шарды подхватят все экземпляры."""
+        run_id = uuid.uuid4().hex
+        meta_key = self._key(run_id, "meta")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(meta_key, mapping={
+                "job": job,
+                "param": param,
+                "title": title,
+                "shards": shards,
+                "created": time.time(),
+            })
+            pipe.expire(meta_key, CRON_RUN_TTL)
+            pipe.sadd(RUNS_KEY, run_id)
+            await pipe.execute()
+        logger.info(f"Published CRON run {run_id} ({job} {param}) with {shards} shards")
+        return run_id
+
+    async def process_run(self, run_id: str) -> List[int]:
+        """Обрабатывает все шарды запуска, которые удалось захватить. Возвращает их номера."""
+        meta = {_decode(k): _decode(v) for k, v in (await self.redis.hgetall(self._key(run_id, "meta"))).items()}
+        if not meta:
+            # Запуск истёк или уже собран
+            await self.redis.srem(RUNS_KEY, run_id)
+            return []
+        handler = self.handlers.get(meta["job"])
+        if handler is None:
+            logger.warning(f"No handler for CRON job {meta['job']} (run {run_id})")
+            return []
+
+        shards = int(meta["shards"])
+        done_key = self._key(run_id, "done")
+        done = {int(_decode(s)) for s in await self.redis.smembers(done_key)}
+        processed = []
+        for shard in range(shards):
+            if shard in done:
+                continue
+            lease_key = self._key(run_id, f"lease:{shard}")
+            if not await self.redis.set(lease_key, self.instance_id, nx=True, ex=CRON_SHARD_LEASE_TTL):
+                continue
+            # Шард мог завершиться между чтением done и захватом аренды
+            if await self.redis.sismember(done_key, shard):
+                await self.redis.delete(lease_key)
+                continue
+
+            logger.info(f"Instance {self.instance_id} claimed shard {shard + 1}/{shards} of CRON run {run_id}")
+            renewer = asyncio.create_task(self._keep_lease(lease_key))
+            try:
+                report = await handler(meta["param"], shard, shards)
+            except Exception as e:
+                logger.error(f"CRON shard {shard} of run {run_id} failed: {e}", exc_info=True)
+                report = CronRunReport(f"{meta['title']} [{shard + 1}/{shards}]")
+                report.record_error(None, e)
+                report.finish("error")
+            finally:
+                renewer.cancel()
+            processed.append(shard)
+            await self._complete_shard(run_id, meta, shard, report)
+        return processed
+
+    async def _keep_lease(self, lease_key: str):
+        while True:
+            await asyncio.sleep(CRON_SHARD_LEASE_TTL / 3)
+            try:
+                renewed = await self._renew_lease(keys=[lease_key], args=[self.instance_id, CRON_SHARD_LEASE_TTL])
+            except Exception as e:
+                logger.warning(f"Failed to renew CRON lease {lease_key}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost CRON lease {lease_key}, shard may be processed twice")
+                return
+
+    async def _complete_shard(self, run_id: str, meta: Dict[str, str], shard: int, report: CronRunReport):
+        shards = int(meta["shards"])
+        reports_key = self._key(run_id, "reports")
+        done_key = self._key(run_id, "done")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(reports_key, shard, json.dumps(report.to_dict()))
+            pipe.expire(reports_key, CRON_RUN_TTL)
+            pipe.sadd(done_key, shard)
+            pipe.expire(done_key, CRON_RUN_TTL)
+            pipe.scard(done_key)
+            pipe.delete(self._key(run_id, f"lease:{shard}"))
+            results = await pipe.execute()
+        if results[-2] < shards:
+            return
+        # Отчёт отправляет ровно один экземпляр
+        if not await self.redis.set(self._key(run_id, "reported"), self.instance_id, nx=True, ex=CRON_RUN_TTL):
+            return
+        await self.redis.srem(RUNS_KEY, run_id)
+
+        merged = CronRunReport(meta["title"])
+        # Длительность всего запуска - от публикации до последнего шарда
+        merged.started_at = time.monotonic() - (time.time() - float(meta["created"]))
+        shard_reports = (await self.redis.hgetall(reports_key)).values()
+        statuses = set()
+        for raw in shard_reports:
+            data = json.loads(raw)
+            statuses.add(data.get("status"))
+            merged.merge_dict(data)
+        merged.count('shards', shards)
+        merged.finish("error" if "error" in statuses else "finished")
+        logger.info(f"CRON run {run_id} completed on all {shards} shards")
+        await self.on_run_complete(merged)
+
+    async def run_forever(self):
+        """Фоновый цикл: подхватывает шарды опубликованных запусков, включая брошенные упавшими экземплярами."""
+        while True:
+            try:
+                for run_id in await self.redis.smembers(RUNS_KEY):
+                    await self.process_run(_decode(run_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"CRON shard worker error: {e}", exc_info=True)
+            await asyncio.sleep(CRON_SHARD_POLL_INTERVAL)
+
+    def start(self):
+        if self._worker_task is None or self._worker_task.done():
+            self._worker_task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._worker_task is None:
+            return
+        self._worker_task.cancel()
+        try:
+            await self._worker_task
+        except asyncio.CancelledError:
+            pass
+        self._worker_task = None
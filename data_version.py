@@ -0,0 +1,72 @@
+"""
+Версии данных пользователей для условных ответов API.
+Каждая функция db.py, меняющая данные пользователя, увеличивает его счётчик в Redis
+(INCR), а массовые CRON-обновления - общий счётчик. Пара счётчиков и дата дают
+ETag для /api/stats: совпадение означает, что ответ не изменился, и Postgres не нужен.
+"""
+import logging
+from functools import wraps
+from typing import Callable, Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_VERSION_KEY = "data_version:global"
+
+
+class DataVersions:
+    """Счётчики версий данных; без Redis версии не ведутся и current() возвращает None."""
+
+    def __init__(self, redis=None):
+        self.redis = redis
+        self.bump_errors = registry.counter('data_version_bump_errors')
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return f"data_version:user:{user_id}"
+
+    def _incr(self, key: str):
+        if self.redis is None:
+            return
+        try:
+            self.redis.incr(key)
+        except Exception as e:
+            # Клиент со старым ETag получит 304 до следующей записи - заметно в метриках
+            self.bump_errors.inc()
+            logger.error(f"Failed to bump {key}: {e}")
+
+    def bump(self, user_id: int):
+        self._incr(self._user_key(user_id))
+
+    def bump_all(self):
+        self._incr(GLOBAL_VERSION_KEY)
+
+    def current(self, user_id: int) -> Optional[str]:
+        """'<версия пользователя>.<общая версия>' или None, если Redis недоступен."""
+        if self.redis is None:
+            return None
+        try:
+            user_version, global_version = self.redis.mget(self._user_key(user_id), GLOBAL_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Failed to read data version for user {user_id}: {e}")
+            return None
+        return f"{int(user_version or 0)}.{int(global_version or 0)}"
+
+    def user_write(self, fn: Callable) -> Callable:
+        """Декоратор функции с user_id первым аргументом: после успешной записи версия растёт."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            self.bump(kwargs['user_id'] if 'user_id' in kwargs else args[0])
+            return result
+        return wrapper
+
+    def bulk_write(self, fn: Callable) -> Callable:
+        """Декоратор массового обновления: растёт общая версия."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            self.bump_all()
+            return result
+        return wrapper
@@ -1,13 +1,20 @@
 import os
+import json
 import logging
 from contextlib import contextmanager
-from datetime import date, timedelta
+from datetime import date, datetime, time, timedelta
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError, IntegrityError
 import random
-from typing import List, Dict, Tuple, Any 
+from typing import List, Dict, Tuple, Any, Optional
+
+from cache import TwoLevelCache
+from data_version import DataVersions
+from redis_pool import create_sync_redis
+from timezones import DEFAULT_TIMEZONE
+from tips_catalog import Tip, TipsCatalog
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -17,9 +24,56 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not set")
 
+# Пользователь считается спящим, если не обращался к боту столько дней
+DORMANT_AFTER_DAYS = int(os.getenv("DORMANT_AFTER_DAYS", 14))
+
+# Версия схемы, которую создаёт init_db. Увеличивается при каждом изменении DDL в init_db:
+# по ней процесс-лидер решает, нужно ли снова выполнять миграции при запуске
+SCHEMA_VERSION = 2
+
 engine = create_engine(DATABASE_URL, pool_size=10, max_overflow=10, pool_timeout=30, pool_recycle=1800)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Сегодняшняя строка daily_stats пользователя: её читают клавиатура отметки дел,
+# CRON-сводки и /api/stats. Кэш обновляется теми же функциями, что пишут строку
+REDIS_URL = os.getenv("REDIS_URL")
+# Синхронный клиент Redis для кэшей и версий данных; функции db.py вызываются из
+# асинхронного кода через asyncio.to_thread, поэтому его команды не блокируют event loop
+cache_redis = create_sync_redis(REDIS_URL) if REDIS_URL else None
+
+def _encode_stats_row(row: Dict[str, Any]) -> str:
+    return json.dumps(row, default=date.isoformat)
+
+def _decode_stats_row(raw: bytes) -> Dict[str, Any]:
+    row = json.loads(raw)
+    row['stat_date'] = date.fromisoformat(row['stat_date'])
+    return row
+
+today_stats_cache = TwoLevelCache(
+    'today_stats',
+    redis=cache_redis,
+    encode=_encode_stats_row,
+    decode=_decode_stats_row,
+)
+
+# Версии данных пользователей для ETag /api/stats: растут при каждой записи ниже
+data_versions = DataVersions(cache_redis)
+
+# Часовой пояс пользователя: читается при каждом открытии настроек
+USER_TIMEZONE_CACHE_TTL = int(os.getenv("USER_TIMEZONE_CACHE_TTL", 24 * 3600))
+user_timezone_cache = TwoLevelCache('user_timezone', redis=cache_redis)
+
+def _seconds_until_end_of(day: date) -> int:
+    return int((datetime.combine(day + timedelta(days=1), time.min) - datetime.now()).total_seconds())
+
+def _cache_today_stats(user_id: int, stat_date: date, row) -> None:
+    """Записывает в кэш строку, возвращённую RETURNING *; без строки - сбрасывает кэш."""
+    key = f"{user_id}:{stat_date.isoformat()}"
+    if row is None:
+        today_stats_cache.delete(key)
+    else:
+        today_stats_cache.set(key, row._asdict(), _seconds_until_end_of(stat_date))
+
 @contextmanager
 def get_db():
     db_session = SessionLocal()
@@ -44,6 +98,16 @@ def init_db():
                     timezone TEXT DEFAULT 'Asia/Almaty'
                 )
             """))
+            # Пользователи, заблокировавшие бота, помечаются неактивными и не попадают в CRON-рассылки
+            db.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE"))
+            db.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS deactivated_at TIMESTAMP"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_users_timezone_active ON users (timezone) WHERE is_active"))
+            # Время последнего обращения к боту - для разделения плановых задач на активных и спящих пользователей.
+            # Без значения по умолчанию: NULL (не обращался) считается спящим, а существующие
+            # пользователи заполняются по реальной активности ниже, после создания daily_stats
+            db.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP"))
+            db.execute(text("ALTER TABLE users ALTER COLUMN last_seen_at DROP DEFAULT"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_users_last_seen_at ON users (last_seen_at)"))
             
             # Создание таблицы daily_stats
             db.execute(text("""
@@ -72,6 +136,12 @@ def init_db():
                     UNIQUE(user_id, stat_date)
                 )
             """))
+            # Пользователи без отметки last_seen_at: последний день со статистикой
+            db.execute(text("""
+                UPDATE users u SET last_seen_at = s.last_stat_date
+                FROM (SELECT user_id, MAX(stat_date) AS last_stat_date FROM daily_stats GROUP BY user_id) s
+                WHERE u.user_id = s.user_id AND u.last_seen_at IS NULL
+            """))
             
             # Создание таблицы sport_achievements
             db.execute(text("""
@@ -263,6 +333,30 @@ def init_db():
             #     SELECT 'Мышление', 'Задавайте себе вопрос "Почему?" для анализа своих решений.'
             #     WHERE NOT EXISTS (SELECT 1 FROM tips WHERE category = 'Мышление' AND tip = 'Задавайте себе вопрос "Почему?" для анализа своих решений.')
             # """))
+
+            # Счётчик версии каталога советов: растёт при любом изменении tips,
+            # процессы бота сверяют его и перечитывают каталог (tips_catalog.py)
+            db.execute(text("""
+                CREATE TABLE IF NOT EXISTS tips_version (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    version BIGINT NOT NULL DEFAULT 0
+                )
+            """))
+            db.execute(text("INSERT INTO tips_version (id, version) VALUES (TRUE, 0) ON CONFLICT DO NOTHING"))
+            db.execute(text("""
+                CREATE OR REPLACE FUNCTION bump_tips_version() RETURNS trigger AS $$
+                BEGIN
+                    UPDATE tips_version SET version = version + 1;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            """))
+            db.execute(text("DROP TRIGGER IF EXISTS tips_version_bump ON tips"))
+            db.execute(text("""
+                CREATE TRIGGER tips_version_bump
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tips
+                FOR EACH STATEMENT EXECUTE PROCEDURE bump_tips_version()
+            """))
             
             db.commit()
             logger.info("Database initialized successfully")
@@ -270,15 +364,19 @@ def init_db():
         logger.error(f"Error initializing database: {e}")
         raise
 
+@data_versions.user_write
 def add_user(user_id: int, username: str, first_name: str):
     try:
         with get_db() as db:
             db.execute(text("""
-                INSERT INTO users (user_id, username, first_name, timezone)
-                VALUES (:user_id, :username, :first_name, 'Asia/Almaty')
+                INSERT INTO users (user_id, username, first_name, timezone, last_seen_at)
+                VALUES (:user_id, :username, :first_name, 'Asia/Almaty', NOW())
                 ON CONFLICT (user_id) DO UPDATE SET
                     username = EXCLUDED.username,
-                    first_name = EXCLUDED.first_name;
+                    first_name = EXCLUDED.first_name,
+                    is_active = TRUE,
+                    deactivated_at = NULL,
+                    last_seen_at = NOW();
             """), {'user_id': user_id, 'username': username, 'first_name': first_name})
             db.commit()
             logger.info(f"Added/updated user {user_id}")
@@ -288,6 +386,53 @@ def add_user(user_id: int, username: str, first_name: str):
         logger.error(f"Error adding user {user_id}: {e}")
         raise
 
+def touch_users_last_seen(user_ids: List[int]):
+    """Пакетно обновляет время последнего обращения к боту."""
+    if not user_ids:
+        return
+    try:
+        with get_db() as db:
+            db.execute(text("UPDATE users SET last_seen_at = NOW() WHERE user_id = ANY(:user_ids)"), {'user_ids': list(user_ids)})
+            db.commit()
+            logger.debug(f"Updated last_seen_at for {len(user_ids)} users")
+    except Exception as e:
+        logger.error(f"Error updating last_seen_at for {len(user_ids)} users: {e}")
+        raise
+
+def _tier_filter(tier: str, user_column: str = "user_id") -> str:
+    """
+    SQL-условие на пользователей нужного уровня активности:
+    'active' - обращались к боту за последние DORMANT_AFTER_DAYS дней,
+    'dormant' - остальные, включая не обращавшихся ни разу (NULL), 'all' - без ограничений.
+    """
+    if tier == 'all':
+        return "TRUE"
+    if tier == 'active':
+        return f"{user_column} IN (SELECT user_id FROM users WHERE last_seen_at >= NOW() - make_interval(days => :dormant_days))"
+    if tier == 'dormant':
+        return f"{user_column} IN (SELECT user_id FROM users WHERE last_seen_at IS NULL OR last_seen_at < NOW() - make_interval(days => :dormant_days))"
+    raise ValueError(f"Unknown user tier: {tier}")
+
+def deactivate_users(user_ids: List[int]):
+    """
+    Помечает пользователей неактивными (заблокировали бота или удалили аккаунт).
+    Повторный /start возвращает их в рассылки через add_user.
+    """
+    if not user_ids:
+        return
+    try:
+        with get_db() as db:
+            result = db.execute(text("""
+                UPDATE users SET is_active = FALSE, deactivated_at = NOW()
+                WHERE user_id = ANY(:user_ids) AND is_active
+            """), {'user_ids': list(user_ids)})
+            db.commit()
+            logger.info(f"Deactivated {result.rowcount} unreachable users")
+    except Exception as e:
+        logger.error(f"Error deactivating users {user_ids}: {e}")
+        raise
+
+@data_versions.user_write
 def save_morning_plan(user_id: int, screen_time: int, workout: int, english: int, coding: int, planning: int, stretching: int, reflection: int, walk: int, is_rest_day: bool):
     try:
         with get_db() as db:
@@ -316,10 +461,12 @@ def save_morning_plan(user_id: int, screen_time: int, workout: int, english: int
                     walk_planned = :walk_planned,
                     morning_poll_completed = true,
                     is_rest_day = :is_rest_day
+                RETURNING *
             """)
-            db.execute(stmt, {
+            today = date.today()
+            row = db.execute(stmt, {
                 'user_id': user_id,
-                'stat_date': date.today(),
+                'stat_date': today,
                 'screen_time_goal': screen_time,
                 'workout_planned': workout,
                 'english_planned': english,
@@ -329,13 +476,15 @@ def save_morning_plan(user_id: int, screen_time: int, workout: int, english: int
                 'reflection_planned': reflection,
                 'walk_planned': walk,
                 'is_rest_day': is_rest_day
-            })
+            }).first()
             db.commit()
+            _cache_today_stats(user_id, today, row)
             logger.info(f"Saved morning plan for user {user_id}")
     except Exception as e:
         logger.error(f"Error saving morning plan for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def mark_activity_done(user_id: int, activity_type: str):
     try:
         with get_db() as db:
@@ -344,14 +493,18 @@ def mark_activity_done(user_id: int, activity_type: str):
                 UPDATE daily_stats
                 SET {activity_field} = 1
                 WHERE user_id = :user_id AND stat_date = :stat_date
+                RETURNING *
             """)
-            db.execute(stmt, {'user_id': user_id, 'stat_date': date.today()})
+            today = date.today()
+            row = db.execute(stmt, {'user_id': user_id, 'stat_date': today}).first()
             db.commit()
+            _cache_today_stats(user_id, today, row)
             logger.info(f"Marked {activity_type} as done for user {user_id}")
     except Exception as e:
         logger.error(f"Error marking activity {activity_type} for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def add_sport_achievement(user_id: int, achievement_name: str, date_earned: date):
     try:
         with get_db() as db:
@@ -365,33 +518,38 @@ def add_sport_achievement(user_id: int, achievement_name: str, date_earned: date
         logger.error(f"Error adding sport achievement for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def log_custom_activity(user_id: int, activity_name: str, duration_minutes: int):
     try:
         with get_db() as db:
+            today = date.today()
             db.execute(text("""
                 INSERT INTO screen_activities (user_id, activity_date, activity_name, duration_minutes)
                 VALUES (:user_id, :activity_date, :activity_name, :duration_minutes)
             """), {
                 'user_id': user_id,
-                'activity_date': date.today(),
+                'activity_date': today,
                 'activity_name': activity_name,
                 'duration_minutes': duration_minutes
             })
-            db.execute(text("""
+            row = db.execute(text("""
                 UPDATE daily_stats
                 SET screen_time_actual = screen_time_actual + :duration_minutes
                 WHERE user_id = :user_id AND stat_date = :activity_date
+                RETURNING *
             """), {
                 'user_id': user_id,
-                'activity_date': date.today(),
+                'activity_date': today,
                 'duration_minutes': duration_minutes
-            })
+            }).first()
             db.commit()
+            _cache_today_stats(user_id, today, row)
             logger.info(f"Logged screen activity '{activity_name}' for user {user_id}")
     except Exception as e:
         logger.error(f"Error logging screen activity for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def log_productive_activity(user_id: int, activity_name: str, duration_minutes: int):
     try:
         with get_db() as db:
@@ -410,6 +568,7 @@ def log_productive_activity(user_id: int, activity_name: str, duration_minutes:
         logger.error(f"Error logging productive activity for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def add_goal(user_id: int, goal_name: str, goal_type: str, target_value: int, current_value: int, start_date: date, end_date: date, streak: int = 0):
     try:
         with get_db() as db:
@@ -433,6 +592,7 @@ def add_goal(user_id: int, goal_name: str, goal_type: str, target_value: int, cu
         logger.error(f"Error adding goal for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def log_goal_completion(user_id: int, goal_id: int, completed: bool):
     try:
         with get_db() as db:
@@ -453,6 +613,7 @@ def log_goal_completion(user_id: int, goal_id: int, completed: bool):
         logger.error(f"Error logging goal completion for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def update_goal_progress(user_id: int, activity_type: str, value: int):
     try:
         with get_db() as db:
@@ -492,6 +653,7 @@ def update_goal_progress(user_id: int, activity_type: str, value: int):
         logger.error(f"Error updating goal progress for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def update_goal_streak(user_id: int, goal_id: int):
     try:
         with get_db() as db:
@@ -547,6 +709,7 @@ def update_goal_streak(user_id: int, goal_id: int):
         logger.error(f"Error updating goal streak for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def add_habit(user_id: int, habit_name: str):
     try:
         with get_db() as db:
@@ -561,6 +724,7 @@ def add_habit(user_id: int, habit_name: str):
         logger.error(f"Error adding habit for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def log_habit_completion(user_id: int, habit_id: int, completed: bool):
     try:
         with get_db() as db:
@@ -581,6 +745,7 @@ def log_habit_completion(user_id: int, habit_id: int, completed: bool):
         logger.error(f"Error logging habit completion for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def save_productivity_answer(user_id: int, question: str, answer: str):
     try:
         with get_db() as db:
@@ -601,17 +766,28 @@ def save_productivity_answer(user_id: int, question: str, answer: str):
         logger.error(f"Error saving productivity answer for user {user_id}: {e}")
         raise
 
-def get_today_stats_for_user(user_id: int):
+def _load_today_stats(user_id: int, today: date) -> Optional[Dict[str, Any]]:
+    with get_db() as db:
+        stmt = text("""
+            SELECT * FROM daily_stats
+            WHERE user_id = :user_id AND stat_date = :stat_date
+        """)
+        result = db.execute(stmt, {'user_id': user_id, 'stat_date': today}).first()
+        if result:
+            return result._asdict()
+        return None
+
+def get_today_stats_for_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Сегодняшняя строка daily_stats из кэша; запрос к БД только при промахе."""
     try:
-        with get_db() as db:
-            stmt = text("""
-                SELECT * FROM daily_stats
-                WHERE user_id = :user_id AND stat_date = :stat_date
-            """)
-            result = db.execute(stmt, {'user_id': user_id, 'stat_date': date.today()}).first()
-            if result:
-                return result._asdict()
-            return None
+        today = date.today()
+        row = today_stats_cache.get_or_load(
+            f"{user_id}:{today.isoformat()}",
+            lambda: _load_today_stats(user_id, today),
+            _seconds_until_end_of(today),
+        )
+        # Копия: вызывающий код не должен менять строку в кэше
+        return dict(row) if row is not None else None
     except Exception as e:
         logger.error(f"Error fetching today stats for user {user_id}: {e}")
         raise
@@ -630,6 +806,7 @@ def get_today_screen_time(user_id: int):
         logger.error(f"Error fetching screen time for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def clear_user_data(user_id: int):
     """
     Очищает все данные пользователя из всех связанных таблиц.
@@ -670,23 +847,34 @@ def clear_user_data(user_id: int):
                     logger.warning(f"Table {table_name} does not exist, skipping deletion for user_id {user_id}")
 
             db.commit()
+            _cache_today_stats(user_id, date.today(), None)
+            user_timezone_cache.delete(str(user_id))
             logger.info(f"Successfully cleared all data for user_id {user_id}")
     except Exception as e:
         logger.error(f"Error clearing data for user_id {user_id}: {e}")
         raise
 
+def _load_tips_version() -> int:
+    with get_db() as db:
+        return db.execute(text("SELECT version FROM tips_version")).scalar() or 0
+
+def _load_tips() -> List[Tip]:
+    with get_db() as db:
+        return [Tip(row.id, row.category, row.tip) for row in db.execute(text("SELECT id, category, tip FROM tips"))]
+
+tips_catalog = TipsCatalog(_load_tips_version, _load_tips)
+
 def get_random_tip():
     try:
-        with get_db() as db:
-            stmt = text("SELECT category, tip FROM tips ORDER BY RANDOM() LIMIT 1")
-            result = db.execute(stmt).first()
-            if result:
-                return result._asdict()['category'], result._asdict()['tip']
-            return None
+        tip = tips_catalog.snapshot().random()
+        if tip:
+            return tip.category, tip.tip
+        return None
     except Exception as e:
         logger.error(f"Error fetching random tip: {e}")
         raise
 
+@data_versions.user_write
 def check_and_award_achievements(user_id: int):
     try:
         with get_db() as db:
@@ -787,14 +975,20 @@ def check_and_award_achievements(user_id: int):
 
 def get_tips_by_category(category: str) -> List[Dict[str, str]]:
     try:
-        with get_db() as db:
-            stmt = text("SELECT id, tip AS title FROM tips WHERE category = :category")
-            tips = db.execute(stmt, {'category': category}).fetchall()
-            return [{'id': tip.id, 'title': tip.title} for tip in tips]
+        tips = tips_catalog.snapshot().by_category.get(category, ())
+        return [{'id': tip.id, 'title': tip.tip} for tip in tips]
     except Exception as e:
         logger.error(f"Error fetching tips for category {category}: {e}")
         raise
 
+def get_tip(tip_id: int) -> Optional[Dict[str, Any]]:
+    try:
+        tip = tips_catalog.snapshot().by_id.get(tip_id)
+        return tip._asdict() if tip else None
+    except Exception as e:
+        logger.error(f"Error fetching tip {tip_id}: {e}")
+        raise
+
 def get_habits_with_progress(user_id: int) -> List[Dict[str, any]]:
     try:
         with get_db() as db:
@@ -839,6 +1033,7 @@ def get_habit_streak(user_id: int, habit_id: int) -> int:
         logger.error(f"Error calculating habit streak for user {user_id}, habit {habit_id}: {e}")
         raise
  
+@data_versions.user_write
 def delete_sport_achievement(user_id: int, achievement_id: int):
     """
     Удаляет конкретное спортивное достижение пользователя по его ID.
@@ -856,6 +1051,7 @@ def delete_sport_achievement(user_id: int, achievement_id: int):
         logger.error(f"Error deleting sport achievement {achievement_id} for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def delete_habit(user_id: int, habit_id: int):
     """
     Удаляет конкретную привычку пользователя по её ID, включая связанные записи в habit_completions.
@@ -875,6 +1071,7 @@ def delete_habit(user_id: int, habit_id: int):
         logger.error(f"Error deleting habit {habit_id} for user {user_id}: {e}")
         raise
 
+@data_versions.user_write
 def delete_goal(user_id: int, goal_id: int):
     """
     Удаляет конкретную цель пользователя по её ID, включая связанные записи в goal_completions.
@@ -957,36 +1154,42 @@ def get_goals(user_id: int) -> List[Dict[str, any]]:
         logger.error(f"Error fetching goals for user_id {user_id}: {e}")
         raise
 
-def reset_goals():
+@data_versions.bulk_write
+def reset_goals(tier: str = 'all'):
     """
     Сбрасывает прогресс для ежедневных и еженедельных целей.
     Ежедневные сбрасываются каждый день.
     Еженедельные сбрасываются в понедельник.
+    Для спящих пользователей (tier='dormant') задача запускается раз в неделю,
+    поэтому еженедельные цели сбрасываются в любой день.
     """
     try:
         with get_db() as db:
             today = date.today()
+            tier_filter = _tier_filter(tier)
+            params = {'dormant_days': DORMANT_AFTER_DAYS}
             
             # Сброс всех ежедневных целей
-            db.execute(text("""
+            db.execute(text(f"""
                 UPDATE goals SET current_value = 0, is_completed = false 
-                WHERE goal_type = 'daily' AND is_completed = true
-            """))
-            logger.info("Reset progress for daily goals.")
+                WHERE goal_type = 'daily' AND is_completed = true AND {tier_filter}
+            """), params)
+            logger.info(f"Reset progress for daily goals ({tier} users).")
 
             # Если сегодня понедельник (weekday() == 0), сбрасываем еженедельные цели
-            if today.weekday() == 0:
-                db.execute(text("""
+            if today.weekday() == 0 or tier == 'dormant':
+                db.execute(text(f"""
                     UPDATE goals SET current_value = 0, is_completed = false 
-                    WHERE goal_type = 'weekly'
-                """))
-                logger.info("Reset progress for weekly goals because it's Monday.")
+                    WHERE goal_type = 'weekly' AND {tier_filter}
+                """), params)
+                logger.info(f"Reset progress for weekly goals ({tier} users).")
             
             db.commit()
     except Exception as e:
         logger.error(f"Error resetting goals: {e}")
         raise
 
+@data_versions.user_write
 def set_user_timezone(user_id: int, timezone: str):
     """Устанавливает часовой пояс для пользователя."""
     try:
@@ -994,21 +1197,27 @@ def set_user_timezone(user_id: int, timezone: str):
             stmt = text("UPDATE users SET timezone = :timezone WHERE user_id = :user_id")
             db.execute(stmt, {'timezone': timezone, 'user_id': user_id})
             db.commit()
+            user_timezone_cache.set(str(user_id), timezone, USER_TIMEZONE_CACHE_TTL)
             logger.info(f"Set timezone for user {user_id} to {timezone}")
     except Exception as e:
         logger.error(f"Error setting timezone for user {user_id}: {e}")
         raise
 
+def _load_user_timezone(user_id: int) -> str:
+    with get_db() as db:
+        stmt = text("SELECT timezone FROM users WHERE user_id = :user_id")
+        result = db.execute(stmt, {'user_id': user_id}).scalar_one_or_none()
+        return result or DEFAULT_TIMEZONE
+
 def get_user_timezone(user_id: int) -> str:
-    """Получает часовой пояс пользователя из базы данных."""
+    """Получает часовой пояс пользователя (из кэша, при промахе - из базы данных)."""
     try:
-        with get_db() as db:
-            stmt = text("SELECT timezone FROM users WHERE user_id = :user_id")
-            result = db.execute(stmt, {'user_id': user_id}).scalar_one_or_none()
-            return result or 'Asia/Almaty'
+        return user_timezone_cache.get_or_load(
+            str(user_id), lambda: _load_user_timezone(user_id), USER_TIMEZONE_CACHE_TTL
+        )
     except Exception as e:
         logger.error(f"Error getting timezone for user {user_id}: {e}")
-        return 'Asia/Almaty'
+        return DEFAULT_TIMEZONE
     
 def get_paginated_achievements(user_id: int, page: int = 1, per_page: int = 5) -> Tuple[List[Dict[str, Any]], int]:
     offset = (page - 1) * per_page
@@ -1037,33 +1246,38 @@ def get_paginated_goals(user_id: int, page: int = 1, per_page: int = 5) -> Tuple
         total = db.execute(stmt_total, {'uid': user_id}).scalar_one()
         return [{'id': item.id, 'name': item.name} for item in items], total
 
-def reset_missed_streaks():
-    """Сбрасывает стрики для целей, которые не были выполнены. Вызывается ежедневно."""
+@data_versions.bulk_write
+def reset_missed_streaks(tier: str = 'all'):
+    """
+    Сбрасывает стрики для целей, которые не были выполнены. Вызывается ежедневно для активных
+    пользователей и раз в неделю для спящих (tier='dormant', еженедельные цели проверяются в любой день).
+    """
     today = date.today()
     yesterday = today - timedelta(days=1)
     with get_db() as db:
         try:
+            tier_filter = _tier_filter(tier, "user_id")
             # Сброс для ежедневных целей, не выполненных вчера
-            stmt_daily = text("""
-                UPDATE goals SET streak = 0 WHERE goal_type = 'daily' AND streak > 0 AND id NOT IN (
+            stmt_daily = text(f"""
+                UPDATE goals SET streak = 0 WHERE goal_type = 'daily' AND streak > 0 AND {tier_filter} AND id NOT IN (
                     SELECT goal_id FROM goal_completions WHERE completion_date = :yesterday AND completed = true AND goal_id IS NOT NULL
                 )
             """)
-            db.execute(stmt_daily, {'yesterday': yesterday})
-            logger.info("Reset streaks for missed daily goals.")
+            db.execute(stmt_daily, {'yesterday': yesterday, 'dormant_days': DORMANT_AFTER_DAYS})
+            logger.info(f"Reset streaks for missed daily goals ({tier} users).")
 
             # Если сегодня понедельник, сброс для еженедельных целей
-            if today.weekday() == 0:
+            if today.weekday() == 0 or tier == 'dormant':
                 last_week_start = today - timedelta(days=7)
                 last_week_end = today - timedelta(days=1)
-                stmt_weekly = text("""
-                    UPDATE goals g SET streak = 0 WHERE g.goal_type = 'weekly' AND g.streak > 0 AND (
+                stmt_weekly = text(f"""
+                    UPDATE goals g SET streak = 0 WHERE g.goal_type = 'weekly' AND g.streak > 0 AND {_tier_filter(tier, "g.user_id")} AND (
                         SELECT COUNT(id) FROM goal_completions gc 
                         WHERE gc.goal_id = g.id AND gc.completion_date BETWEEN :start_date AND :end_date AND gc.completed = true
                     ) < g.target_value
                 """)
-                db.execute(stmt_weekly, {'start_date': last_week_start, 'end_date': last_week_end})
-                logger.info("Reset streaks for missed weekly goals.")
+                db.execute(stmt_weekly, {'start_date': last_week_start, 'end_date': last_week_end, 'dormant_days': DORMANT_AFTER_DAYS})
+                logger.info(f"Reset streaks for missed weekly goals ({tier} users).")
             db.commit()
         except Exception as e:
             logger.error(f"Error in reset_missed_streaks: {e}")
@@ -1076,7 +1290,7 @@ def get_full_user_stats(user_id: int) -> Dict[str, Any]:
         today = date.today()
         seven_days_ago = today - timedelta(days=7)
         
-        today_main_stats = db.execute(text("SELECT * FROM daily_stats WHERE user_id = :uid AND stat_date = :today"), {'uid': user_id, 'today': today}).first()
+        today_main_stats = get_today_stats_for_user(user_id)
         if not today_main_stats: return {'today_main_stats': None}
         
         screen_breakdown = {r.activity_name: r.duration_minutes for r in db.execute(text("SELECT activity_name, duration_minutes FROM screen_activities WHERE user_id = :uid AND activity_date = :today"), {'uid': user_id, 'today': today})}
@@ -1094,7 +1308,7 @@ def get_full_user_stats(user_id: int) -> Dict[str, Any]:
         history_productive_time_map = {r.activity_date: r.total for r in db.execute(text("SELECT activity_date, SUM(duration_minutes) as total FROM productive_activities WHERE user_id = :uid AND activity_date >= :start AND activity_date < :today GROUP BY activity_date"), {'uid': user_id, 'start': seven_days_ago, 'today': today})}
 
         return {
-            'today_main_stats': today_main_stats._asdict(),
+            'today_main_stats': today_main_stats,
             'today_screen_time_total': sum(screen_breakdown.values()),
             'screen_time_breakdown': screen_breakdown,
             'productive_time_actual': sum(productive_breakdown.values()),
@@ -1142,6 +1356,7 @@ def get_paginated_productive_activities_for_today(user_id: int, page: int = 1, p
         
         return [{'id': item.id, 'name': item.name, 'duration': item.duration} for item in items], total
 
+@data_versions.user_write
 def delete_screen_activity(user_id: int, activity_id: int) -> int:
     """Удаляет 'не полезную' активность и вычитает ее время из daily_stats."""
     with get_db() as db:
@@ -1162,10 +1377,13 @@ def delete_screen_activity(user_id: int, activity_id: int) -> int:
                 UPDATE daily_stats 
                 SET screen_time_actual = screen_time_actual - :duration 
                 WHERE user_id = :uid AND stat_date = :today AND screen_time_actual >= :duration
+                RETURNING *
             """)
-            db.execute(stmt_update_total, {'duration': duration, 'uid': user_id, 'today': date.today()})
+            today = date.today()
+            row = db.execute(stmt_update_total, {'duration': duration, 'uid': user_id, 'today': today}).first()
 
             db.commit()
+            _cache_today_stats(user_id, today, row)
             logger.info(f"Deleted screen activity {activity_id} ({duration} mins) for user {user_id}")
             return duration
         except Exception as e:
@@ -1173,6 +1391,7 @@ def delete_screen_activity(user_id: int, activity_id: int) -> int:
             logger.error(f"Error deleting screen activity {activity_id} for user {user_id}: {e}")
             raise
 
+@data_versions.user_write
 def delete_productive_activity(user_id: int, activity_id: int):
     """Удаляет 'полезную' активность."""
     with get_db() as db:
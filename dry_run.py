@@ -0,0 +1,64 @@
+"""
+Заглушка Bot для пробных (dry-run) прогонов CRON-задач.
+Ничего не отправляет в Telegram: записывает вызовы, имитирует задержку сети
+и, при необходимости, ответы 429 (flood control), чтобы измерить пропускную
+способность рассылки без сообщений реальным пользователям.
+"""
+import asyncio
+from collections import Counter
+from typing import Any, Dict, List
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.methods import SendMessage
+
+DRY_RUN_BOT_ID = 0
+# Ключи FSM строятся без id бота, поэтому пробный прогон пишет состояния под своим
+# префиксом, чтобы не затереть диалоги настоящих пользователей
+DRY_RUN_KEY_BUILDER = DefaultKeyBuilder(prefix="fsm-dry-run")
+# Сколько последних вызовов хранить для ответа
+DRY_RUN_MAX_RECORDED_CALLS = 20
+
+
+class DryRunBot:
+    """Минимальная замена aiogram.Bot для кода CRON-задач."""
+
+    def __init__(self, latency_ms: int = 0, rate_limit_every: int = 0, retry_after: int = 1):
+        self.id = DRY_RUN_BOT_ID
+        self.latency = max(latency_ms, 0) / 1000
+        # Каждый N-й вызов завершается TelegramRetryAfter (0 - не имитировать)
+        self.rate_limit_every = max(rate_limit_every, 0)
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.rate_limited = 0
+        self.recorded: List[Dict[str, Any]] = []
+        self._total_calls = 0
+
+    async def send_message(self, chat_id: int, text: str, reply_markup: Any = None, **kwargs: Any) -> None:
+        self._total_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_every and self._total_calls % self.rate_limit_every == 0:
+            self.rate_limited += 1
+            raise TelegramRetryAfter(
+                method=SendMessage(chat_id=chat_id, text=text),
+                message="Too Many Requests (dry run)",
+                retry_after=self.retry_after,
+            )
+        self.calls['sendMessage'] += 1
+        if len(self.recorded) < DRY_RUN_MAX_RECORDED_CALLS:
+            self.recorded.append({
+                'method': 'sendMessage',
+                'chat_id': chat_id,
+                'text_length': len(text),
+                'has_markup': reply_markup is not None,
+            })
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'calls': dict(self.calls),
+            'rate_limited': self.rate_limited,
+            'latency_ms': int(self.latency * 1000),
+            'rate_limit_every': self.rate_limit_every,
+            'sample_calls': self.recorded,
+        }
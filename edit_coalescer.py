@@ -0,0 +1,132 @@
+"""
+Склейка частых правок одного сообщения.
+При быстрых нажатиях на клавиатуру (утренний опрос) каждое нажатие перерисовывало
+сообщение через editMessageText. Здесь правки одного сообщения, пришедшие в пределах
+короткого окна, сливаются в одну с последним содержимым, а правка пропускается совсем,
+если итоговые текст и клавиатура совпадают с уже показанными.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Окно, в пределах которого правки одного сообщения сливаются, секунды
+EDIT_DEBOUNCE_SECONDS = float(os.getenv("EDIT_DEBOUNCE_SECONDS", 0.5))
+# Для скольких сообщений помнить хэш показанного содержимого
+EDIT_HASH_CACHE_SIZE = int(os.getenv("EDIT_HASH_CACHE_SIZE", 10000))
+
+MessageKey = Tuple[int, int]
+
+
+def render_hash(text: Optional[str], reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+    markup_json = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ""
+    return hashlib.sha1(f"{text or ''}\x00{markup_json}".encode()).hexdigest()
+
+
+class _PendingEdit:
+    __slots__ = ("message", "text", "reply_markup", "task")
+
+    def __init__(self, message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup]):
+        self.message = message
+        self.text = text
+        self.reply_markup = reply_markup
+        self.task: Optional[asyncio.Task] = None
+
+
+class EditCoalescer:
+    """Отложенные правки сообщений с ключом (chat_id, message_id)."""
+
+    def __init__(self, window: float = EDIT_DEBOUNCE_SECONDS, hash_cache_size: int = EDIT_HASH_CACHE_SIZE):
+        self.window = window
+        self.hash_cache_size = hash_cache_size
+        self.pending: Dict[MessageKey, _PendingEdit] = {}
+        # Правки, которые уже отправляются в Telegram (ожидание окна прошло)
+        self.flushing: Dict[MessageKey, asyncio.Task] = {}
+        # Хэш содержимого, которое сейчас показано в сообщении
+        self.shown: "OrderedDict[MessageKey, str]" = OrderedDict()
+        self.scheduled = registry.counter('message_edits_scheduled')
+        self.merged = registry.counter('message_edits_merged')
+        self.skipped = registry.counter('message_edits_skipped_unchanged')
+        self.sent = registry.counter('message_edits_sent')
+
+    @staticmethod
+    def _key(message: Message) -> MessageKey:
+        return message.chat.id, message.message_id
+
+    def schedule(self, message: Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Запланировать правку; более поздняя правка того же сообщения заменяет ожидающую."""
+        key = self._key(message)
+        self.scheduled.inc()
+        if key not in self.shown:
+            self._remember(key, render_hash(message.text, message.reply_markup))
+        entry = self.pending.get(key)
+        if entry is not None:
+            entry.text, entry.reply_markup = text, reply_markup
+            self.merged.inc()
+            return
+        entry = self.pending[key] = _PendingEdit(message, text, reply_markup)
+        entry.task = asyncio.create_task(self._flush_later(key))
+
+    async def cancel(self, message: Message):
+        """
+        Отменить ожидающую и уже отправляемую правку, например перед окончательной правкой
+        сообщения напрямую. Возвращается, когда отменённые правки завершились: устаревшая
+        перерисовка не может прийти в Telegram после окончательной правки.
+        """
+        key = self._key(message)
+        tasks = []
+        entry = self.pending.pop(key, None)
+        if entry is not None and entry.task is not None:
+            tasks.append(entry.task)
+        flushing = self.flushing.get(key)
+        if flushing is not None:
+            tasks.append(flushing)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.shown.pop(key, None)
+
+    def _remember(self, key: MessageKey, content_hash: str):
+        self.shown[key] = content_hash
+        self.shown.move_to_end(key)
+        if len(self.shown) > self.hash_cache_size:
+            self.shown.popitem(last=False)
+
+    async def _flush_later(self, key: MessageKey):
+        await asyncio.sleep(self.window)
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+        content_hash = render_hash(entry.text, entry.reply_markup)
+        if self.shown.get(key) == content_hash:
+            self.skipped.inc()
+            return
+        # Предыдущая правка этого сообщения ещё отправляется: дожидаемся её, чтобы не обогнать
+        previous = self.flushing.get(key)
+        task = self.flushing[key] = asyncio.current_task()
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await entry.message.edit_text(entry.text, reply_markup=entry.reply_markup)
+            self.sent.inc()
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.error(f"Failed to edit message {key}: {e}")
+                return
+        except Exception as e:
+            logger.error(f"Failed to edit message {key}: {e}")
+            return
+        finally:
+            if self.flushing.get(key) is task:
+                del self.flushing[key]
+        self._remember(key, content_hash)
@@ -0,0 +1,118 @@
+"""
+Кэш FSM на время обработки одного апдейта.
+Обработчики опросов читают данные FSM по нескольку раз за нажатие (get_data, затем
+update_data, затем снова get_data), и каждое обращение было отдельным запросом к Redis.
+Здесь состояние и данные загружаются одним MGET до обработчика, чтения и записи
+внутри обработчика идут в память, а изменения сохраняются одним пайплайном после него:
+не больше двух обращений к Redis на апдейт.
+"""
+import copy
+from typing import Any, Awaitable, Callable, Dict, Optional, cast
+
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from fsm_storage import CompactRedisStorage
+from metrics import registry
+
+
+class CachedFSMContext(FSMContext):
+    """FSMContext, который держит состояние и данные в памяти до flush()."""
+
+    storage: CompactRedisStorage
+
+    def __init__(self, storage: CompactRedisStorage, key: StorageKey) -> None:
+        super().__init__(storage=storage, key=key)
+        self._state: Optional[str] = None
+        self._data: Dict[str, Any] = {}
+        self._loaded = False
+        self._state_changed = False
+        self._data_changed = False
+
+    async def load(self) -> None:
+        self._state, self._data = await self.storage.load(self.key)
+        self._loaded = True
+
+    async def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            await self.load()
+
+    async def set_state(self, state: StateType = None) -> None:
+        await self._ensure_loaded()
+        self._state = state.state if isinstance(state, State) else state
+        self._state_changed = True
+
+    async def get_state(self) -> Optional[str]:
+        await self._ensure_loaded()
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        await self._ensure_loaded()
+        self._data = copy.deepcopy(data)
+        self._data_changed = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        await self._ensure_loaded()
+        # Копия, как после чтения из Redis: правки словаря без update_data не попадают в кэш
+        return copy.deepcopy(self._data)
+
+    async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        await self._ensure_loaded()
+        return copy.deepcopy(self._data.get(key, default))
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        await self._ensure_loaded()
+        self._data.update(copy.deepcopy(kwargs))
+        self._data_changed = True
+        return copy.deepcopy(self._data)
+
+    async def flush(self) -> bool:
+        """Сохраняет накопленные изменения одним пайплайном; False, если сохранять нечего."""
+        if not (self._state_changed or self._data_changed):
+            return False
+        await self.storage.save(
+            self.key,
+            self._state,
+            self._data,
+            state_changed=self._state_changed,
+            data_changed=self._data_changed,
+        )
+        self._state_changed = self._data_changed = False
+        return True
+
+
+class CachedFSMContextMiddleware(FSMContextMiddleware):
+    """Замена dp.fsm: отдаёт обработчикам CachedFSMContext и сохраняет его после обработки."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.flushes = registry.counter('fsm_context_flushes')
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        bot: Bot = cast(Bot, data["bot"])
+        resolved = self.resolve_event_context(bot, data)
+        data["fsm_storage"] = self.storage
+        if resolved is None:
+            return await handler(event, data)
+        # get_context() по-прежнему отдаёт обычный FSMContext для кода вне обработчиков
+        context = CachedFSMContext(storage=cast(CompactRedisStorage, self.storage), key=resolved.key)
+        async with self.events_isolation.lock(key=context.key):
+            await context.load()
+            data.update({"state": context, "raw_state": await context.get_state()})
+            try:
+                return await handler(event, data)
+            finally:
+                # Изменения, сделанные до исключения, сохраняются, как и без кэша
+                if await context.flush():
+                    self.flushes.inc()
@@ -0,0 +1,206 @@
+"""
+Хранилище FSM в Redis с компактным кодированием и сроком жизни диалогов.
+Данные FSM кодируются msgpack вместо JSON, а ключи состояния и данных получают TTL
+по группе состояний: брошенный утренний опрос или ввод активности больше не
+остаётся в Redis навсегда. Старые значения в JSON читаются как раньше.
+"""
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+import msgpack
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+# TTL для групп состояний без отдельной настройки, секунды
+FSM_DEFAULT_TTL = int(os.getenv("FSM_DEFAULT_TTL", 24 * 3600))
+
+# TTL по группам состояний (StatesGroup), секунды
+FSM_STATE_GROUP_TTLS: Dict[str, int] = {
+    # Опросы, отправляемые CRON-задачами: живут до следующей рассылки
+    "MorningPoll": 12 * 3600,
+    "EveningHabitPoll": 12 * 3600,
+    "EveningGoalPoll": 12 * 3600,
+    "ProductivityPoll": 12 * 3600,
+    # Короткие диалоги ввода и навигация
+    "LogActivity": 3 * 3600,
+    "SetGoal": 3 * 3600,
+    "AddHabit": 3 * 3600,
+    "SportAchievement": 3 * 3600,
+    "Feedback": 3 * 3600,
+    "TipsSelection": 3600,
+    "HelpSection": 3600,
+}
+
+# Ставит данные с TTL ключа состояния (или TTL по умолчанию, если состояния нет)
+_SET_DATA_SCRIPT = """
+local ttl = redis.call('ttl', KEYS[1])
+if ttl <= 0 then
+    ttl = tonumber(ARGV[2])
+end
+return redis.call('set', KEYS[2], ARGV[1], 'EX', ttl)
+"""
+
+NO_STATE_GROUP = "(без состояния)"
+
+
+def state_group(state: Optional[str]) -> str:
+    """'MorningPoll:planning_day' -> 'MorningPoll'."""
+    if not state:
+        return NO_STATE_GROUP
+    return state.split(":", 1)[0]
+
+
+class CompactRedisStorage(RedisStorage):
+    """RedisStorage с msgpack-кодированием данных и TTL по группам состояний."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._set_data_script = self.redis.register_script(_SET_DATA_SCRIPT)
+
+    @staticmethod
+    def ttl_for_state(state: StateType) -> int:
+        value = state.state if isinstance(state, State) else state
+        return FSM_STATE_GROUP_TTLS.get(state_group(value), FSM_DEFAULT_TTL)
+
+    @staticmethod
+    def encode_data(data: Dict[str, Any]) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def decode_data(value: Any) -> Dict[str, Any]:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        # Значения, записанные до перехода на msgpack: JSON-объект начинается с '{',
+        # а msgpack-словарь - с байта 0x80-0x8f, 0xde или 0xdf
+        if value[:1] == b"{":
+            return json.loads(value)
+        return msgpack.unpackb(value, raw=False, strict_map_key=False)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if state is None:
+            await super().set_state(key, state)
+            return
+        ttl = self.ttl_for_state(state)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(
+                self.key_builder.build(key, "state"),
+                state.state if isinstance(state, State) else state,
+                ex=ttl,
+            )
+            # Данные диалога живут столько же, сколько его состояние
+            pipe.expire(self.key_builder.build(key, "data"), ttl)
+            await pipe.execute()
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not data:
+            await self.redis.delete(self.key_builder.build(key, "data"))
+            return
+        await self._set_data_script(
+            keys=[self.key_builder.build(key, "state"), self.key_builder.build(key, "data")],
+            args=[self.encode_data(data), FSM_DEFAULT_TTL],
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.redis.get(self.key_builder.build(key, "data"))
+        if value is None:
+            return {}
+        return self.decode_data(value)
+
+    async def load(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Состояние и данные одним MGET."""
+        state, data = await self.redis.mget(
+            self.key_builder.build(key, "state"), self.key_builder.build(key, "data")
+        )
+        if isinstance(state, bytes):
+            state = state.decode("utf-8")
+        return state, self.decode_data(data) if data is not None else {}
+
+    async def save(
+        self,
+        key: StorageKey,
+        state: Optional[str],
+        data: Dict[str, Any],
+        state_changed: bool = True,
+        data_changed: bool = True,
+    ) -> None:
+        """Записывает изменившиеся состояние и данные одним пайплайном."""
+        state_key = self.key_builder.build(key, "state")
+        data_key = self.key_builder.build(key, "data")
+        ttl = self.ttl_for_state(state) if state is not None else FSM_DEFAULT_TTL
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if state is None:
+                if state_changed:
+                    pipe.delete(state_key)
+            elif state_changed:
+                pipe.set(state_key, state, ex=ttl)
+            else:
+                # Данные диалога живут столько же, сколько его состояние
+                pipe.expire(state_key, ttl)
+            if data_changed:
+                if data:
+                    pipe.set(data_key, self.encode_data(data), ex=ttl)
+                else:
+                    pipe.delete(data_key)
+            elif state_changed and state is not None:
+                pipe.expire(data_key, ttl)
+            await pipe.execute()
+
+    async def memory_report(self, scan_count: int = 1000) -> Dict[str, Dict[str, int]]:
+        """
+        Ключи FSM и занимаемая ими память по группам состояний (SCAN + MEMORY USAGE).
+        Ключ данных относится к группе состояния того же пользователя.
+        """
+        prefix = self.key_builder.prefix
+        separator = self.key_builder.separator
+        state_suffix = f"{separator}state"
+        data_suffix = f"{separator}data"
+
+        sizes: Dict[str, int] = {}
+        no_ttl = set()
+        states: Dict[str, Optional[str]] = {}
+        batch = []
+
+        async def flush_batch():
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for redis_key in batch:
+                    pipe.memory_usage(redis_key)
+                    pipe.ttl(redis_key)
+                    if redis_key.endswith(state_suffix):
+                        pipe.get(redis_key)
+                results = await pipe.execute(raise_on_error=False)
+            idx = 0
+            for redis_key in batch:
+                usage, ttl = results[idx], results[idx + 1]
+                idx += 2
+                sizes[redis_key] = usage if isinstance(usage, int) else 0
+                if ttl == -1:
+                    no_ttl.add(redis_key)
+                if redis_key.endswith(state_suffix):
+                    value = results[idx]
+                    idx += 1
+                    states[redis_key[:-len(state_suffix)]] = value.decode() if isinstance(value, bytes) else value
+            batch.clear()
+
+        async for raw_key in self.redis.scan_iter(match=f"{prefix}{separator}*", count=scan_count):
+            batch.append(raw_key.decode() if isinstance(raw_key, bytes) else raw_key)
+            if len(batch) >= scan_count:
+                await flush_batch()
+        if batch:
+            await flush_batch()
+
+        report: Dict[str, Dict[str, int]] = defaultdict(lambda: {"state_keys": 0, "data_keys": 0, "bytes": 0, "no_ttl": 0})
+        for redis_key, size in sizes.items():
+            if redis_key.endswith(state_suffix):
+                base, kind = redis_key[:-len(state_suffix)], "state_keys"
+            elif redis_key.endswith(data_suffix):
+                base, kind = redis_key[:-len(data_suffix)], "data_keys"
+            else:
+                base, kind = redis_key, "data_keys"
+            entry = report[state_group(states.get(base))]
+            entry[kind] += 1
+            entry["bytes"] += size
+            entry["no_ttl"] += redis_key in no_ttl
+        return dict(report)
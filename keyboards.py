@@ -1,15 +1,69 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from datetime import date
-from sqlalchemy import text
-from db import get_db, get_paginated_achievements, get_paginated_habits, get_paginated_goals, get_paginated_screen_activities_for_today, get_paginated_productive_activities_for_today
+from db import get_today_stats_for_user, get_paginated_achievements, get_paginated_habits, get_paginated_goals, get_paginated_screen_activities_for_today, get_paginated_productive_activities_for_today
+import copy
 import logging
 import math
-from typing import Optional, List, Dict, Tuple
+import callbacks
+from functools import lru_cache, wraps
+from pydantic import ConfigDict
+from typing import Callable, Optional, List, Dict, Tuple
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+# Клавиатуры без параметров собираются один раз при импорте, с параметрами -
+# кэшируются по аргументам. Все они общие для всех вызовов и потому неизменяемы.
+# Сколько вариантов клавиатуры с параметрами помнить (по id цели/привычки и т.п.)
+KEYBOARD_CACHE_SIZE = 1024
+
+
+class _FrozenList(list):
+    """Строка кнопок общей клавиатуры: изменение вызывает TypeError."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Shared keyboards are immutable, build a new InlineKeyboardMarkup instead")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(item, memo) for item in self]
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
+def _freeze(markup: InlineKeyboardMarkup) -> FrozenInlineKeyboardMarkup:
+    rows = _FrozenList(_FrozenList(row) for row in markup.inline_keyboard)
+    return FrozenInlineKeyboardMarkup.model_construct(inline_keyboard=rows)
+
+
+def _prebuilt(build: Callable[[], InlineKeyboardMarkup]) -> Callable[[], InlineKeyboardMarkup]:
+    """Собирает клавиатуру при импорте и возвращает один и тот же экземпляр."""
+    markup = _freeze(build())
+
+    @wraps(build)
+    def get() -> InlineKeyboardMarkup:
+        return markup
+    return get
+
+
+def _memoized(maxsize: Optional[int] = KEYBOARD_CACHE_SIZE):
+    """Кэширует клавиатуру по аргументам."""
+    def decorator(build):
+        return lru_cache(maxsize=maxsize)(wraps(build)(lambda *args, **kwargs: _freeze(build(*args, **kwargs))))
+    return decorator
+
+
+@_memoized()
 def get_main_menu_keyboard(include_settings: bool = False) -> InlineKeyboardMarkup:
     """
     Создает основное меню бота с кнопками для всех функций, включая настройки (если включено).
@@ -32,6 +86,7 @@ def get_main_menu_keyboard(include_settings: bool = False) -> InlineKeyboardMark
     logger.debug("Main menu keyboard created successfully")
     return builder.as_markup()
 
+@_prebuilt
 def get_achievements_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Создает меню для работы с достижениями.
@@ -45,6 +100,7 @@ def get_achievements_menu_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_habits_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Создает подменю для работы с привычками.
@@ -58,6 +114,7 @@ def get_habits_menu_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_goals_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Создает подменю для работы с целями.
@@ -82,14 +139,14 @@ def get_delete_achievements_keyboard(user_id: int, page: int = 1) -> InlineKeybo
     builder = InlineKeyboardBuilder()
 
     for ach in achievements:
-        builder.button(text=f"❌ {ach['name']}", callback_data=f"delete_achievement_{ach['id']}")
+        builder.button(text=f"❌ {ach['name']}", callback_data=callbacks.DeleteAchievementCallback.pack(ach['id']))
 
     total_pages = math.ceil(total_items / 5)
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"delete_achievement_page:{page-1}"))
+        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=callbacks.DeleteAchievementPageCallback.pack(page - 1)))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"delete_achievement_page:{page+1}"))
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=callbacks.DeleteAchievementPageCallback.pack(page + 1)))
     
     if nav_buttons:
         builder.row(*nav_buttons)
@@ -107,14 +164,14 @@ def get_delete_habits_keyboard(user_id: int, page: int = 1) -> InlineKeyboardMar
     builder = InlineKeyboardBuilder()
 
     for habit in habits:
-        builder.button(text=f"❌ {habit['name']}", callback_data=f"delete_habit_{habit['id']}")
+        builder.button(text=f"❌ {habit['name']}", callback_data=callbacks.DeleteHabitCallback.pack(habit['id']))
 
     total_pages = math.ceil(total_items / 5)
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"delete_habit_page:{page-1}"))
+        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=callbacks.DeleteHabitPageCallback.pack(page - 1)))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"delete_habit_page:{page+1}"))
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=callbacks.DeleteHabitPageCallback.pack(page + 1)))
 
     if nav_buttons:
         builder.row(*nav_buttons)
@@ -133,14 +190,14 @@ def get_delete_goals_keyboard(user_id: int, page: int = 1) -> InlineKeyboardMark
     builder = InlineKeyboardBuilder()
 
     for goal in goals:
-        builder.button(text=f"❌ {goal['name']}", callback_data=f"delete_goal_{goal['id']}")
+        builder.button(text=f"❌ {goal['name']}", callback_data=callbacks.DeleteGoalCallback.pack(goal['id']))
 
     total_pages = math.ceil(total_items / 5)
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"delete_goal_page:{page-1}"))
+        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=callbacks.DeleteGoalPageCallback.pack(page - 1)))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"delete_goal_page:{page+1}"))
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=callbacks.DeleteGoalPageCallback.pack(page + 1)))
 
     if nav_buttons:
         builder.row(*nav_buttons)
@@ -149,13 +206,14 @@ def get_delete_goals_keyboard(user_id: int, page: int = 1) -> InlineKeyboardMark
     builder.adjust(1)
     return builder.as_markup()
 
+@_prebuilt
 def get_tips_categories_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру с категориями советов.
     """
     logger.debug("Creating tips categories keyboard")
     categories = ["Мотивация", "Дисциплина", "Фокус", "Спорт", "Продуктивность", "Мышление"]
-    buttons = [[InlineKeyboardButton(text=category, callback_data=f"tip_category_{category}")] for category in categories]
+    buttons = [[InlineKeyboardButton(text=category, callback_data=callbacks.TipCategoryCallback.pack(category))] for category in categories]
     buttons.append([InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -164,22 +222,24 @@ def get_tips_by_category_keyboard(tips: List[Dict[str, str]]) -> InlineKeyboardM
     Создает клавиатуру со списком советов для выбранной категории.
     """
     logger.debug("Creating tips by category keyboard")
-    buttons = [[InlineKeyboardButton(text=tip['title'], callback_data=f"tip_{tip['id']}")] for tip in tips]
+    buttons = [[InlineKeyboardButton(text=tip['title'], callback_data=callbacks.TipCallback.pack(tip['id']))] for tip in tips]
     buttons.append([InlineKeyboardButton(text="« Назад к категориям", callback_data="category")])
     buttons.append([InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_memoized()
 def get_tip_content_keyboard(category: str) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для возврата к списку советов в категории.
     """
     logger.debug(f"Creating tip content keyboard for category: {category}")
     buttons = [
-        [InlineKeyboardButton(text="« Назад к советам", callback_data=f"tip_category_{category}")],
+        [InlineKeyboardButton(text="« Назад к советам", callback_data=callbacks.TipCategoryCallback.pack(category))],
         [InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_log_activity_type_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для выбора типа активности (полезная/не полезная).
@@ -198,39 +258,37 @@ def get_mark_done_keyboard(user_id: int) -> InlineKeyboardMarkup:
     """
     try:
         logger.debug(f"Creating mark done keyboard for user_id: {user_id}")
-        with get_db() as db_session:
-            stmt = text("SELECT * FROM daily_stats WHERE user_id = :uid AND stat_date = :today")
-            result = db_session.execute(stmt, {'uid': user_id, 'today': date.today()}).first()
-            if not result:
-                logger.debug(f"No daily stats found for user_id: {user_id}")
-                return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")]])
-            stats = result._asdict()
-            buttons = []
-            activities = [
-                ('workout', '⚔️ Тренировка', 'done_workout'),
-                ('stretching', '🧘 Растяжка', 'done_stretching'),
-                ('english', '🎓 Язык', 'done_english'),
-                ('reflection', '🤔 Размышления', 'done_reflection'),
-                ('coding', '💻 Кодинг', 'done_coding'),
-                ('planning', '📝 План', 'done_planning'),
-                ('walk', '🚶 Прогулка', 'done_walk'),
-            ]
-            row = []
-            for key, label, callback in activities:
-                if stats.get(f"{key}_planned", 0) == 1:
-                    row.append(InlineKeyboardButton(text=label, callback_data=callback))
-                    if len(row) == 2:
-                        buttons.append(row)
-                        row = []
-            if row:
-                buttons.append(row)
-            buttons.append([InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")])
-            logger.debug("Mark done keyboard created successfully")
-            return InlineKeyboardMarkup(inline_keyboard=buttons)
+        stats = get_today_stats_for_user(user_id)
+        if not stats:
+            logger.debug(f"No daily stats found for user_id: {user_id}")
+            return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")]])
+        buttons = []
+        activities = [
+            ('workout', '⚔️ Тренировка'),
+            ('stretching', '🧘 Растяжка'),
+            ('english', '🎓 Язык'),
+            ('reflection', '🤔 Размышления'),
+            ('coding', '💻 Кодинг'),
+            ('planning', '📝 План'),
+            ('walk', '🚶 Прогулка'),
+        ]
+        row = []
+        for key, label in activities:
+            if stats.get(f"{key}_planned", 0) == 1:
+                row.append(InlineKeyboardButton(text=label, callback_data=callbacks.DoneActivityCallback.pack(key)))
+                if len(row) == 2:
+                    buttons.append(row)
+                    row = []
+        if row:
+            buttons.append(row)
+        buttons.append([InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")])
+        logger.debug("Mark done keyboard created successfully")
+        return InlineKeyboardMarkup(inline_keyboard=buttons)
     except Exception as e:
         logger.error(f"Error generating mark done keyboard for user_id {user_id}: {e}")
         return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="« Назад в меню", callback_data="menu_back")]])
 
+@_prebuilt
 def get_confirm_clear_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для подтверждения сброса статистики.
@@ -242,6 +300,7 @@ def get_confirm_clear_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_morning_day_type_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для выбора типа дня.
@@ -253,11 +312,12 @@ def get_morning_day_type_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+MORNING_PLAN_KEYS = ('time', 'workout', 'english', 'coding', 'planning', 'stretching', 'reflection', 'walk')
+
 def get_morning_poll_keyboard(user_plan: dict = None) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для утреннего опроса.
     """
-    logger.debug("Creating morning poll keyboard")
     if user_plan is None:
         user_plan = {
             'time': None,
@@ -269,6 +329,13 @@ def get_morning_poll_keyboard(user_plan: dict = None) -> InlineKeyboardMarkup:
             'reflection': 0,
             'walk': 0
         }
+    # Вариантов плана немного, поэтому клавиатура кэшируется по значениям плана
+    return _morning_poll_keyboard(*(user_plan.get(key) for key in MORNING_PLAN_KEYS))
+
+@_memoized()
+def _morning_poll_keyboard(*plan) -> InlineKeyboardMarkup:
+    logger.debug("Creating morning poll keyboard")
+    user_plan = dict(zip(MORNING_PLAN_KEYS, plan))
     buttons = [
         [InlineKeyboardButton(text="Экранное время", callback_data="inactive")],
         [
@@ -326,6 +393,7 @@ def get_morning_poll_keyboard(user_plan: dict = None) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_memoized()
 def get_stats_keyboard(webapp_url: str) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для перехода к статистике через веб-приложение.
@@ -337,6 +405,7 @@ def get_stats_keyboard(webapp_url: str) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_timezone_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для выбора часового пояса.
@@ -350,6 +419,7 @@ def get_timezone_keyboard() -> InlineKeyboardMarkup:
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder # Убедитесь, что этот импорт есть в начале файла
 
+@_memoized()
 def get_settings_keyboard(current_tz: str) -> InlineKeyboardMarkup:
     """Создает меню настроек со сменой часового пояса."""
     logger.debug(f"Creating settings keyboard with timezone: {current_tz}")
@@ -365,6 +435,7 @@ def get_settings_keyboard(current_tz: str) -> InlineKeyboardMarkup:
     builder.adjust(1)
     return builder.as_markup()
 
+@_prebuilt
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру с кнопкой отмены.
@@ -375,6 +446,7 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_memoized()
 def get_goal_answer_keyboard(goal_id: int) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для ответа на вопрос о выполнении цели.
@@ -382,13 +454,14 @@ def get_goal_answer_keyboard(goal_id: int) -> InlineKeyboardMarkup:
     logger.debug(f"Creating goal answer keyboard for goal_id: {goal_id}")
     buttons = [
         [
-            InlineKeyboardButton(text="✅ Да", callback_data=f"goal_answer_{goal_id}_yes"),
-            InlineKeyboardButton(text="❌ Нет", callback_data=f"goal_answer_{goal_id}_no")
+            InlineKeyboardButton(text="✅ Да", callback_data=callbacks.GoalAnswerCallback.pack(goal_id, "yes")),
+            InlineKeyboardButton(text="❌ Нет", callback_data=callbacks.GoalAnswerCallback.pack(goal_id, "no"))
         ],
         [InlineKeyboardButton(text="« Отмена", callback_data="fsm_cancel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_goal_type_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для выбора типа цели (ежедневная или еженедельная).
@@ -401,6 +474,7 @@ def get_goal_type_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_goal_confirm_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для подтверждения создания цели.
@@ -412,6 +486,7 @@ def get_goal_confirm_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_help_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Создает подменю для раздела помощи с категориями.
@@ -430,6 +505,7 @@ def get_help_menu_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_memoized()
 def get_habit_answer_keyboard(habit_id: int) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для ответа на вопрос о выполнении привычки.
@@ -437,13 +513,14 @@ def get_habit_answer_keyboard(habit_id: int) -> InlineKeyboardMarkup:
     logger.debug(f"Creating habit answer keyboard for habit_id: {habit_id}")
     buttons = [
         [
-            InlineKeyboardButton(text="✅ Да", callback_data=f"habit_answer_{habit_id}_yes"),
-            InlineKeyboardButton(text="❌ Нет", callback_data=f"habit_answer_{habit_id}_no")
+            InlineKeyboardButton(text="✅ Да", callback_data=callbacks.HabitAnswerCallback.pack(habit_id, "yes")),
+            InlineKeyboardButton(text="❌ Нет", callback_data=callbacks.HabitAnswerCallback.pack(habit_id, "no"))
         ],
         [InlineKeyboardButton(text="« Отмена", callback_data="fsm_cancel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_free_activity_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Создает меню для работы со свободными активностями (записать/удалить).
@@ -456,14 +533,15 @@ def get_free_activity_menu_keyboard() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+@_prebuilt
 def get_delete_activity_type_keyboard() -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для выбора типа удаляемой активности.
     """
     logger.debug("Creating delete activity type keyboard")
     buttons = [
-        [InlineKeyboardButton(text="📱 Не полезная", callback_data="delete_activity_type_screen")],
-        [InlineKeyboardButton(text="💡 Полезная", callback_data="delete_activity_type_productive")],
+        [InlineKeyboardButton(text="📱 Не полезная", callback_data=callbacks.DeleteActivityTypeCallback.pack("screen"))],
+        [InlineKeyboardButton(text="💡 Полезная", callback_data=callbacks.DeleteActivityTypeCallback.pack("productive"))],
         [InlineKeyboardButton(text="« Назад", callback_data="menu_free_activity")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -489,15 +567,15 @@ def get_delete_activity_keyboard(user_id: int, activity_type: str, page: int = 1
     for act in activities:
         builder.button(
             text=f"❌ {act['name']} ({act['duration']} мин)",
-            callback_data=f"delete_activity_confirm_{activity_type}_{act['id']}"
+            callback_data=callbacks.DeleteActivityConfirmCallback.pack(activity_type, act['id'])
         )
 
     total_pages = math.ceil(total_items / per_page)
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"delete_activity_page_{activity_type}:{page-1}"))
+        nav_buttons.append(InlineKeyboardButton(text="⬅️", callback_data=callbacks.DeleteActivityPageCallback.pack(activity_type, page - 1)))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=f"delete_activity_page_{activity_type}:{page+1}"))
+        nav_buttons.append(InlineKeyboardButton(text="➡️", callback_data=callbacks.DeleteActivityPageCallback.pack(activity_type, page + 1)))
 
     if nav_buttons:
         builder.row(*nav_buttons)
@@ -0,0 +1,86 @@
+"""
+Отслеживание времени последнего обращения пользователей к боту.
+Запись в БД не чаще раза в час на пользователя и пачками, чтобы middleware
+не добавлял по запросу в Postgres на каждый апдейт.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Не чаще одного обновления last_seen_at на пользователя за этот интервал (секунды)
+LAST_SEEN_MIN_INTERVAL = int(os.getenv("LAST_SEEN_MIN_INTERVAL", 3600))
+# Сбрасываем накопленное в БД при таком размере пачки или по истечении интервала
+LAST_SEEN_BATCH_SIZE = int(os.getenv("LAST_SEEN_BATCH_SIZE", 100))
+LAST_SEEN_FLUSH_INTERVAL = int(os.getenv("LAST_SEEN_FLUSH_INTERVAL", 60))
+
+
+class LastSeenTracker:
+    """Копит id пользователей и пакетно записывает last_seen_at."""
+
+    def __init__(self):
+        # user_id -> time.monotonic() последней зафиксированной активности
+        self.recorded: Dict[int, float] = {}
+        self.pending: Set[int] = set()
+        self.last_flush = time.monotonic()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: int):
+        now = time.monotonic()
+        last = self.recorded.get(user_id)
+        if last is not None and now - last < LAST_SEEN_MIN_INTERVAL:
+            return
+        self.recorded[user_id] = now
+        self.pending.add(user_id)
+        if len(self.pending) >= LAST_SEEN_BATCH_SIZE or now - self.last_flush >= LAST_SEEN_FLUSH_INTERVAL:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        if not self.pending or (self._flush_task and not self._flush_task.done()):
+            return
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        user_ids, self.pending = list(self.pending), set()
+        self.last_flush = time.monotonic()
+        # Забываем давно отмеченных пользователей, чтобы словарь не рос бесконечно
+        cutoff = self.last_flush - LAST_SEEN_MIN_INTERVAL
+        self.recorded = {uid: ts for uid, ts in self.recorded.items() if ts >= cutoff}
+        if not user_ids:
+            return
+        try:
+            await asyncio.to_thread(db.touch_users_last_seen, user_ids)
+        except Exception as e:
+            logger.error(f"Failed to flush last_seen_at for {len(user_ids)} users: {e}")
+            # Разрешаем повторную запись при следующем обращении
+            for uid in user_ids:
+                self.recorded.pop(uid, None)
+
+
+last_seen_tracker = LastSeenTracker()
+
+
+class LastSeenMiddleware(BaseMiddleware):
+    """Outer-middleware на update: отмечает активность отправителя апдейта."""
+
+    def __init__(self, tracker: LastSeenTracker = last_seen_tracker):
+        self.tracker = tracker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is not None:
+            self.tracker.touch(user.id)
+        return await handler(event, data)
@@ -0,0 +1,111 @@
+"""
+Разовые задачи запуска при нескольких процессах (uvicorn --workers, несколько машин).
+Миграции выполняет тот процесс, который первым взял блокировку в Redis; после успеха
+он ставит отметку leader:<name>:done:<версия>. Остальные ждут отметку и стартуют без
+повторной работы - в том числе процессы, перезапущенные позже: пока версия (схемы БД)
+не сменилась, задачи не повторяются. Идемпотентные проверки, которые нужны при каждом
+запуске (вебхук), выполняет run_exclusive - без отметки, но не параллельно.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Максимальное время разовых задач; по истечении блокировка снимается сама
+LEADER_LOCK_TTL = int(os.getenv("LEADER_LOCK_TTL", 120))
+# Сколько живёт отметка о выполненных задачах запуска
+LEADER_DONE_TTL = int(os.getenv("LEADER_DONE_TTL", 7 * 24 * 3600))
+LEADER_POLL_INTERVAL = 0.5
+
+# Снимает блокировку, только если она всё ещё принадлежит этому процессу:
+# блокировку с истёкшим TTL мог уже взять другой процесс
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def release_lock(redis, lock_key: str, owner: str):
+    try:
+        await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, owner)
+    except Exception as e:
+        # Блокировка снимется сама по TTL
+        logger.warning(f"Failed to release {lock_key}: {e}")
+
+
+async def run_exclusive(redis, name: str, task: Callable[[], Awaitable[None]], ttl: int = LEADER_LOCK_TTL) -> bool:
+    """
+    Выполняет task, если удалось взять блокировку name; если её держит другой процесс,
+    он как раз выполняет ту же проверку, и task пропускается. Возвращает True, если task выполнен здесь.
+    """
+    lock_key = f"leader:{name}"
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        acquired = await redis.set(lock_key, owner, nx=True, ex=ttl)
+    except Exception as e:
+        logger.warning(f"Lock {name} failed: {e}, running {name} locally")
+        acquired = True
+    if not acquired:
+        return False
+    try:
+        await task()
+    finally:
+        await release_lock(redis, lock_key, owner)
+    return True
+
+
+async def run_as_leader(
+    redis,
+    name: str,
+    tasks: Callable[[], Awaitable[None]],
+    version: str,
+    ttl: int = LEADER_LOCK_TTL,
+) -> bool:
+    """
+    Выполняет tasks, если для version они ещё не выполнены и удалось взять блокировку
+    name; иначе ждёт отметку о выполнении. Возвращает True, если задачи выполнил этот процесс.
+    """
+    lock_key = f"leader:{name}"
+    done_key = f"leader:{name}:done:{version}"
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    deadline = time.monotonic() + ttl
+    while True:
+        try:
+            if await redis.exists(done_key):
+                return False
+            acquired = await redis.set(lock_key, owner, nx=True, ex=ttl)
+        except Exception as e:
+            # Без Redis ведём себя как одиночный процесс
+            logger.warning(f"Leader election for {name} failed: {e}, running startup tasks locally")
+            await tasks()
+            return True
+
+        if acquired:
+            logger.info(f"Process {owner} is the leader for {name}")
+            try:
+                await tasks()
+                try:
+                    await redis.set(done_key, owner, ex=LEADER_DONE_TTL)
+                except Exception as e:
+                    # Задачи идемпотентны: без отметки их повторит следующий процесс
+                    logger.warning(f"Failed to mark {name} as done: {e}")
+            finally:
+                await release_lock(redis, lock_key, owner)
+            return True
+
+        # Ждём отметку; если лидер упал и блокировка освободилась без неё - пробуем стать лидером сами
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LEADER_POLL_INTERVAL)
+            if await redis.exists(done_key):
+                return False
+            if not await redis.exists(lock_key):
+                break
+        else:
+            logger.warning(f"Leader tasks for {name} did not finish in {ttl}s, starting anyway")
+            return False
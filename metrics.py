@@ -0,0 +1,146 @@
+"""
+Простые внутрипроцессные метрики для CRON-задач и вебхука.
+"""
+import bisect
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+# Границы корзин гистограммы задержек, в миллисекундах
+DEFAULT_LATENCY_BUCKETS_MS: Sequence[float] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с фиксированными корзинами.
+    Хранит только счётчики, поэтому стоит O(1) памяти независимо от числа наблюдений.
+    """
+
+    def __init__(self, buckets_ms: Iterable[float] = DEFAULT_LATENCY_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        # Последняя корзина - всё, что больше верхней границы
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float):
+        value_ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def merge_snapshot(self, snapshot: Dict[str, Any]):
+        """Добавляет наблюдения из snapshot() другой гистограммы с теми же корзинами."""
+        count = snapshot.get('count', 0)
+        if not count:
+            return
+        buckets = snapshot.get('buckets', {})
+        for idx, bound in enumerate(self.buckets_ms):
+            self.counts[idx] += buckets.get(f"le_{bound}", 0)
+        self.counts[-1] += buckets.get('inf', 0)
+        self.count += count
+        self.total_ms += snapshot.get('avg_ms', 0.0) * count
+        self.max_ms = max(self.max_ms, snapshot.get('max_ms', 0.0))
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля сверху (верхняя граница корзины), в миллисекундах."""
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= threshold:
+                return self.buckets_ms[idx] if idx < len(self.buckets_ms) else self.max_ms
+        return self.max_ms
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.avg_ms, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 1),
+            'buckets': {f"le_{b}": c for b, c in zip(self.buckets_ms, self.counts)} | {'inf': self.counts[-1]},
+        }
+
+    def format_compact(self) -> str:
+        """Короткое текстовое представление для сообщений администратору."""
+        if not self.count:
+            return "нет данных"
+        return (
+            f"n={self.count}, avg={self.avg_ms:.0f}мс, p50≤{self.percentile(0.5):.0f}мс, "
+            f"p95≤{self.percentile(0.95):.0f}мс, max={self.max_ms:.0f}мс"
+        )
+
+
+class Counter:
+    """Монотонно растущий счётчик."""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+
+class Gauge:
+    """Текущее значение; может вычисляться функцией в момент снятия метрик."""
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def dec(self, n: float = 1):
+        self.value -= n
+
+    def get(self) -> float:
+        return self.fn() if self.fn is not None else self.value
+
+
+class MetricsRegistry:
+    """Именованные метрики процесса; одинаковое имя возвращает тот же объект."""
+
+    def __init__(self):
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Gauge] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def counter(self, name: str) -> Counter:
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def gauge(self, name: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        if name not in self.gauges:
+            self.gauges[name] = Gauge(fn)
+        elif fn is not None:
+            self.gauges[name].fn = fn
+        return self.gauges[name]
+
+    def histogram(self, name: str, buckets_ms: Iterable[float] = DEFAULT_LATENCY_BUCKETS_MS) -> LatencyHistogram:
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram(buckets_ms)
+        return self.histograms[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'counters': {name: c.value for name, c in self.counters.items()},
+            'gauges': {name: g.get() for name, g in self.gauges.items()},
+            'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+
+
+registry = MetricsRegistry()
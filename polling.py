@@ -0,0 +1,119 @@
+"""
+Режим long polling: альтернатива вебхуку для локальных нагрузочных тестов и
+отдельной машины-обработчика. Использует те же dp, обработчики и планировщик
+апдейтов, что и вебхук (порядок внутри пользователя, параллельность между
+пользователями). API-процесс FastAPI при этом запускается с BOT_MODE=polling,
+чтобы не выставлять вебхук.
+
+Пачка апдейтов подтверждается (offset следующего getUpdates) только после того, как
+планировщик её обработал: если процесс упадёт раньше, Telegram доставит пачку снова.
+Доставка «хотя бы один раз» - после падения часть пачки может обработаться повторно.
+
+Запуск:
+    BOT_MODE=polling python polling.py
+"""
+import asyncio
+import logging
+import os
+import signal
+from typing import Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+
+from app import bot, dp, update_queue, on_startup, on_shutdown
+
+logger = logging.getLogger(__name__)
+
+# Максимум апдейтов за один getUpdates (ограничение Telegram - 100)
+POLLING_LIMIT = min(int(os.getenv("POLLING_LIMIT", 100)), 100)
+# Длительность long polling запроса, секунды
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", 30))
+# Пауза после ошибки сети/API, растёт до максимума
+POLLING_BACKOFF_MAX = float(os.getenv("POLLING_BACKOFF_MAX", 30))
+# Как часто повторять постановку в очередь, если планировщик переполнен
+POLLING_QUEUE_RETRY_INTERVAL = 0.1
+
+
+class PollingOffsets:
+    """
+    confirmed - offset последнего успешного getUpdates (апдейты ниже него Telegram удалил);
+    enqueued - offset после последнего апдейта, поставленного в очередь планировщика.
+    """
+
+    def __init__(self):
+        self.confirmed: Optional[int] = None
+        self.enqueued: Optional[int] = None
+
+
+async def poll_updates(stop_event: asyncio.Event, offsets: PollingOffsets):
+    # getUpdates не работает, пока у бота выставлен вебхук
+    await bot.delete_webhook(drop_pending_updates=False)
+    allowed_updates = dp.resolve_used_update_types()
+    logger.info(f"Polling started, allowed updates: {allowed_updates}")
+
+    backoff = 1.0
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(
+                offset=offsets.enqueued,
+                limit=POLLING_LIMIT,
+                timeout=POLLING_TIMEOUT,
+                allowed_updates=allowed_updates,
+                request_timeout=POLLING_TIMEOUT + 10
+            )
+            backoff = 1.0
+            offsets.confirmed = offsets.enqueued
+        except TelegramRetryAfter as e:
+            logger.warning(f"getUpdates rate limited, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+            continue
+        except (TelegramNetworkError, TelegramAPIError) as e:
+            logger.error(f"getUpdates failed: {e}, retrying in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, POLLING_BACKOFF_MAX)
+            continue
+
+        for update in updates:
+            # Не теряем апдейты: при переполнении ждём, пока планировщик освободится
+            while not update_queue.put_nowait(update):
+                await asyncio.sleep(POLLING_QUEUE_RETRY_INTERVAL)
+            offsets.enqueued = update.update_id + 1
+        # Следующий getUpdates подтвердит пачку - только после её обработки
+        await update_queue.join()
+
+
+async def confirm_processed(offsets: PollingOffsets):
+    """
+    При остановке подтверждает обработанные апдейты, которые ещё не подтверждены.
+    Вызывается только после того, как очередь планировщика опустела.
+    """
+    if offsets.enqueued is None or offsets.enqueued == offsets.confirmed:
+        return
+    try:
+        await bot.get_updates(offset=offsets.enqueued, limit=1, timeout=0)
+    except Exception as e:
+        logger.warning(f"Failed to confirm processed updates below {offsets.enqueued}: {e}")
+
+
+async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await on_startup(register_webhook=False)
+    offsets = PollingOffsets()
+    poller = asyncio.create_task(poll_updates(stop_event, offsets))
+    await stop_event.wait()
+    logger.info("Stopping polling...")
+    poller.cancel()
+    await asyncio.gather(poller, return_exceptions=True)
+    # Дообрабатываем поставленные апдейты; подтверждаем их, только если очередь опустела.
+    # Не поставленный хвост пачки Telegram доставит снова после перезапуска
+    if await update_queue.stop():
+        await confirm_processed(offsets)
+    await on_shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+Общий пул соединений с Redis.
+Хранилище FSM, дедупликация апдейтов, координатор CRON и блокировка запуска
+работают через один клиент с ограниченным пулом: новые функции на Redis не
+добавляют своих соединений. Пул блокирующий - при исчерпании команда ждёт
+свободное соединение до REDIS_POOL_TIMEOUT вместо ошибки. Задержка команд и
+пайплайнов, ожидание пула и его исчерпание видны в /api/metrics.
+"""
+import os
+import time
+from typing import Any, Sequence
+
+import redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry as SyncRetry
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from metrics import registry
+
+# Максимум соединений процесса с Redis
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+# Сколько ждать свободного соединения, если пул исчерпан, секунды
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+# Таймауты установки соединения и ответа на команду, секунды
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+# Сколько раз повторять команду после таймаута или обрыва соединения
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", 3))
+# PING простаивающего соединения перед использованием, секунды
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+# Команды Redis обычно укладываются в миллисекунду, корзины мельче стандартных
+REDIS_LATENCY_BUCKETS_MS: Sequence[float] = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """BlockingConnectionPool, который считает ожидания свободного соединения."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.exhausted = registry.counter('redis_pool_exhausted')
+        self.timeouts = registry.counter('redis_pool_timeouts')
+        self.wait_latency = registry.histogram('redis_pool_wait', REDIS_LATENCY_BUCKETS_MS)
+        registry.gauge('redis_pool_in_use', lambda: len(self._in_use_connections))
+        registry.gauge('redis_pool_max').set(self.max_connections)
+
+    async def get_connection(self, command_name, *keys, **options):
+        if self.can_get_connection():
+            return await super().get_connection(command_name, *keys, **options)
+        # Все соединения заняты: команда будет ждать освобождения
+        self.exhausted.inc()
+        started = time.monotonic()
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except RedisConnectionError:
+            self.timeouts.inc()
+            raise
+        finally:
+            self.wait_latency.observe(time.monotonic() - started)
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.monotonic()
+        try:
+            return await super().execute(raise_on_error=raise_on_error)
+        finally:
+            registry.histogram('redis_pipeline', REDIS_LATENCY_BUCKETS_MS).observe(time.monotonic() - started)
+
+
+class InstrumentedRedis(Redis):
+    """Клиент Redis с гистограммой задержки по каждой команде."""
+
+    async def execute_command(self, *args, **options):
+        started = time.monotonic()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception as e:
+            registry.counter(f'redis_errors:{type(e).__name__}').inc()
+            raise
+        finally:
+            registry.histogram(f'redis_command:{args[0]}', REDIS_LATENCY_BUCKETS_MS).observe(time.monotonic() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedSyncConnectionPool(redis.BlockingConnectionPool):
+    """Синхронный BlockingConnectionPool с теми же метриками, что и у асинхронного, с суффиксом :sync."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.exhausted = registry.counter('redis_pool_exhausted:sync')
+        self.timeouts = registry.counter('redis_pool_timeouts:sync')
+        self.wait_latency = registry.histogram('redis_pool_wait:sync', REDIS_LATENCY_BUCKETS_MS)
+        # В очереди лежат свободные соединения и None-заглушки ещё не созданных
+        registry.gauge('redis_pool_in_use:sync', lambda: self.max_connections - self.pool.qsize())
+        registry.gauge('redis_pool_max:sync').set(self.max_connections)
+
+    def get_connection(self, command_name, *keys, **options):
+        if not self.pool.empty():
+            return super().get_connection(command_name, *keys, **options)
+        self.exhausted.inc()
+        started = time.monotonic()
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except RedisConnectionError:
+            self.timeouts.inc()
+            raise
+        finally:
+            self.wait_latency.observe(time.monotonic() - started)
+
+
+class InstrumentedSyncRedis(redis.Redis):
+    """Синхронный клиент; команды попадают в те же гистограммы redis_command:*, что и асинхронные."""
+
+    def execute_command(self, *args, **options):
+        started = time.monotonic()
+        try:
+            return super().execute_command(*args, **options)
+        except Exception as e:
+            registry.counter(f'redis_errors:{type(e).__name__}').inc()
+            raise
+        finally:
+            registry.histogram(f'redis_command:{args[0]}', REDIS_LATENCY_BUCKETS_MS).observe(time.monotonic() - started)
+
+
+def create_redis(url: str) -> InstrumentedRedis:
+    """Клиент с общим пулом; создаётся один раз на процесс."""
+    pool = InstrumentedConnectionPool.from_url(
+        url,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        retry_on_timeout=True,
+        retry=Retry(ExponentialBackoff(), REDIS_RETRIES),
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def create_sync_redis(url: str) -> InstrumentedSyncRedis:
+    """
+    Синхронный клиент с теми же настройками пула - для db.py, который вызывается
+    из потоков (asyncio.to_thread), а не в event loop. Отдельный пул: asyncio-соединения
+    нельзя использовать из потоков. Метрики пула - с суффиксом :sync.
+    """
+    pool = InstrumentedSyncConnectionPool.from_url(
+        url,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        retry_on_timeout=True,
+        retry=SyncRetry(ExponentialBackoff(), REDIS_RETRIES),
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return InstrumentedSyncRedis(connection_pool=pool)
@@ -0,0 +1,107 @@
+"""
+HTTP-сессия бота для запросов к Telegram Bot API.
+Лимит соединений и keep-alive настраиваются переменными окружения, а каждый запрос
+замеряется: гистограмма задержки и число одновременных запросов по методу API
+(sendMessage, editMessageText, answerCallbackQuery и т.д.). По ним видно, упирается
+ли рассылка в лимит соединений или в задержку самого Telegram.
+"""
+import asyncio
+import os
+import ssl
+import time
+from typing import TYPE_CHECKING, Optional
+
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram.__meta__ import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from metrics import registry
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+# Максимум одновременных соединений с api.telegram.org
+TELEGRAM_CONNECTION_LIMIT = int(os.getenv("TELEGRAM_CONNECTION_LIMIT", 100))
+# Сколько секунд держать простаивающее соединение открытым (aiohttp по умолчанию - 15)
+TELEGRAM_KEEPALIVE_TIMEOUT = float(os.getenv("TELEGRAM_KEEPALIVE_TIMEOUT", 60))
+# Таймаут запроса к Bot API, секунды
+TELEGRAM_REQUEST_TIMEOUT = int(os.getenv("TELEGRAM_REQUEST_TIMEOUT", 60))
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Замеряет задержку и число одновременных запросов по каждому методу Bot API."""
+
+    def __init__(self):
+        self.in_flight = registry.gauge('telegram_in_flight')
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        method_in_flight = registry.gauge(f'telegram_in_flight:{api_method}')
+        self.in_flight.inc()
+        method_in_flight.inc()
+        started = time.monotonic()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            registry.counter(f'telegram_errors:{api_method}:{type(e).__name__}').inc()
+            raise
+        finally:
+            registry.histogram(f'telegram_request:{api_method}').observe(time.monotonic() - started)
+            method_in_flight.dec()
+            self.in_flight.dec()
+
+
+class TelegramSession(AiohttpSession):
+    """
+    AiohttpSession с собственным TCPConnector: AiohttpSession принимает из его
+    параметров только limit, поэтому ClientSession создаётся здесь целиком.
+    """
+
+    def __init__(
+        self,
+        limit: int = TELEGRAM_CONNECTION_LIMIT,
+        keepalive_timeout: float = TELEGRAM_KEEPALIVE_TIMEOUT,
+        **kwargs,
+    ):
+        super().__init__(limit=limit, **kwargs)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.client_session: Optional[ClientSession] = None
+
+    async def create_session(self) -> ClientSession:
+        if self.client_session is None or self.client_session.closed:
+            self.client_session = ClientSession(
+                connector=TCPConnector(
+                    ssl=self.ssl_context,
+                    limit=self.limit,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=3600,
+                ),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+            )
+        return self.client_session
+
+    async def close(self) -> None:
+        if self.client_session is not None and not self.client_session.closed:
+            await self.client_session.close()
+            # Даём соединениям закрыться до остановки цикла событий
+            await asyncio.sleep(0)
+
+
+def create_session() -> AiohttpSession:
+    session = TelegramSession(timeout=TELEGRAM_REQUEST_TIMEOUT)
+    session.middleware(RequestMetricsMiddleware())
+    registry.gauge('telegram_connection_limit').set(TELEGRAM_CONNECTION_LIMIT)
+    return session
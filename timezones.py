@@ -0,0 +1,19 @@
+"""
+Общий кэш часовых поясов.
+Объекты зон создаются один раз на имя: локальное время пользователя в CRON-задачах
+не требует разбора базы tzdata на каждый вызов.
+"""
+from functools import lru_cache
+
+import pendulum
+
+DEFAULT_TIMEZONE = 'Asia/Almaty'
+
+
+@lru_cache(maxsize=None)
+def get_tz(name: str) -> pendulum.Timezone:
+    return pendulum.timezone(name)
+
+
+def local_now(name: str) -> pendulum.DateTime:
+    return pendulum.now(get_tz(name))
@@ -0,0 +1,103 @@
+"""
+Каталог советов в памяти процесса.
+Таблица tips маленькая и почти не меняется, а читалась на каждое нажатие категории
+(и ORDER BY RANDOM() для случайного совета). Здесь она загружается целиком в
+неизменяемый снимок: кортежи советов по категориям и словарь по id. Любое изменение
+таблицы увеличивает счётчик версии (триггер в init_db); процесс сверяет версию не
+чаще раза в TIPS_VERSION_CHECK_INTERVAL секунд и перечитывает каталог, если она сменилась.
+Сверка идёт в фоновом потоке: читатели получают текущий снимок без обращения к БД.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверять версию каталога с БД, секунды
+TIPS_VERSION_CHECK_INTERVAL = float(os.getenv("TIPS_VERSION_CHECK_INTERVAL", 60))
+
+
+class Tip(NamedTuple):
+    id: int
+    category: str
+    tip: str
+
+
+class TipsSnapshot:
+    """Неизменяемый снимок таблицы tips одной версии."""
+
+    __slots__ = ("version", "all", "by_category", "by_id")
+
+    def __init__(self, version: int, tips: Iterable[Tip]):
+        self.version = version
+        self.all: Tuple[Tip, ...] = tuple(sorted(tips, key=lambda t: t.id))
+        by_category = {}
+        for tip in self.all:
+            by_category.setdefault(tip.category, []).append(tip)
+        self.by_category: Mapping[str, Tuple[Tip, ...]] = MappingProxyType(
+            {category: tuple(items) for category, items in by_category.items()}
+        )
+        self.by_id: Mapping[int, Tip] = MappingProxyType({tip.id: tip for tip in self.all})
+
+    def random(self) -> Optional[Tip]:
+        return random.choice(self.all) if self.all else None
+
+
+class TipsCatalog:
+    """Текущий снимок каталога с перечитыванием по смене версии."""
+
+    def __init__(
+        self,
+        load_version: Callable[[], int],
+        load_tips: Callable[[], Iterable[Tip]],
+        check_interval: float = TIPS_VERSION_CHECK_INTERVAL,
+    ):
+        self.load_version = load_version
+        self.load_tips = load_tips
+        self.check_interval = check_interval
+        self._snapshot: Optional[TipsSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self.reloads = registry.counter('tips_catalog_reloads')
+        registry.gauge('tips_catalog_size', lambda: len(self._snapshot.all) if self._snapshot else 0)
+
+    def refresh(self, force: bool = False) -> TipsSnapshot:
+        """Сверяет версию с БД и перечитывает каталог, если она сменилась."""
+        with self._lock:
+            version = self.load_version()
+            self._checked_at = time.monotonic()
+            if force or self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = TipsSnapshot(version, self.load_tips())
+                self.reloads.inc()
+                logger.info(f"Tips catalog loaded: {len(self._snapshot.all)} tips, version {version}")
+            return self._snapshot
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # БД недоступна: продолжаем отдавать загруженный каталог
+            logger.warning(f"Tips catalog version check failed: {e}")
+            self._checked_at = time.monotonic()
+        finally:
+            self._refreshing.clear()
+
+    def snapshot(self) -> TipsSnapshot:
+        """
+        Текущий снимок без ожидания БД; если пора сверить версию, сверка запускается в фоне.
+        Блокирует только до первой загрузки каталога.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.refresh()
+        if time.monotonic() - self._checked_at >= self.check_interval and not self._refreshing.is_set():
+            self._refreshing.set()
+            threading.Thread(target=self._refresh_in_background, name="tips-catalog-refresh", daemon=True).start()
+        return snapshot
@@ -0,0 +1,66 @@
+"""
+Отбрасывание повторно доставленных апдейтов.
+Telegram повторяет доставку, если вебхук отвечает медленно или с ошибкой, и
+обработчики вроде отметки активности записали бы данные дважды. Недавние update_id
+помнятся в Redis (общий для всех экземпляров SET NX EX) с LRU-кэшем процесса перед ним.
+"""
+import logging
+import os
+from collections import OrderedDict
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд помнить обработанный update_id
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", 3600))
+# Размер локального LRU-кэша update_id
+UPDATE_DEDUP_LOCAL_SIZE = int(os.getenv("UPDATE_DEDUP_LOCAL_SIZE", 10000))
+
+
+class UpdateDeduplicator:
+    """Окно недавних update_id одного бота."""
+
+    def __init__(self, redis, bot_id: int, window: int = UPDATE_DEDUP_WINDOW, local_size: int = UPDATE_DEDUP_LOCAL_SIZE):
+        self.redis = redis
+        self.bot_id = bot_id
+        self.window = window
+        self.local_size = local_size
+        self.local: "OrderedDict[int, None]" = OrderedDict()
+        self.duplicates = registry.counter('webhook_updates_duplicate')
+        self.local_hits = registry.counter('webhook_dedup_local_hits')
+
+    def _key(self, update_id: int) -> str:
+        return f"dedup:{self.bot_id}:{update_id}"
+
+    def _remember(self, update_id: int):
+        self.local[update_id] = None
+        if len(self.local) > self.local_size:
+            self.local.popitem(last=False)
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Отмечает update_id как увиденный. True - он уже встречался в пределах окна."""
+        if update_id in self.local:
+            self.local.move_to_end(update_id)
+            self.local_hits.inc()
+            self.duplicates.inc()
+            return True
+        self._remember(update_id)
+        try:
+            fresh = await self.redis.set(self._key(update_id), 1, nx=True, ex=self.window)
+        except Exception as e:
+            # Без Redis полагаемся только на локальный кэш, но апдейт не теряем
+            logger.warning(f"Update dedup check failed for {update_id}: {e}")
+            return False
+        if not fresh:
+            self.duplicates.inc()
+            return True
+        return False
+
+    async def forget(self, update_id: int):
+        """Снимает отметку, если апдейт не был принят в обработку и Telegram доставит его снова."""
+        self.local.pop(update_id, None)
+        try:
+            await self.redis.delete(self._key(update_id))
+        except Exception as e:
+            logger.warning(f"Failed to forget update {update_id} in dedup window: {e}")
@@ -0,0 +1,164 @@
+"""
+Планировщик входящих апдейтов вебхука.
+Вебхук только проверяет апдейт и передаёт его планировщику, сразу отвечая Telegram 200.
+Апдейты одного пользователя обрабатываются строго по очереди (без гонок на данных FSM
+при быстрых повторных нажатиях), разные пользователи - параллельно, но не более
+WEBHOOK_WORKERS одновременно. При переполнении вебхук отвечает 503, и Telegram
+повторит доставку позже.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from aiogram.types import Update
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов обрабатывается одновременно (по разным пользователям)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+# Максимум ожидающих апдейтов всего; сверх него вебхук отвечает 503
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+# Максимум ожидающих апдейтов одного пользователя
+WEBHOOK_USER_QUEUE_SIZE = int(os.getenv("WEBHOOK_USER_QUEUE_SIZE", 20))
+# Через сколько секунд простоя очередь пользователя удаляется
+WEBHOOK_LANE_IDLE_TTL = float(os.getenv("WEBHOOK_LANE_IDLE_TTL", 30))
+# Значение Retry-After (секунды) в ответе 503
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", 5))
+# Сколько ждать обработки оставшихся апдейтов при остановке
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 10))
+
+
+def update_user_id(update: Update) -> Optional[int]:
+    """id пользователя, от которого пришёл апдейт (None для апдейтов без пользователя)."""
+    try:
+        event = update.event
+    except Exception:
+        return None
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user is not None else None
+
+
+class _Lane:
+    """Упорядоченная очередь апдейтов одного пользователя и задача, которая её разбирает."""
+
+    __slots__ = ("items", "wakeup", "task")
+
+    def __init__(self):
+        self.items: Deque[Tuple[Update, float]] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class UpdateScheduler:
+    """Очереди апдейтов по пользователям с общим ограничением параллельности."""
+
+    def __init__(
+        self,
+        process: Callable[[Update], Awaitable[Any]],
+        workers: int = WEBHOOK_WORKERS,
+        max_pending: int = WEBHOOK_QUEUE_SIZE,
+        max_per_user: int = WEBHOOK_USER_QUEUE_SIZE,
+        idle_ttl: float = WEBHOOK_LANE_IDLE_TTL,
+    ):
+        self.process = process
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.idle_ttl = idle_ttl
+        self.semaphore = asyncio.Semaphore(max(workers, 1))
+        self.lanes: Dict[Any, _Lane] = {}
+        self.pending = 0
+        self.in_flight = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+        self.received = registry.counter('webhook_updates_received')
+        self.rejected = registry.counter('webhook_updates_rejected')
+        self.rejected_user = registry.counter('webhook_updates_rejected_user')
+        self.failed = registry.counter('webhook_updates_failed')
+        self.wait_latency = registry.histogram('webhook_queue_wait')
+        self.handle_latency = registry.histogram('webhook_update_handle')
+        registry.gauge('webhook_queue_depth', lambda: self.pending)
+        registry.gauge('webhook_lanes', lambda: len(self.lanes))
+        registry.gauge('webhook_in_flight', lambda: self.in_flight)
+
+    def put_nowait(self, update: Update) -> bool:
+        """Ставит апдейт в очередь его пользователя. False - очередь переполнена."""
+        if self.pending >= self.max_pending:
+            self.rejected.inc()
+            return False
+        user_id = update_user_id(update)
+        # Апдейты без пользователя не упорядочиваем между собой
+        key = user_id if user_id is not None else ("update", update.update_id)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = _Lane()
+            lane.task = asyncio.create_task(self._drain(key, lane))
+        elif len(lane.items) >= self.max_per_user:
+            self.rejected.inc()
+            self.rejected_user.inc()
+            return False
+        lane.items.append((update, time.monotonic()))
+        lane.wakeup.set()
+        self.pending += 1
+        self._drained.clear()
+        self.received.inc()
+        return True
+
+    async def _drain(self, key: Any, lane: _Lane):
+        while True:
+            if not lane.items:
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), self.idle_ttl)
+                except asyncio.TimeoutError:
+                    if not lane.items:
+                        # Освобождаем память простаивающего пользователя
+                        del self.lanes[key]
+                        return
+                continue
+
+            update, enqueued_at = lane.items.popleft()
+            async with self.semaphore:
+                started = time.monotonic()
+                self.wait_latency.observe(started - enqueued_at)
+                self.in_flight += 1
+                try:
+                    await self.process(update)
+                except Exception as e:
+                    self.failed.inc()
+                    logger.error(f"Error processing webhook update {update.update_id}: {e}", exc_info=True)
+                finally:
+                    self.in_flight -= 1
+                    self.handle_latency.observe(time.monotonic() - started)
+                    self.pending -= 1
+                    if not self.pending:
+                        self._drained.set()
+
+    async def join(self):
+        """Дожидается, пока будут обработаны все поставленные апдейты."""
+        await self._drained.wait()
+
+    async def stop(self, timeout: Optional[float] = WEBHOOK_DRAIN_TIMEOUT) -> bool:
+        """
+        Дожидается обработки ожидающих апдейтов (не дольше timeout) и останавливает очереди.
+        Возвращает True, если все апдейты успели обработаться.
+        """
+        drained = True
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            drained = False
+            logger.warning(f"Webhook queue not drained on shutdown, {self.pending} updates dropped")
+        tasks = [lane.task for lane in self.lanes.values() if lane.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.lanes.clear()
+        self.pending = 0
+        self._drained.set()
+        return drained
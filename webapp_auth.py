@@ -0,0 +1,126 @@
+"""
+Проверка initData Telegram Web App.
+Секретный ключ HMAC("WebAppData", BOT_TOKEN) вычисляется один раз при создании
+проверяющего, а не на каждый запрос. Мини-приложение шлёт одну и ту же строку
+initData со всеми запросами сессии, поэтому уже проверенные строки запоминаются
+на INIT_DATA_CACHE_TTL секунд: повторный запрос - поиск в словаре без разбора и HMAC.
+initData старше INIT_DATA_MAX_AGE секунд (по auth_date) отклоняется, в том числе из кэша.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Максимальный возраст initData по auth_date, секунды
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", 86400))
+# Сколько секунд помнить проверенную строку initData
+INIT_DATA_CACHE_TTL = float(os.getenv("INIT_DATA_CACHE_TTL", 300))
+# Сколько проверенных строк держать в памяти процесса
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", 10000))
+
+
+def derive_secret_key(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+class InitDataValidator:
+    """
+    Проверяет подпись initData и возвращает данные пользователя (dict с 'id') или None.
+    В кэш попадают только успешно проверенные строки: ключ - строка целиком, поэтому
+    подменить в ней user при том же hash нельзя.
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        max_age: int = INIT_DATA_MAX_AGE,
+        cache_ttl: float = INIT_DATA_CACHE_TTL,
+        cache_size: int = INIT_DATA_CACHE_SIZE,
+    ):
+        self.secret_key = derive_secret_key(bot_token)
+        self.max_age = max_age
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # initData -> (срок жизни записи по time.time(), данные пользователя)
+        self.cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.cache_hits = registry.counter('init_data_cache_hits')
+        self.verified = registry.counter('init_data_verified')
+        registry.gauge('init_data_cache_size', lambda: len(self.cache))
+
+    def _reject(self, reason: str) -> None:
+        registry.counter(f'init_data_rejected:{reason}').inc()
+        return None
+
+    def _cached(self, init_data: str, now: float) -> Optional[Dict]:
+        with self.lock:
+            entry = self.cache.get(init_data)
+            if entry is None:
+                return None
+            expires_at, user_data = entry
+            if expires_at <= now:
+                del self.cache[init_data]
+                return None
+            self.cache.move_to_end(init_data)
+            return user_data
+
+    def _remember(self, init_data: str, user_data: Dict, expires_at: float):
+        with self.lock:
+            self.cache[init_data] = (expires_at, user_data)
+            self.cache.move_to_end(init_data)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def verify(self, init_data: str, now: Optional[float] = None) -> Optional[Tuple[Dict, int]]:
+        """Полная проверка без кэша: подпись, auth_date и наличие user.id. Возвращает (user, auth_date)."""
+        now = time.time() if now is None else now
+        parsed_data = dict(parse_qsl(init_data))
+        received_hash = parsed_data.pop('hash', None)
+        if not received_hash:
+            return self._reject('no_hash')
+
+        data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(parsed_data.items()))
+        calculated_hash = hmac.new(self.secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(calculated_hash, received_hash):
+            return self._reject('bad_hash')
+
+        try:
+            auth_date = int(parsed_data['auth_date'])
+        except (KeyError, ValueError):
+            return self._reject('no_auth_date')
+        if now - auth_date > self.max_age:
+            return self._reject('expired')
+
+        user_data = json.loads(parsed_data.get('user', '{}'))
+        if 'id' not in user_data:
+            return self._reject('no_user')
+        self.verified.inc()
+        return user_data, auth_date
+
+    def validate(self, init_data: str) -> Optional[Dict]:
+        now = time.time()
+        user_data = self._cached(init_data, now)
+        if user_data is not None:
+            self.cache_hits.inc()
+            return dict(user_data)
+        try:
+            verified = self.verify(init_data, now)
+        except Exception as e:
+            logger.error(f"Could not validate initData: {e}")
+            return self._reject('malformed')
+        if verified is None:
+            return None
+        user_data, auth_date = verified
+        # Запись не переживает срок годности самой initData
+        self._remember(init_data, user_data, min(now + self.cache_ttl, auth_date + self.max_age))
+        return dict(user_data)